@@ -8,6 +8,26 @@ AIチャットボットモジュール
 - sentence_transformersライブラリは初回呼び出し時にインポート
 - SentenceTransformerモデルは初回呼び出し時にロード
 - 埋め込みデータは初回呼び出し時にロード
+  （埋め込みインデックスがあればメモリマップで読み込み、なければDBから読み込み）
+- 埋め込みは正規化済みの連続したfloat32行列として保持し、
+  検索は行列とクエリの積1回と上位k件の部分選択で行う
+  （ANNインデックスがあれば近似検索で調べる行を絞り込み、
+  量子化インデックスがあればint8のコードで候補を絞り込んでから計算し直す）
+- データベースモードでは、ベクトル検索とキーワード検索（FTS5）を並行して実行し、
+  順位をRRFで統合する（日本語の固有名詞や完全一致の語を含むメッセージを補う）
+- チャンネル・カテゴリ・重要度・期間での絞り込みは、類似度の計算前に
+  対象の行を選んでおき、その行だけを計算する
+- データベースモードでは、バックグラウンドのスレッドがDBの埋め込み世代番号を
+  定期的に確認し、追加・削除された埋め込みだけを読み込んで検索に反映する
+  （知識データは一時点の状態ごと置き換えるため、実行中の検索には影響しない）
+- クエリの埋め込みは正規化した質問文ごとにLRUキャッシュで保持し、
+  同じ質問ではモデルでの計算を省く（モデルを読み込み直した場合は破棄）
+- 複数の質問をまとめて検索する場合（search_similar_messages）は、
+  埋め込みを1回のバッチで生成し、類似度を行列同士の積でまとめて計算する
+- ベクトル検索の候補は、コサイン類似度に新しさ（時間の経過による減衰）と
+  重要度の重みを加えたスコアで並べ替える
+- 検索結果は多めに取得した候補からMMRで選び直し、ほぼ同じメッセージが
+  LLMに渡す枠を埋めないようにする
 - 2回目以降の呼び出しではキャッシュされたデータを使用
 
 この設計により、モジュールのインポートは即座に完了し、
@@ -16,10 +36,51 @@ Bot起動時間が大幅に短縮されます。
 
 import json
 import os
+import sqlite3
 import threading
-
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from diversity import (
+    get_diversity_lambda,
+    get_duplicate_threshold,
+    is_diversity_enabled,
+    mmr_select,
+)
+from embedding_index import (
+    INDEX_DIR,
+    EmbeddingIndex,
+    IndexMetadata,
+    normalize_rows,
+    read_manifest,
+)
 from gemini_config import create_generative_model
+from hybrid_search import (
+    SearchTimings,
+    candidate_count,
+    get_lexical_timeout,
+    get_lexical_weight,
+    get_rrf_k,
+    get_vector_weight,
+    reciprocal_rank_fusion,
+)
 from knowledge_db import KnowledgeDB
+from live_index import (
+    IndexSnapshot,
+    get_refresh_interval,
+    load_index_snapshot,
+    refresh_snapshot,
+)
+from query_cache import QueryEmbeddingCache, get_query_cache_size
+from ranking_weights import (
+    get_importance_weight,
+    get_recency_half_life_days,
+    get_recency_weight,
+    rerank,
+)
 
 EMBED_PATH = os.path.join(os.path.dirname(__file__), "../data/embeddings.json")
 DB_PATH = os.path.join(os.path.dirname(__file__), "../data/knowledge.db")
@@ -29,8 +90,9 @@ USE_JSON_FALLBACK = os.environ.get("USE_JSON_FALLBACK", "false").lower() == "tru
 
 # 遅延ロード用のグローバル変数（キャッシュ）
 _model = None
-_texts = None
-_embeddings = None
+# 知識データ（埋め込みインデックスとANN・量子化インデックス、起動後の差分）
+# 更新時は新しいIndexSnapshotに置き換えるため、検索中は最初に取得した参照を使う
+_snapshot = None
 _prompts = None
 _cached_additional_role = None  # キャッシュされた追加役割の値
 _gemini_model = None  # Gemini APIモデルのキャッシュ
@@ -42,6 +104,13 @@ _init_lock = threading.Lock()
 _llm_success_lock = threading.Lock()  # LLM成功メッセージ表示用ロック
 # データベースインスタンス（クリーンアップはガベージコレクションを介して自動的に行われる）
 _db = None
+# キーワード検索をクエリの埋め込み生成と並行して実行するスレッド
+_lexical_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lexical")
+# 知識データの更新（差分の反映）を直列化するロックと、更新スレッド
+_refresh_lock = threading.Lock()
+_refresh_thread = None
+# クエリの埋め込みのLRUキャッシュ（QUERY_CACHE_SIZE件まで）
+_query_cache = QueryEmbeddingCache(get_query_cache_size())
 
 
 def is_initialized():
@@ -54,6 +123,105 @@ def is_initialized():
     return _initialized
 
 
+def _load_knowledge_from_db():
+    """
+    データベースモードの知識データをロード
+
+    最新の埋め込みインデックス（prepare_dataset.pyが作成）があれば
+    メモリマップで読み込み、ない場合や古い場合はDBから読み込みます。
+
+    Returns:
+        tuple: (db, snapshot)
+            snapshotは埋め込みインデックスと対応するANN・量子化インデックス
+            （ない場合はNone）をまとめたIndexSnapshot
+
+    Raises:
+        FileNotFoundError: 埋め込みデータが存在しない場合
+    """
+    db = KnowledgeDB(DB_PATH)
+
+    snapshot = load_index_snapshot(db, INDEX_DIR)
+    if snapshot is not None:
+        print(f"✅ 埋め込みインデックスを読み込みました: {len(snapshot)}件")
+        if snapshot.ann_index is not None:
+            print(f"✅ ANNインデックスを読み込みました: {snapshot.ann_index.nlist}リスト")
+        if snapshot.quantized_index is not None:
+            print("✅ 量子化インデックス（int8）を読み込みました")
+        return db, snapshot
+
+    if read_manifest(INDEX_DIR) is not None:
+        print("⚠️ 埋め込みインデックスが古いため、データベースから読み込みます")
+
+    # 読み込み中に追加された埋め込みは、次回の更新で重ねて反映される
+    generation = db.get_embedding_generation()
+    ids = []
+    texts = []
+    vectors = []
+    metadata = []
+    for message_id, content, vector, row_metadata in db.iter_embeddings(
+        with_metadata=True
+    ):
+        ids.append(message_id)
+        texts.append(content)
+        vectors.append(vector)
+        metadata.append(row_metadata)
+    if not texts:
+        raise FileNotFoundError(
+            f"埋め込みデータが見つかりません: {DB_PATH}\n"
+            "prepare_dataset.pyを実行してデータを生成してください。"
+        )
+    index = EmbeddingIndex(
+        np.array(ids, dtype=np.int64),
+        normalize_rows(np.vstack(vectors)),
+        texts,
+        {},
+        IndexMetadata.from_rows(metadata),
+    )
+    return db, IndexSnapshot(index, generation=generation)
+
+
+def _load_model_and_data():
+    """
+    埋め込みモデルと知識データをロード
+
+    Returns:
+        tuple: (model, db, snapshot)
+            JSONモードではdbはNone、snapshotのメッセージIDは行番号
+
+    Raises:
+        FileNotFoundError: EMBED_PATHまたはDB_PATHが存在しない場合
+        json.JSONDecodeError: JSONファイルの解析に失敗した場合
+    """
+    # sentence_transformersを遅延インポート（起動時間の最適化）
+    from sentence_transformers import SentenceTransformer
+
+    # モデルのロード
+    model = SentenceTransformer("all-MiniLM-L6-v2")
+
+    # データベースまたはJSONからデータをロード
+    use_db = os.path.exists(DB_PATH) and not USE_JSON_FALLBACK
+
+    if use_db:
+        # データベースモード
+        db, snapshot = _load_knowledge_from_db()
+        return model, db, snapshot
+
+    # JSONモード（後方互換）
+    if not os.path.exists(EMBED_PATH):
+        raise FileNotFoundError(
+            f"埋め込みデータが見つかりません: {EMBED_PATH}\n"
+            "prepare_dataset.pyを実行してデータを生成してください。"
+        )
+
+    with open(EMBED_PATH, "r") as f:
+        dataset = json.load(f)
+
+    texts = [item["text"] for item in dataset]
+    embeddings = normalize_rows(np.array([item["embedding"] for item in dataset]))
+    index = EmbeddingIndex(np.arange(len(texts)), embeddings, texts, {})
+    return model, None, IndexSnapshot(index)
+
+
 def ensure_initialized_with_callback(callback=None):
     """
     初期化を実行し、コールバックを通じて初回初期化かどうかを通知する
@@ -72,7 +240,7 @@ def ensure_initialized_with_callback(callback=None):
         json.JSONDecodeError: JSONファイルの解析に失敗した場合
         Exception: モデルのロードに失敗した場合
     """
-    global _model, _texts, _embeddings, _initialized, _db
+    global _model, _snapshot, _initialized, _db
 
     # 既に初期化済み
     if _initialized:
@@ -89,40 +257,9 @@ def ensure_initialized_with_callback(callback=None):
             callback()
 
         try:
-            # sentence_transformersを遅延インポート（起動時間の最適化）
-            from sentence_transformers import SentenceTransformer
-
-            # モデルのロード
-            _model = SentenceTransformer("all-MiniLM-L6-v2")
-
-            # データベースまたはJSONからデータをロード
-            use_db = os.path.exists(DB_PATH) and not USE_JSON_FALLBACK
-
-            if use_db:
-                # データベースモード
-                _db = KnowledgeDB(DB_PATH)
-                _texts, _embeddings = _db.get_all_embeddings()
-
-                if not _texts:
-                    raise FileNotFoundError(
-                        f"埋め込みデータが見つかりません: {DB_PATH}\n"
-                        "prepare_dataset.pyを実行してデータを生成してください。"
-                    )
-            else:
-                # JSONモード（後方互換）
-                if not os.path.exists(EMBED_PATH):
-                    raise FileNotFoundError(
-                        f"埋め込みデータが見つかりません: {EMBED_PATH}\n"
-                        "prepare_dataset.pyを実行してデータを生成してください。"
-                    )
-
-                with open(EMBED_PATH, "r") as f:
-                    dataset = json.load(f)
-
-                _texts = [item["text"] for item in dataset]
-                _embeddings = [item["embedding"] for item in dataset]
-
+            _model, _db, _snapshot = _load_model_and_data()
             _initialized = True
+            _start_refresh_thread()
             return False  # 初回初期化完了
         except json.JSONDecodeError as e:
             raise Exception(f"JSONファイルの解析に失敗しました: {str(e)}") from e
@@ -142,7 +279,7 @@ def _ensure_initialized():
         json.JSONDecodeError: JSONファイルの解析に失敗した場合
         Exception: モデルのロードに失敗した場合
     """
-    global _model, _texts, _embeddings, _initialized, _db
+    global _model, _snapshot, _initialized, _db
 
     # 初期チェック（ロックなし）- パフォーマンス最適化
     if _initialized:
@@ -155,40 +292,9 @@ def _ensure_initialized():
             return
 
         try:
-            # sentence_transformersを遅延インポート（起動時間の最適化）
-            from sentence_transformers import SentenceTransformer
-
-            # モデルのロード
-            _model = SentenceTransformer("all-MiniLM-L6-v2")
-
-            # データベースまたはJSONからデータをロード
-            use_db = os.path.exists(DB_PATH) and not USE_JSON_FALLBACK
-
-            if use_db:
-                # データベースモード
-                _db = KnowledgeDB(DB_PATH)
-                _texts, _embeddings = _db.get_all_embeddings()
-
-                if not _texts:
-                    raise FileNotFoundError(
-                        f"埋め込みデータが見つかりません: {DB_PATH}\n"
-                        "prepare_dataset.pyを実行してデータを生成してください。"
-                    )
-            else:
-                # JSONモード（後方互換）
-                if not os.path.exists(EMBED_PATH):
-                    raise FileNotFoundError(
-                        f"埋め込みデータが見つかりません: {EMBED_PATH}\n"
-                        "prepare_dataset.pyを実行してデータを生成してください。"
-                    )
-
-                with open(EMBED_PATH, "r") as f:
-                    dataset = json.load(f)
-
-                _texts = [item["text"] for item in dataset]
-                _embeddings = [item["embedding"] for item in dataset]
-
+            _model, _db, _snapshot = _load_model_and_data()
             _initialized = True
+            _start_refresh_thread()
         except FileNotFoundError:
             raise
         except json.JSONDecodeError as e:
@@ -382,27 +488,267 @@ def generate_response_with_llm(query, similar_messages):
     return None, last_error_message if last_error_message else error_msg
 
 
-# ユーザーの質問に最も近いメッセージを検索
+def refresh_knowledge():
+    """
+    知識データの追加・削除を検索に反映（データベースモードのみ）
 
+    前回の反映以降の差分だけをDBから読み込み、新しいIndexSnapshotに置き換えます。
+    prepare_dataset.pyで最新の埋め込みインデックスが作成されていれば読み込み直します。
 
-def search_similar_message(query, top_k=3):
+    Returns:
+        bool: 知識データを置き換えた場合True
+    """
+    global _snapshot
+
+    if _db is None or _snapshot is None:
+        return False
+
+    with _refresh_lock:
+        snapshot = refresh_snapshot(_db, _snapshot, INDEX_DIR)
+        if snapshot is None:
+            return False
+        _snapshot = snapshot
+
+    delta_count = len(snapshot.delta_rows)
+    print(f"🔄 知識データを更新しました: {len(snapshot)}件（起動後の差分: {delta_count}件）")
+    return True
+
+
+def _refresh_loop(interval):
+    """INDEX_REFRESH_INTERVAL秒ごとに知識データの差分を反映"""
+    while True:
+        time.sleep(interval)
+        try:
+            refresh_knowledge()
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print(f"⚠️ 知識データの更新に失敗しました: {e}")
+
+
+def _start_refresh_thread():
+    """知識データの更新スレッドを開始（データベースモードで間隔が0より大きい場合）"""
+    global _refresh_thread
+
+    interval = get_refresh_interval()
+    if _db is None or interval <= 0 or _refresh_thread is not None:
+        return
+    _refresh_thread = threading.Thread(
+        target=_refresh_loop, args=(interval,), name="knowledge-refresh", daemon=True
+    )
+    _refresh_thread.start()
+
+
+def get_query_cache_stats():
+    """
+    クエリの埋め込みキャッシュの状態を返す
+
+    Returns:
+        dict: size（件数）, maxsize（上限）, hits, misses, hit_rate（ヒット率）
+    """
+    return _query_cache.stats()
+
+
+def _search_lexical(query, limit, filters, timings):
+    """キーワード検索（FTS5のOR検索、BM25の高い順のメッセージID）"""
+    with timings.measure("lexical"):
+        results = _db.search_text(query, limit, filters=filters, match_all=False)
+    return [message_id for message_id, _ in results]
+
+
+def search_similar_message(query, top_k=3, filters=None):
+    """
+    ユーザーの質問に最も近いメッセージを検索
+
+    データベースモードでは、キーワード検索をクエリの埋め込み生成・ベクトル検索と
+    並行して実行し、両方の順位をRRFで統合します（HYBRID_LEXICAL_WEIGHT=0で無効）。
+    キーワード検索がHYBRID_LEXICAL_TIMEOUT秒以内に終わらない場合や失敗した場合は
+    ベクトル検索のみの結果を返します。
+    ベクトル検索の候補は新しさと重要度の重みを加えて並べ替えます
+    （RECENCY_WEIGHT・IMPORTANCE_WEIGHT、JSONモードでは行わない）。
+    多めに取得した候補からMMRで結果を選び、ほぼ同じメッセージを除きます
+    （DIVERSITY_LAMBDA=1かつDUPLICATE_THRESHOLDが1より大きい場合は無効）。
+    段階ごとの所要時間をログに出力します。
+
+    Args:
+        query: ユーザーからの入力メッセージ
+        top_k: 取得件数
+        filters: 絞り込み条件の辞書（省略時は全て、データベースモードのみ）
+            - channel_id: チャンネルID
+            - category: カテゴリ
+            - min_importance: 最小重要度
+            - since: この時刻（Unix時間）以降
+            - until: この時刻（Unix時間）より前
+
+    Returns:
+        類似メッセージの本文のリスト（関連度の高い順）
+
+    Raises:
+        ValueError: JSONモードで絞り込み条件を指定した場合、
+            または未対応の絞り込み条件が指定された場合
+    """
     _ensure_initialized()
-    # utilを遅延インポート
-    from sentence_transformers import util
 
-    query_emb = _model.encode(query)
-    scores = util.cos_sim(query_emb, _embeddings)[0]
-    top_results = scores.argsort(descending=True)[:top_k]
-    return [_texts[i] for i in top_results]
+    # 検索中に知識データが更新されても、同じ時点の状態を参照する
+    snapshot = _snapshot
+
+    timings = SearchTimings()
+    selection = None
+    if filters:
+        with timings.measure("filter"):
+            selection = snapshot.select_rows(filters)
+
+    limit = candidate_count(top_k)
+    diversity_lambda = get_diversity_lambda()
+    duplicate_threshold = get_duplicate_threshold()
+    diversify = is_diversity_enabled(diversity_lambda, duplicate_threshold)
+    recency_weight = get_recency_weight()
+    importance_weight = get_importance_weight()
+    weighted = snapshot.index.metadata is not None and (
+        recency_weight > 0 or importance_weight > 0
+    )
+
+    lexical_weight = get_lexical_weight()
+    lexical = None
+    if _db is not None and lexical_weight > 0:
+        lexical = _lexical_executor.submit(
+            _search_lexical, query, limit, filters, timings
+        )
+
+    with timings.measure("encode"):
+        query_emb = _query_cache.encode(_model, query)
+    with timings.measure("vector"):
+        # 統合・重み付け・多様化する場合は候補を多めに取得
+        fetch = limit if lexical is not None or weighted or diversify else top_k
+        rows, scores = snapshot.search(query_emb, fetch, selection)
+
+    if weighted:
+        with timings.measure("weighting"):
+            timestamps, importance = snapshot.row_metadata(rows)
+            rows, scores = rerank(
+                rows,
+                scores,
+                timestamps,
+                importance,
+                time.time(),
+                recency_weight,
+                get_recency_half_life_days(),
+                importance_weight,
+            )
+
+    if lexical is None:
+        if diversify:
+            with timings.measure("diversity"):
+                chosen = mmr_select(
+                    snapshot.vectors(rows),
+                    scores,
+                    top_k,
+                    diversity_lambda,
+                    duplicate_threshold,
+                )
+                rows = rows[chosen]
+        results = [snapshot.text(i) for i in rows[:top_k]]
+    else:
+        with timings.measure("wait"):
+            # キーワード検索が遅れている場合は待たずにベクトル検索の結果のみを使う
+            try:
+                lexical_ids = lexical.result(timeout=get_lexical_timeout())
+            except FutureTimeoutError:
+                timings.note("キーワード検索がタイムアウトしたためベクトル検索のみ")
+                lexical_ids = []
+            except sqlite3.Error as e:
+                print(f"⚠️ キーワード検索に失敗しました: {e}")
+                timings.note("キーワード検索に失敗したためベクトル検索のみ")
+                lexical_ids = []
+
+        with timings.measure("fusion"):
+            texts_by_id = {snapshot.message_id(i): snapshot.text(i) for i in rows}
+            fused = reciprocal_rank_fusion(
+                [list(texts_by_id), lexical_ids],
+                [get_vector_weight(), lexical_weight],
+                get_rrf_k(),
+            )[: limit if diversify else top_k]
+            fused_ids = [message_id for message_id, _ in fused]
+
+        if diversify:
+            with timings.measure("diversity"):
+                chosen = mmr_select(
+                    snapshot.vectors_for_ids(fused_ids),
+                    [score for _, score in fused],
+                    top_k,
+                    diversity_lambda,
+                    duplicate_threshold,
+                )
+                fused_ids = [fused_ids[i] for i in chosen]
+
+        with timings.measure("fusion"):
+            # キーワード検索のみで見つかったメッセージの本文を取得
+            missing = [i for i in fused_ids if i not in texts_by_id]
+            texts_by_id.update(_db.get_message_contents(missing))
+            results = [texts_by_id[i] for i in fused_ids if i in texts_by_id]
+
+    timings.finish()
+    print(f"🔎 類似メッセージ検索: {timings.summary()}")
+    return results
+
+
+def search_similar_messages(queries, top_k=3, filters=None):
+    """
+    複数の質問それぞれに最も近いメッセージをまとめて検索（ベクトル検索のみ）
+
+    評価用のスクリプトやテストなど、多数の質問を一度に検索する用途向けです。
+    質問の埋め込みはモデルの1回のバッチで生成し、類似度は埋め込みの行列と
+    質問の行列の積でまとめて計算します（ANN・量子化インデックスがある場合は
+    質問ごとに検索します）。キーワード検索とのRRFによる統合は行いません。
+
+    Args:
+        queries: ユーザーからの入力メッセージのリスト
+        top_k: 質問ごとの取得件数
+        filters: 絞り込み条件の辞書（search_similar_messageと同じ、全ての質問に適用）
+
+    Returns:
+        質問ごとの(メッセージID, コサイン類似度)のリスト（類似度の高い順）。
+        JSONモードではメッセージIDの代わりに埋め込みの行番号
+
+    Raises:
+        ValueError: JSONモードで絞り込み条件を指定した場合、
+            または未対応の絞り込み条件が指定された場合
+    """
+    _ensure_initialized()
+
+    queries = list(queries)
+    if not queries:
+        return []
+
+    snapshot = _snapshot
+
+    timings = SearchTimings()
+    selection = None
+    if filters:
+        with timings.measure("filter"):
+            selection = snapshot.select_rows(filters)
+
+    with timings.measure("encode"):
+        query_embs = _query_cache.encode_batch(_model, queries)
+    with timings.measure("vector"):
+        found = snapshot.search_batch(query_embs, top_k, selection)
+
+    results = [
+        [(snapshot.message_id(i), float(score)) for i, score in zip(rows, scores)]
+        for rows, scores in found
+    ]
+
+    timings.finish()
+    print(f"🔎 類似メッセージ検索（{len(queries)}件）: {timings.summary()}")
+    return results
 
 
-def generate_response(query, top_k=5):
+def generate_response(query, top_k=5, filters=None):
     """
     クエリに対して、LLM APIを使用して過去の知識を基に返信を生成
 
     Args:
         query: ユーザーからの入力メッセージ
         top_k: 参考にする類似メッセージの数
+        filters: 類似メッセージの絞り込み条件（search_similar_messageと同じ）
 
     Returns:
         生成された返信文字列
@@ -421,7 +767,7 @@ def generate_response(query, top_k=5):
         )
 
     # 類似メッセージを検索
-    similar_messages = search_similar_message(query, top_k)
+    similar_messages = search_similar_message(query, top_k, filters)
 
     # 類似メッセージが見つからない場合
     if not similar_messages:
@@ -0,0 +1,420 @@
+"""
+近似最近傍（ANN）インデックスモジュール
+
+埋め込みインデックス（embedding_index.py）の正規化済み行列に対する、
+転置ファイル（IVF）方式の近似検索インデックスを作成・読み込みします。
+
+- 作成: 球面k-meansで埋め込みをnlist個のクラスタに分け、
+  各行の所属クラスタ（転置リスト）を記録します
+- 検索: クエリに近い重心のnprobe個のリストに含まれる行だけを厳密に計算します。
+  nprobeを増やすほど再現率が上がり、検索時間が長くなります
+- 増分更新: 学習済みの重心を再利用し、新しい埋め込み（または本文の編集で
+  埋め込みが変わった行）だけをクラスタに割り当てます。
+  件数が学習時のRETRAIN_GROWTH倍を超えた場合は重心を学習し直します
+
+ファイル構成（埋め込みインデックスと同じディレクトリ）:
+- ivf_centroids.npy: 正規化済みの重心（nlist×次元数）
+- ivf_offsets.npy / ivf_rows.npy: 転置リスト（リストごとの行番号の連結と開始位置）
+- ivf_assign_ids.npy / ivf_assign_lists.npy / ivf_assign_keys.npy:
+  メッセージIDごとの所属リストとベクトルの照合用の値（増分更新用、ID順）
+- ivf.json: 学習時の件数・対応する埋め込みインデックスの件数と世代番号など
+"""
+
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from embedding_index import normalize_rows, score_rows, top_k_indices
+
+# ANNインデックスの形式バージョン（互換性のない変更時に更新）
+ANN_FORMAT_VERSION = 1
+
+ANN_MANIFEST_FILE = "ivf.json"
+CENTROIDS_FILE = "ivf_centroids.npy"
+OFFSETS_FILE = "ivf_offsets.npy"
+ROWS_FILE = "ivf_rows.npy"
+ASSIGN_IDS_FILE = "ivf_assign_ids.npy"
+ASSIGN_LISTS_FILE = "ivf_assign_lists.npy"
+ASSIGN_KEYS_FILE = "ivf_assign_keys.npy"
+
+# この件数未満の場合はANNインデックスを作成しない（全件検索で十分高速）
+DEFAULT_ANN_MIN_VECTORS = 50_000
+
+# 検索時に調べるリスト数の既定値
+DEFAULT_NPROBE = 16
+
+# 件数が学習時のこの倍数を超えたら重心を学習し直す
+RETRAIN_GROWTH = 2.0
+
+# k-meansの学習に使う1クラスタあたりの最大サンプル数と反復回数
+TRAIN_SAMPLES_PER_LIST = 64
+KMEANS_ITERATIONS = 10
+
+# 所属リストの計算で一度に処理する行数
+ASSIGN_CHUNK_ROWS = 16_384
+
+
+def get_ann_min_vectors() -> int:
+    """環境変数ANN_MIN_VECTORS（ANNインデックスを作成する最小件数）を取得"""
+    value = os.environ.get("ANN_MIN_VECTORS", "")
+    return int(value) if value.strip() else DEFAULT_ANN_MIN_VECTORS
+
+
+def get_ann_nlist(count: int) -> int:
+    """
+    環境変数ANN_NLIST（リスト数）を取得
+
+    未指定の場合は件数の平方根（1リストあたり約√N件）とします。
+    """
+    value = os.environ.get("ANN_NLIST", "")
+    if value.strip():
+        return max(1, min(int(value), count))
+    return max(1, int(np.sqrt(count)))
+
+
+def get_ann_nprobe() -> int:
+    """環境変数ANN_NPROBE（検索時に調べるリスト数）を取得"""
+    value = os.environ.get("ANN_NPROBE", "")
+    return max(1, int(value)) if value.strip() else DEFAULT_NPROBE
+
+
+def vector_keys(vectors: np.ndarray) -> np.ndarray:
+    """
+    ベクトルが変わったかを照合するための値（各行の成分の合計）
+
+    本文の編集で埋め込みが再生成された行を検出するために使います。
+    """
+    keys = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_ROWS):
+        end = min(start + ASSIGN_CHUNK_ROWS, len(vectors))
+        keys[start:end] = np.asarray(vectors[start:end]).sum(axis=1)
+    return keys
+
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    各行を最も近い重心のリストに割り当てる
+
+    Args:
+        vectors: 正規化済みの行列
+        centroids: 正規化済みの重心
+
+    Returns:
+        各行の所属リスト（int32）
+    """
+    lists = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_ROWS):
+        end = min(start + ASSIGN_CHUNK_ROWS, len(vectors))
+        scores = np.asarray(vectors[start:end]) @ centroids.T
+        lists[start:end] = np.argmax(scores, axis=1)
+    return lists
+
+
+def train_centroids(
+    vectors: np.ndarray, nlist: int, seed: int = 0, iterations: int = KMEANS_ITERATIONS
+) -> np.ndarray:
+    """
+    球面k-meansで重心を学習
+
+    学習にはnlist×TRAIN_SAMPLES_PER_LIST件までの無作為な標本を使います。
+
+    Args:
+        vectors: 正規化済みの行列
+        nlist: 重心の数
+        seed: 乱数シード
+        iterations: 反復回数
+
+    Returns:
+        正規化済みの重心（nlist×次元数のfloat32行列）
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * TRAIN_SAMPLES_PER_LIST)
+    sample_rows = np.sort(rng.choice(len(vectors), sample_size, replace=False))
+    sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(iterations):
+        lists = assign_lists(sample, centroids)
+        counts = np.bincount(lists, minlength=nlist)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        # クラスタ順に並べた標本を区間ごとに合計する
+        sums = np.empty_like(centroids)
+        filled = counts > 0
+        sorted_sample = sample[np.argsort(lists, kind="stable")]
+        sums[filled] = np.add.reduceat(sorted_sample, starts[filled], axis=0)
+
+        # 空になったクラスタは標本から選び直す
+        empty = np.flatnonzero(~filled)
+        sums[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+        centroids = normalize_rows(sums)
+
+    return centroids
+
+
+class IVFIndex:
+    """転置ファイル方式の近似最近傍インデックス"""
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        offsets: np.ndarray,
+        rows: np.ndarray,
+        manifest: Dict,
+    ):
+        """
+        Args:
+            centroids: 正規化済みの重心
+            offsets: 各リストの開始位置（nlist+1要素）
+            rows: リストごとに並べた行番号
+            manifest: ivf.jsonの内容
+        """
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+        self.manifest = manifest
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def search(
+        self,
+        vectors: np.ndarray,
+        query: np.ndarray,
+        top_k: int,
+        nprobe: Optional[int] = None,
+        quantized=None,
+        rows: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        クエリとのコサイン類似度が高い順にtop_k件を近似検索
+
+        Args:
+            vectors: インデックス作成時と同じ正規化済みの行列
+            query: クエリの埋め込み（正規化は不要）
+            top_k: 取得件数
+            nprobe: 調べるリスト数（省略時は環境変数ANN_NPROBEまたは既定値）
+            quantized: 量子化インデックス（Int8Index）。指定した場合は、
+                調べる行の近似スコアで候補を絞り込んでから厳密に計算する
+            rows: 絞り込み条件に一致する行の位置（昇順、Noneの場合は全行）。
+                調べるリストの行数の見込みより少ない場合は全て計算し、
+                それ以外の場合は調べるリストの行のうち一致する行だけを計算する
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (行の位置, コサイン類似度)
+        """
+        query = normalize_rows(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        nprobe = min(nprobe or get_ann_nprobe(), self.nlist)
+
+        if rows is not None and len(rows) * self.nlist <= len(vectors) * nprobe:
+            # 絞り込んだ行の方が少ないため、リストを使わずに全て計算する
+            candidates = rows
+        else:
+            probes = top_k_indices(self.centroids @ query, nprobe)
+            candidates = np.concatenate(
+                [self.rows[self.offsets[i] : self.offsets[i + 1]] for i in probes]
+            )
+            # メモリマップからの読み込みが前から順になるよう並べる
+            candidates.sort()
+            if rows is not None:
+                candidates = np.intersect1d(candidates, rows, assume_unique=True)
+                if len(candidates) < top_k:
+                    # 調べたリストに一致する行が足りない場合は全て計算する
+                    candidates = rows
+
+        if quantized is not None:
+            return quantized.search(vectors, query, top_k, rows=candidates)
+
+        scores = score_rows(vectors, candidates, query)
+        best = top_k_indices(scores, top_k)
+        return candidates[best], scores[best]
+
+
+def _save_npy(path: str, array: np.ndarray):
+    """拡張子を付け足さずに.npyファイルを保存"""
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
+def read_ann_manifest(index_dir: str) -> Optional[Dict]:
+    """ivf.jsonを読み込む（存在しない・読み込めない場合はNone）"""
+    path = os.path.join(index_dir, ANN_MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def remove_ann_index(index_dir: str):
+    """ANNインデックスのファイルを削除"""
+    for name in (
+        ANN_MANIFEST_FILE,
+        CENTROIDS_FILE,
+        OFFSETS_FILE,
+        ROWS_FILE,
+        ASSIGN_IDS_FILE,
+        ASSIGN_LISTS_FILE,
+        ASSIGN_KEYS_FILE,
+    ):
+        path = os.path.join(index_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _load_previous_assignments(index_dir: str, dim: int):
+    """増分更新に使う前回の重心と所属リストを読み込む（使えない場合はNone）"""
+    manifest = read_ann_manifest(index_dir)
+    if manifest is None or manifest.get("version") != ANN_FORMAT_VERSION:
+        return None
+    try:
+        centroids = np.load(os.path.join(index_dir, CENTROIDS_FILE))
+        assign_ids = np.load(os.path.join(index_dir, ASSIGN_IDS_FILE))
+        assign_lists = np.load(os.path.join(index_dir, ASSIGN_LISTS_FILE))
+        assign_keys = np.load(os.path.join(index_dir, ASSIGN_KEYS_FILE))
+    except (OSError, ValueError):
+        return None
+    if centroids.ndim != 2 or centroids.shape[1] != dim:
+        return None
+    return manifest, centroids, assign_ids, assign_lists, assign_keys
+
+
+def build_ann_index(
+    index,
+    index_dir: str,
+    nlist: Optional[int] = None,
+    retrain: bool = False,
+) -> Dict:
+    """
+    埋め込みインデックスからANNインデックスを作成・増分更新
+
+    前回のANNインデックスがあれば重心を再利用し、前回と同じIDで
+    ベクトルも変わっていない行は前回の所属リストをそのまま使います。
+
+    Args:
+        index: 埋め込みインデックス（EmbeddingIndex）
+        index_dir: 出力先ディレクトリ（埋め込みインデックスと同じ）
+        nlist: リスト数（省略時は環境変数ANN_NLISTまたは件数の平方根）
+        retrain: Trueの場合は前回の重心を使わずに学習し直す
+
+    Returns:
+        作成したivf.jsonの内容（"assigned"に新たに割り当てた件数を含む）
+    """
+    vectors = index.vectors
+    count, dim = vectors.shape
+    keys = vector_keys(vectors)
+
+    previous = None if retrain else _load_previous_assignments(index_dir, dim)
+    if previous is not None and count > previous[0]["trained_count"] * RETRAIN_GROWTH:
+        previous = None
+
+    lists = np.empty(count, dtype=np.int32)
+    if previous is None:
+        nlist = nlist or get_ann_nlist(count)
+        centroids = train_centroids(vectors, nlist)
+        trained_count = count
+        pending = np.arange(count)
+    else:
+        manifest, centroids, assign_ids, previous_lists, assign_keys = previous
+        trained_count = manifest["trained_count"]
+
+        # 前回と同じIDで、ベクトルも変わっていない行は所属リストを再利用
+        positions = np.searchsorted(assign_ids, index.ids)
+        positions = np.minimum(positions, max(len(assign_ids) - 1, 0))
+        reusable = np.zeros(count, dtype=bool)
+        if len(assign_ids) > 0:
+            reusable = (assign_ids[positions] == index.ids) & np.isclose(
+                assign_keys[positions], keys, rtol=0, atol=1e-4
+            )
+        lists[reusable] = previous_lists[positions[reusable]]
+        pending = np.flatnonzero(~reusable)
+
+    if len(pending) == count:
+        lists = assign_lists(vectors, centroids)
+    elif len(pending) > 0:
+        lists[pending] = assign_lists(vectors[pending], centroids)
+
+    nlist = len(centroids)
+    rows = np.argsort(lists, kind="stable").astype(np.int64)
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(lists, minlength=nlist))
+
+    order = np.argsort(index.ids, kind="stable")
+    arrays = {
+        CENTROIDS_FILE: centroids.astype(np.float32),
+        OFFSETS_FILE: offsets,
+        ROWS_FILE: rows,
+        ASSIGN_IDS_FILE: np.asarray(index.ids)[order],
+        ASSIGN_LISTS_FILE: lists[order],
+        ASSIGN_KEYS_FILE: keys[order],
+    }
+
+    # 作成中のANNインデックスが使われないよう、先にmanifestを削除
+    manifest_path = os.path.join(index_dir, ANN_MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    for name, array in arrays.items():
+        temp_path = os.path.join(index_dir, name + ".tmp")
+        _save_npy(temp_path, array)
+        os.replace(temp_path, os.path.join(index_dir, name))
+
+    manifest = {
+        "version": ANN_FORMAT_VERSION,
+        "type": "ivf",
+        "nlist": nlist,
+        "dim": int(dim),
+        "count": int(count),
+        "trained_count": int(trained_count),
+        "index_generation": index.manifest.get("generation"),
+        "index_count": index.manifest.get("count"),
+    }
+    temp_manifest_path = manifest_path + ".tmp"
+    with open(temp_manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_manifest_path, manifest_path)
+
+    return dict(manifest, assigned=int(len(pending)))
+
+
+def load_ann_index(index_dir: str, index_manifest: Dict) -> Optional[IVFIndex]:
+    """
+    ANNインデックスを読み込む
+
+    埋め込みインデックス（index_manifest）と対応していない場合は読み込みません。
+
+    Args:
+        index_dir: インデックスのディレクトリ
+        index_manifest: 埋め込みインデックスのmanifest.jsonの内容
+
+    Returns:
+        IVFIndex（存在しない・対応していない・壊れている場合はNone）
+    """
+    manifest = read_ann_manifest(index_dir)
+    if (
+        manifest is None
+        or manifest.get("version") != ANN_FORMAT_VERSION
+        or manifest.get("index_generation") != index_manifest.get("generation")
+        or manifest.get("index_count") != index_manifest.get("count")
+    ):
+        return None
+
+    try:
+        centroids = np.load(os.path.join(index_dir, CENTROIDS_FILE))
+        offsets = np.load(os.path.join(index_dir, OFFSETS_FILE))
+        rows = np.load(os.path.join(index_dir, ROWS_FILE), mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+
+    if (
+        centroids.shape != (manifest["nlist"], manifest["dim"])
+        or offsets.shape != (manifest["nlist"] + 1,)
+        or rows.shape != (manifest["count"],)
+    ):
+        return None
+
+    return IVFIndex(centroids, offsets, rows, manifest)
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+メッセージ取得のベンチマークスクリプト
+
+channel.historyの代わりに、1ページ（100件）ごとに指定した遅延を入れる
+擬似チャンネル（fake_discord.py）を使って、fetch_messages_from_guildの
+取得時間・ピークメモリを計測します。実際のDiscordサーバーやBotトークンは不要です。
+履歴は合成データのほか、フィクスチャファイル（--fixture）からも読み込めます。
+
+--embed-latencyを指定すると、1件あたりの生成時間を模した擬似エンコーダーで
+「取得後にまとめて埋め込みを生成」と「取得と並行して生成」（ingest_pipeline.py）の
+所要時間を比較します。
+
+使用例:
+    python src/benchmark_fetch.py
+    python src/benchmark_fetch.py --channels 16 --messages 5000 --concurrency 1 4 8
+    python src/benchmark_fetch.py --channels 1 --messages 50000 --windows 1 4 8
+    python src/benchmark_fetch.py --rate-limit 50 1 --memory
+    python src/benchmark_fetch.py --fixture data/fixture.json --with-db
+    python src/benchmark_fetch.py --embed-latency 0.0005
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+from itertools import islice
+
+import numpy as np
+
+from fake_discord import (
+    FakeClient,
+    FakeRateLimit,
+    build_guild,
+    load_fixture,
+    save_fixture,
+)
+from fetch_messages import fetch_messages_from_guild
+from ingest_pipeline import embed_messages, fetch_and_embed
+from knowledge_db import KnowledgeDB
+
+DEFAULT_CHANNELS = 8
+DEFAULT_MESSAGES_PER_CHANNEL = 2000
+DEFAULT_CONCURRENCY = [1, 2, 4, 8]
+DEFAULT_WINDOWS = [1]
+
+# 1ページ取得あたりの擬似レイテンシ（秒）
+DEFAULT_PAGE_LATENCY = 0.05
+
+# 擬似エンコーダーの埋め込み次元（all-MiniLM-L6-v2と同じ）
+EMBEDDING_DIM = 384
+
+# 取得後にまとめて生成する場合の1回の生成件数
+EMBED_CHUNK_SIZE = 1000
+
+
+class FakeEncoder:
+    """1件あたり指定した時間がかかる擬似的な埋め込みモデル"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.rng = np.random.default_rng(0)
+
+    def encode(self, texts, show_progress_bar=None):
+        # time.sleepはGILを解放するため、実際のモデルの計算と同様に取得と並行できる
+        time.sleep(self.latency * len(texts))
+        return self.rng.standard_normal((len(texts), EMBEDDING_DIM)).astype(np.float32)
+
+
+async def run_fetch(guild, concurrency, windows, db, measure_memory=False):
+    """
+    fetch_messages_from_guildを実行
+
+    Returns:
+        Tuple[float, FetchStats, Optional[int]]: (経過時間, 進捗カウンター,
+            ピークメモリ（バイト、measure_memory=Falseの場合はNone）)
+    """
+    client = FakeClient(guild)
+    peak = None
+    if measure_memory:
+        tracemalloc.start()
+    # チャンネルごとの進捗表示は計測結果の表示に含めない
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            began = time.perf_counter()
+            stats = await fetch_messages_from_guild(
+                client, guild.id, db=db, concurrency=concurrency, windows=windows
+            )
+            elapsed = time.perf_counter() - began
+    finally:
+        if measure_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    return elapsed, stats, peak
+
+
+def reset_guild(guild, rate_limit):
+    """計測ごとにページ取得回数とレート制限の状態を初期化"""
+    limiter = FakeRateLimit(*rate_limit) if rate_limit else None
+    for channel in guild.text_channels:
+        channel.requests = 0
+        channel.rate_limit = limiter
+    return limiter
+
+
+def embed_all_pending(db, model):
+    """取得後にまとめて埋め込みを生成（prepare_dataset.pyと同じ処理順）"""
+    pending = db.iter_pending_embeddings()
+    while True:
+        chunk = list(islice(pending, EMBED_CHUNK_SIZE))
+        if not chunk:
+            break
+        messages = [
+            {"id": message_id, "content": content} for message_id, content in chunk
+        ]
+        embed_messages(db, model, messages)
+
+
+def run_sequential(guild, concurrency, windows, db, model):
+    """取得後に埋め込みを生成し、経過時間を返す"""
+    fetch_elapsed, _, _ = asyncio.run(run_fetch(guild, concurrency, windows, db))
+    began = time.perf_counter()
+    embed_all_pending(db, model)
+    return fetch_elapsed + time.perf_counter() - began
+
+
+async def run_fused(guild, concurrency, windows, db, model):
+    """取得と並行して埋め込みを生成し、経過時間と段ごとの進捗を返す"""
+    client = FakeClient(guild)
+    with contextlib.redirect_stdout(io.StringIO()):
+        began = time.perf_counter()
+        fetch_stats, embed_stats = await fetch_and_embed(
+            client, guild.id, db, model, concurrency=concurrency, windows=windows
+        )
+        elapsed = time.perf_counter() - began
+    return elapsed, fetch_stats, embed_stats
+
+
+def compare_embedding(guild, concurrency, windows, embed_latency, temp_dir):
+    """取得後の生成と取得と並行した生成の所要時間を比較して表示"""
+    print()
+    print(f"🧠 埋め込み生成を含む計測（1件あたり{embed_latency * 1000:.2f}ms）")
+
+    db = KnowledgeDB(os.path.join(temp_dir, "sequential.db"))
+    sequential = run_sequential(
+        guild, concurrency, windows, db, FakeEncoder(embed_latency)
+    )
+    embedded = db.get_embedding_count()
+    db.close()
+    print(f"   取得後に生成:   {sequential:8.2f}秒  埋め込み: {embedded:,}件")
+
+    db = KnowledgeDB(os.path.join(temp_dir, "fused.db"))
+    fused, fetch_stats, embed_stats = asyncio.run(
+        run_fused(guild, concurrency, windows, db, FakeEncoder(embed_latency))
+    )
+    db.close()
+    print(f"   取得と並行生成: {fused:8.2f}秒  埋め込み: {embed_stats.embedded:,}件")
+    print(
+        f"   書き込みキューの最大待ち: {fetch_stats.max_queue_depth}バッチ, "
+        f"埋め込みキューの最大待ち: {embed_stats.max_queue_depth}バッチ"
+    )
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="メッセージ取得のベンチマーク")
+    parser.add_argument("--channels", type=int, default=DEFAULT_CHANNELS, help="チャンネル数")
+    parser.add_argument(
+        "--messages",
+        type=int,
+        default=DEFAULT_MESSAGES_PER_CHANNEL,
+        help="1チャンネルあたりのメッセージ数",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=DEFAULT_PAGE_LATENCY,
+        help="1ページ（100件）取得あたりの遅延（秒）",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=DEFAULT_CONCURRENCY,
+        help="計測する同時取得数（複数指定可）",
+    )
+    parser.add_argument(
+        "--windows",
+        type=int,
+        nargs="+",
+        default=DEFAULT_WINDOWS,
+        help="計測する1チャンネルあたりの同時取得範囲数（複数指定可）",
+    )
+    parser.add_argument(
+        "--with-db",
+        action="store_true",
+        help="一時DBへの保存も含めて計測する",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        nargs=2,
+        metavar=("REQUESTS", "PERIOD"),
+        default=None,
+        help="PERIOD秒あたりREQUESTS回を超えるページ取得を待機させる擬似レート制限",
+    )
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="tracemallocでピークメモリを計測する（計測中は処理が遅くなる）",
+    )
+    parser.add_argument(
+        "--fixture",
+        default=None,
+        help="合成データの代わりに読み込むフィクスチャファイル",
+    )
+    parser.add_argument(
+        "--save-fixture",
+        default=None,
+        help="使用した履歴をフィクスチャファイルに保存する",
+    )
+    parser.add_argument(
+        "--embed-latency",
+        type=float,
+        default=None,
+        help="埋め込み生成の1件あたりの擬似時間（秒）。指定すると生成を含めて比較する",
+    )
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("メッセージ取得 ベンチマーク")
+    print("=" * 60)
+    print()
+    if args.fixture:
+        guild = load_fixture(args.fixture, args.latency)
+        source = f"フィクスチャ {args.fixture}: {len(guild.text_channels)}チャンネル"
+    else:
+        guild = build_guild(args.channels, args.messages, args.latency)
+        source = f"{args.channels}チャンネル × {args.messages:,}件"
+    total = guild.message_count
+    print(f"📊 {source}（計{total:,}件、1ページあたり{args.latency * 1000:.0f}ms）")
+    if args.rate_limit:
+        requests, period = args.rate_limit
+        print(f"   擬似レート制限: {period:g}秒あたり{requests:g}リクエスト")
+    if args.save_fixture:
+        save_fixture(guild, args.save_fixture)
+        print(f"💾 フィクスチャを保存しました: {args.save_fixture}")
+    print()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for windows in args.windows:
+            for concurrency in args.concurrency:
+                db = None
+                if args.with_db:
+                    db_name = f"fetch_{concurrency}_{windows}.db"
+                    db = KnowledgeDB(os.path.join(temp_dir, db_name))
+
+                limiter = reset_guild(guild, args.rate_limit)
+                elapsed, stats, peak = asyncio.run(
+                    run_fetch(guild, concurrency, windows, db, args.memory)
+                )
+                if db is not None:
+                    db.close()
+
+                rate = total / elapsed if elapsed > 0 else float("inf")
+                requests = sum(channel.requests for channel in guild.text_channels)
+                line = (
+                    f"   同時取得数 {concurrency:>3}  範囲数 {windows:>2}  "
+                    f"{elapsed:8.2f}秒  {rate:>10,.0f} messages/sec  "
+                    f"保存対象: {stats.saved:,}件  リクエスト: {requests:,}回"
+                )
+                if limiter is not None:
+                    line += f"  制限待ち: {limiter.hits}回/{limiter.waited:.1f}秒"
+                if peak is not None:
+                    line += f"  ピークメモリ: {peak / 1024 / 1024:.1f}MB"
+                print(line)
+
+        if args.embed_latency is not None:
+            compare_embedding(
+                guild,
+                args.concurrency[-1],
+                args.windows[-1],
+                args.embed_latency,
+                temp_dir,
+            )
+
+    print()
+    print("=" * 60)
+    print("✅ ベンチマークが完了しました")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
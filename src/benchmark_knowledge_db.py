@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+知識データベースのベンチマークスクリプト
+
+合成メッセージ・埋め込みを一時DBに書き込み、KnowledgeDBの一括書き込み性能
+（rows/sec）を計測します。実際のDiscordサーバーやBotトークンは不要です。
+
+使用例:
+    python src/benchmark_knowledge_db.py
+    python src/benchmark_knowledge_db.py --rows 100000 --batch-size 5000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from knowledge_db import KnowledgeDB
+
+DEFAULT_ROWS = [100_000, 1_000_000]
+DEFAULT_BATCH_SIZE = 10_000
+
+# all-MiniLM-L6-v2の埋め込み次元数
+DEFAULT_EMBEDDING_DIM = 384
+
+# 1件ずつの埋め込み挿入は遅いため、この件数だけ計測してレートを求める
+PER_ROW_SAMPLE_ROWS = 5_000
+
+# 本文編集を含むupsertの計測で編集するメッセージの割合
+EDIT_RATIO = 0.1
+
+
+def generate_messages(start, count, content_prefix="メッセージ"):
+    """
+    合成メッセージを生成
+
+    Args:
+        start: 先頭のメッセージID
+        count: 生成件数
+        content_prefix: 本文の接頭辞
+
+    Returns:
+        メッセージデータの辞書のリスト
+    """
+    return [
+        {
+            "id": message_id,
+            "channel_id": message_id % 20,
+            "channel_name": f"channel-{message_id % 20}",
+            "author_id": message_id % 500,
+            "author_name": f"user-{message_id % 500}",
+            "content": f"{content_prefix} {message_id} の本文です。",
+            "created_at": "2024-01-01T00:00:00",
+            "timestamp": 1704067200.0 + message_id,
+        }
+        for message_id in range(start, start + count)
+    ]
+
+
+def run_batches(write, total_rows, batch_size, content_prefix="メッセージ"):
+    """
+    合成メッセージをバッチ単位で書き込み、経過時間を計測
+
+    メッセージ生成にかかる時間は計測から除外します。
+
+    Args:
+        write: バッチを受け取る書き込み関数
+        total_rows: 総件数
+        batch_size: 1バッチあたりの件数
+        content_prefix: 本文の接頭辞
+
+    Returns:
+        Tuple[float, list]: (書き込みの合計秒数, 各バッチの戻り値のリスト)
+    """
+    elapsed = 0.0
+    results = []
+    for start in range(0, total_rows, batch_size):
+        count = min(batch_size, total_rows - start)
+        batch = generate_messages(start + 1, count, content_prefix)
+
+        began = time.perf_counter()
+        results.append(write(batch))
+        elapsed += time.perf_counter() - began
+
+    return elapsed, results
+
+
+def print_result(label, total_rows, elapsed, detail=""):
+    """計測結果を1行で表示"""
+    rate = total_rows / elapsed if elapsed > 0 else float("inf")
+    print(f"   {label:<24} {elapsed:8.2f}秒  {rate:>12,.0f} rows/sec  {detail}")
+
+
+def benchmark_messages(total_rows, batch_size):
+    """
+    メッセージ書き込みのベンチマーク
+
+    新規挿入、全件重複の再挿入、一部を編集したupsertの3パターンを計測します。
+
+    Args:
+        total_rows: 総件数
+        batch_size: 1バッチあたりの件数
+    """
+    print(f"📊 {total_rows:,}件（バッチサイズ: {batch_size:,}件）")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with KnowledgeDB(os.path.join(temp_dir, "benchmark.db")) as db:
+            elapsed, results = run_batches(
+                db.insert_messages_batch, total_rows, batch_size
+            )
+            inserted = sum(result[0] for result in results)
+            print_result("新規挿入", total_rows, elapsed, f"挿入: {inserted:,}件")
+
+            elapsed, results = run_batches(
+                db.insert_messages_batch, total_rows, batch_size
+            )
+            skipped = sum(result[1] for result in results)
+            print_result("再挿入（全件重複）", total_rows, elapsed, f"スキップ: {skipped:,}件")
+
+            # 先頭の一部のメッセージだけ本文を変更してupsert
+            edit_rows = max(1, int(total_rows * EDIT_RATIO))
+            elapsed, results = run_batches(
+                db.upsert_messages_batch, edit_rows, batch_size, "編集済み"
+            )
+            updated = sum(result[1] for result in results)
+            print_result("upsert（本文編集）", edit_rows, elapsed, f"更新: {updated:,}件")
+
+    print()
+
+
+def benchmark_embeddings(total_rows, dim):
+    """
+    埋め込み書き込みのベンチマーク
+
+    1件ずつのinsert_embeddingと、insert_embeddings_batchを比較します。
+
+    Args:
+        total_rows: 総件数
+        dim: 埋め込みの次元数
+    """
+    print(f"📊 埋め込み {total_rows:,}件（{dim}次元）")
+
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((total_rows, dim), dtype=np.float32)
+    message_ids = np.arange(1, total_rows + 1)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with KnowledgeDB(os.path.join(temp_dir, "per_row.db")) as db:
+            sample_rows = min(total_rows, PER_ROW_SAMPLE_ROWS)
+            began = time.perf_counter()
+            for message_id, vector in zip(message_ids[:sample_rows], matrix):
+                db.insert_embedding(int(message_id), vector)
+            elapsed = time.perf_counter() - began
+            print_result("1件ずつ挿入", sample_rows, elapsed, f"{sample_rows:,}件で計測")
+
+        with KnowledgeDB(os.path.join(temp_dir, "batch.db")) as db:
+            began = time.perf_counter()
+            inserted = db.insert_embeddings_batch(message_ids, matrix)
+            elapsed = time.perf_counter() - began
+            print_result("一括挿入", total_rows, elapsed, f"挿入: {inserted:,}件")
+
+    print()
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="知識データベースのベンチマーク")
+    parser.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=DEFAULT_ROWS,
+        help="計測するメッセージ件数（複数指定可）",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="1回の書き込みに渡す件数",
+    )
+    parser.add_argument(
+        "--dim",
+        type=int,
+        default=DEFAULT_EMBEDDING_DIM,
+        help="埋め込みの次元数",
+    )
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("知識データベース ベンチマーク")
+    print("=" * 60)
+    print()
+
+    for total_rows in args.rows:
+        benchmark_messages(total_rows, args.batch_size)
+        benchmark_embeddings(total_rows, args.dim)
+
+    print("=" * 60)
+    print("✅ ベンチマークが完了しました")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+類似メッセージ検索のベンチマークスクリプト
+
+合成した正規化済みの埋め込み行列に対して、1クエリあたりの検索時間の
+p50/p99を件数ごとに計測します。実際のモデルやBotトークンは不要です。
+
+比較対象（従来方式）は、sentence_transformers.util.cos_simと同様に
+クエリごとに全行のノルムを計算し、全件をソートする方式です。
+
+--annを指定すると、クラスタ構造を持つ合成行列に対してANNインデックス
+（ann_index.py）を作成し、nprobeごとの検索時間と全件検索に対する
+recall@kを計測します。
+
+--quantizeを指定すると、メモリマップしたfloat32行列の全件検索と、
+int8の量子化インデックス（quantized_index.py）による検索を、それぞれ
+新しいプロセスで実行し、検索時間・recall@k・ピークメモリ（最大常駐サイズ）を
+比較します。
+
+--filterを指定すると、チャンネル・重要度・期間で絞り込んだ検索について、
+全行の類似度を計算してから条件に一致しない行を除く方式と、
+先に条件に一致する行を選んでその行だけを計算する方式（IndexMetadata）の
+検索時間を比較します。
+
+--batchを指定すると、複数のクエリを1クエリずつ検索する方式と、
+行列同士の積でまとめて検索する方式（search_vectors_batch）の
+1クエリあたりの検索時間を、バッチの大きさごとに比較します。
+
+使用例:
+    python src/benchmark_search.py
+    python src/benchmark_search.py --sizes 10000 100000 --queries 500
+    python src/benchmark_search.py --ann --sizes 100000 1000000 --nprobe 1 4 16 64
+    python src/benchmark_search.py --quantize --sizes 1000000 --top-k 10
+    python src/benchmark_search.py --filter --sizes 1000000
+    python src/benchmark_search.py --batch --sizes 100000 1000000 --batch-size 8 64
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ann_index import build_ann_index, load_ann_index
+from embedding_index import (
+    EmbeddingIndex,
+    IndexMetadata,
+    normalize_rows,
+    search_vectors,
+    search_vectors_batch,
+    top_k_indices,
+)
+from quantized_index import build_quantized_index, load_quantized_index
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_QUERIES = 100
+DEFAULT_TOP_K = 5
+
+# all-MiniLM-L6-v2の埋め込み次元数
+DEFAULT_EMBEDDING_DIM = 384
+
+# 合成行列をまとめて生成・正規化する行数（一時的なメモリ使用量を抑える）
+GENERATE_CHUNK_ROWS = 100_000
+
+# --annで計測するnprobeの既定値
+DEFAULT_NPROBES = [1, 4, 16, 64]
+
+# --annの合成行列のクラスタ数と、クラスタ中心からのばらつき
+# （実際の埋め込みと同様に、話題ごとのまとまりを持たせる）
+SYNTHETIC_CLUSTERS = 1000
+CLUSTER_NOISE = 1.25
+
+# --filterの合成メタデータのチャンネル数と重要度の上限
+SYNTHETIC_CHANNELS = 100
+SYNTHETIC_MAX_IMPORTANCE = 10
+
+# --batchで計測するバッチの大きさの既定値
+DEFAULT_BATCH_SIZES = [8, 64]
+
+
+def generate_vectors(count, dim, rng):
+    """正規化済みのfloat32行列を生成"""
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, GENERATE_CHUNK_ROWS):
+        end = min(start + GENERATE_CHUNK_ROWS, count)
+        chunk = rng.standard_normal((end - start, dim), dtype=np.float32)
+        vectors[start:end] = normalize_rows(chunk)
+    return vectors
+
+
+def generate_clustered_vectors(count, dim, rng, clusters=SYNTHETIC_CLUSTERS):
+    """クラスタ構造を持つ正規化済みのfloat32行列を生成"""
+    centers = normalize_rows(rng.standard_normal((clusters, dim), dtype=np.float32))
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, GENERATE_CHUNK_ROWS):
+        end = min(start + GENERATE_CHUNK_ROWS, count)
+        labels = rng.integers(0, clusters, end - start)
+        noise = rng.standard_normal((end - start, dim), dtype=np.float32)
+        vectors[start:end] = normalize_rows(
+            centers[labels] + noise * (CLUSTER_NOISE / np.sqrt(dim))
+        )
+    return vectors
+
+
+def search_full_sort(vectors, query, top_k):
+    """従来方式: クエリごとに全行のノルムを計算し、全件をソート"""
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+    scores = (vectors @ query) / norms
+    return np.argsort(-scores)[:top_k]
+
+
+def measure(search, vectors, queries, top_k):
+    """
+    1クエリずつ検索し、検索時間のp50/p99（ミリ秒）と結果を返す
+    """
+    latencies = []
+    results = []
+    for query in queries:
+        began = time.perf_counter()
+        result = search(vectors, query, top_k)
+        latencies.append((time.perf_counter() - began) * 1000)
+        results.append(result)
+    return np.percentile(latencies, 50), np.percentile(latencies, 99), results
+
+
+def benchmark_ann(size, args, rng):
+    """ANNインデックスのnprobeごとの検索時間とrecall@kを計測"""
+    # 末尾をクエリとして使い、残りをインデックスに入れる
+    vectors = generate_clustered_vectors(size + args.queries, args.dim, rng)
+    queries = vectors[size:].copy()
+    vectors = vectors[:size]
+
+    p50, p99, exact = measure(
+        lambda v, q, k: search_vectors(v, q, k)[0], vectors, queries, args.top_k
+    )
+    print(f"   {size:>10,}件  全件検索:        p50 {p50:8.2f}ms  p99 {p99:8.2f}ms")
+
+    index_dir = tempfile.mkdtemp()
+    try:
+        ids = np.arange(size, dtype=np.int64)
+        index = EmbeddingIndex(ids, vectors, None, {"count": size, "generation": 0})
+        began = time.perf_counter()
+        manifest = build_ann_index(index, index_dir)
+        build_time = time.perf_counter() - began
+        ann = load_ann_index(index_dir, index.manifest)
+        print(f"   {'':>10}    IVF作成: {build_time:.1f}秒（{manifest['nlist']}リスト）")
+
+        for nprobe in args.nprobe:
+            p50, p99, results = measure(
+                lambda v, q, k: ann.search(v, q, k, nprobe=nprobe)[0],
+                vectors,
+                queries,
+                args.top_k,
+            )
+            hits = sum(len(set(a) & set(b)) for a, b in zip(results, exact))
+            recall = hits / (len(queries) * args.top_k)
+            print(
+                f"   {'':>10}    nprobe={nprobe:<4}      p50 {p50:8.2f}ms  "
+                f"p99 {p99:8.2f}ms  recall@{args.top_k}: {recall:.3f}"
+            )
+    finally:
+        shutil.rmtree(index_dir)
+
+
+def generate_metadata(count, rng):
+    """チャンネル・重要度・タイムスタンプを一様に割り当てた合成メタデータを生成"""
+    return IndexMetadata(
+        rng.integers(0, SYNTHETIC_CHANNELS, count),
+        np.full(count, -1, dtype=np.int32),
+        [],
+        rng.integers(0, SYNTHETIC_MAX_IMPORTANCE, count, dtype=np.int32),
+        np.sort(rng.uniform(0, 1, count))[::-1],
+    )
+
+
+def search_post_filter(vectors, metadata, filters, query, top_k):
+    """比較対象: 全行の類似度を計算し、条件に一致しない行を除いてから上位を選ぶ"""
+    mask = np.ones(len(vectors), dtype=bool)
+    if "channel_id" in filters:
+        mask &= metadata.channel_ids == filters["channel_id"]
+    if "min_importance" in filters:
+        mask &= metadata.importance >= filters["min_importance"]
+    if "since" in filters:
+        mask &= metadata.timestamps >= filters["since"]
+    scores = vectors @ normalize_rows(query.reshape(1, -1))[0]
+    scores[~mask] = -np.inf
+    best = top_k_indices(scores, top_k)
+    return best[np.isfinite(scores[best])]
+
+
+def benchmark_filter(size, args, rng):
+    """絞り込み検索の検索時間を、後から除く方式と先に選ぶ方式で比較"""
+    vectors = generate_vectors(size, args.dim, rng)
+    queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+    metadata = generate_metadata(size, rng)
+
+    cases = [
+        ("チャンネル（約1%）", {"channel_id": 7}),
+        ("チャンネル+直近30%", {"channel_id": 7, "since": 0.7}),
+        ("重要度8以上（約20%）", {"min_importance": 8}),
+    ]
+    for label, filters in cases:
+        post_p50, _, post_results = measure(
+            lambda v, q, k: search_post_filter(v, metadata, filters, q, k),
+            vectors,
+            queries,
+            args.top_k,
+        )
+        p50, p99, results = measure(
+            lambda v, q, k: search_vectors(v, q, k, rows=metadata.select_rows(filters))[
+                0
+            ],
+            vectors,
+            queries,
+            args.top_k,
+        )
+        same = all(list(a) == list(b) for a, b in zip(results, post_results))
+        print(
+            f"   {size:>10,}件  {label}: 先に選ぶ p50 {p50:8.2f}ms  p99 {p99:8.2f}ms"
+            f"  / 後から除く p50 {post_p50:8.2f}ms"
+            f"（{post_p50 / p50:.1f}倍, 結果一致: {'はい' if same else 'いいえ'}）"
+        )
+    del vectors
+
+
+def benchmark_batch(size, args, rng):
+    """複数クエリの検索時間を、1クエリずつの検索とまとめた検索で比較"""
+    vectors = generate_vectors(size, args.dim, rng)
+    for batch_size in args.batch_size:
+        queries = rng.standard_normal((batch_size, args.dim), dtype=np.float32)
+
+        loop_latencies = []
+        batch_latencies = []
+        for _ in range(max(1, args.queries // batch_size)):
+            began = time.perf_counter()
+            loop_results = [search_vectors(vectors, q, args.top_k)[0] for q in queries]
+            loop_latencies.append((time.perf_counter() - began) * 1000)
+
+            began = time.perf_counter()
+            batch_results, _ = search_vectors_batch(vectors, queries, args.top_k)
+            batch_latencies.append((time.perf_counter() - began) * 1000)
+
+        loop_ms = np.percentile(loop_latencies, 50) / batch_size
+        batch_ms = np.percentile(batch_latencies, 50) / batch_size
+        same = all(list(a) == list(b) for a, b in zip(batch_results, loop_results))
+        print(
+            f"   {size:>10,}件  {batch_size:>4}クエリ: まとめて {batch_ms:8.2f}ms/クエリ"
+            f"  / 1クエリずつ {loop_ms:8.2f}ms/クエリ"
+            f"（{loop_ms / batch_ms:.1f}倍, 結果一致: {'はい' if same else 'いいえ'}）"
+        )
+    del vectors
+
+
+def peak_rss_mb():
+    """このプロセスの最大常駐サイズ（MB）"""
+    # ru_maxrssはexec前の親プロセスの値を引き継ぐため、Linuxでは/procの値を使う
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure_in_process(index_dir, mode, queries, top_k):
+    """
+    インデックスをメモリマップで読み込んで検索（新しいプロセスで実行）
+
+    Returns:
+        (p50, p99, 結果, 読み込み前からのピークメモリの増加量（MB）)
+    """
+    before = peak_rss_mb()
+    vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r")
+    if mode == "int8":
+        manifest = {"count": len(vectors), "generation": 0}
+        quantized = load_quantized_index(index_dir, manifest)
+
+        def search(v, q, k):
+            return quantized.search(v, q, k)[0]
+
+    else:
+
+        def search(v, q, k):
+            return search_vectors(v, q, k)[0]
+
+    p50, p99, results = measure(search, vectors, queries, top_k)
+    return p50, p99, results, peak_rss_mb() - before
+
+
+def benchmark_quantized(size, args, rng):
+    """float32とint8の量子化インデックスの検索時間・recall@k・ピークメモリを比較"""
+    vectors = generate_clustered_vectors(size + args.queries, args.dim, rng)
+    queries = vectors[size:].copy()
+    vectors = vectors[:size]
+
+    index_dir = tempfile.mkdtemp()
+    try:
+        np.save(os.path.join(index_dir, "vectors.npy"), vectors)
+        index = EmbeddingIndex(
+            np.arange(size, dtype=np.int64),
+            vectors,
+            None,
+            {"count": size, "generation": 0},
+        )
+        began = time.perf_counter()
+        build_quantized_index(index, index_dir)
+        build_time = time.perf_counter() - began
+        del index, vectors
+
+        exact = None
+        context = multiprocessing.get_context("spawn")
+        for mode in ("float32", "int8"):
+            # ピークメモリを個別に計測するため、方式ごとに新しいプロセスで実行
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                p50, p99, results, peak = executor.submit(
+                    measure_in_process, index_dir, mode, queries, args.top_k
+                ).result()
+            if exact is None:
+                exact = results
+            hits = sum(len(set(a) & set(b)) for a, b in zip(results, exact))
+            recall = hits / (len(queries) * args.top_k)
+            label = f"{size:>10,}件" if mode == "float32" else f"{'':>13}"
+            print(
+                f"   {label}  {mode:<8} p50 {p50:8.2f}ms  p99 {p99:8.2f}ms  "
+                f"recall@{args.top_k}: {recall:.3f}  ピークメモリ: {peak:,.0f}MB"
+            )
+        print(f"   {'':>10}    int8作成: {build_time:.1f}秒")
+    finally:
+        shutil.rmtree(index_dir)
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="類似メッセージ検索のベンチマーク")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="計測する埋め込みの件数（複数指定可）",
+    )
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES, help="計測するクエリ数")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help="取得件数")
+    parser.add_argument(
+        "--dim", type=int, default=DEFAULT_EMBEDDING_DIM, help="埋め込みの次元数"
+    )
+    parser.add_argument("--skip-baseline", action="store_true", help="従来方式の計測を省略する")
+    parser.add_argument(
+        "--ann", action="store_true", help="ANNインデックスの検索時間とrecall@kを計測する"
+    )
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        nargs="+",
+        default=DEFAULT_NPROBES,
+        help="--annで計測する調べるリスト数（複数指定可）",
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="int8の量子化インデックスの検索時間・recall@k・ピークメモリを計測する",
+    )
+    parser.add_argument(
+        "--filter",
+        action="store_true",
+        help="メタデータで絞り込んだ検索の検索時間を計測する",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="複数クエリをまとめた検索の検索時間を計測する",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        nargs="+",
+        default=DEFAULT_BATCH_SIZES,
+        help="--batchで計測するバッチの大きさ（複数指定可）",
+    )
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("類似メッセージ検索 ベンチマーク")
+    print("=" * 60)
+    print()
+    print(f"📊 次元数: {args.dim}, top_k: {args.top_k}, クエリ数: {args.queries}")
+    print()
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        if args.ann:
+            benchmark_ann(size, args, rng)
+            continue
+        if args.quantize:
+            benchmark_quantized(size, args, rng)
+            continue
+        if args.filter:
+            benchmark_filter(size, args, rng)
+            continue
+        if args.batch:
+            benchmark_batch(size, args, rng)
+            continue
+
+        vectors = generate_vectors(size, args.dim, rng)
+        queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+
+        p50, p99, results = measure(
+            lambda v, q, k: search_vectors(v, q, k)[0], vectors, queries, args.top_k
+        )
+        print(f"   {size:>10,}件  行列積+argpartition: p50 {p50:8.2f}ms  p99 {p99:8.2f}ms")
+
+        if not args.skip_baseline:
+            base_p50, base_p99, base_results = measure(
+                search_full_sort, vectors, queries, args.top_k
+            )
+            same = all(list(a) == list(b) for a, b in zip(results, base_results))
+            print(
+                f"   {'':>10}    ノルム計算+全件ソート: p50 {base_p50:8.2f}ms  "
+                f"p99 {base_p99:8.2f}ms  （{base_p50 / p50:.1f}倍, "
+                f"結果一致: {'はい' if same else 'いいえ'}）"
+            )
+        del vectors
+
+    print()
+    print("=" * 60)
+    print("✅ ベンチマークが完了しました")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
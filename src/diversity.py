@@ -0,0 +1,98 @@
+"""
+検索結果の多様化モジュール
+
+サーバーのチャットには「ありがとう！」や定型文、コピーされた回答など
+ほぼ同じメッセージが多く、類似度の順に選ぶとLLMに渡す数件の枠が
+同じ内容で埋まることがあります。そこで、多めに取得した候補から
+Maximal Marginal Relevance（MMR）で結果を選び直します。
+
+- 関連度（最大値を1とした候補のスコア）と、選択済みの結果との類似度の最大値から
+  DIVERSITY_LAMBDA × 関連度 − (1 − DIVERSITY_LAMBDA) × 類似度 が最大の候補を順に選びます
+- 選択済みの結果とのコサイン類似度がDUPLICATE_THRESHOLD以上の候補は
+  ほぼ同じメッセージとして除きます
+- 候補同士の類似度は候補数×候補数の行列積1回で求め、選択は候補数の配列の
+  更新の繰り返しで行うため、追加の処理時間は候補数（top_kの数倍）で決まります
+
+設定（環境変数）:
+- DIVERSITY_LAMBDA: 関連度の重み（0〜1、既定値: 0.7、1で関連度の順のまま）
+- DUPLICATE_THRESHOLD: ほぼ同じメッセージとみなすコサイン類似度
+  （既定値: 0.95、1より大きい値で除かない）
+"""
+
+import os
+
+import numpy as np
+
+DEFAULT_DIVERSITY_LAMBDA = 0.7
+DEFAULT_DUPLICATE_THRESHOLD = 0.95
+
+
+def get_diversity_lambda() -> float:
+    """環境変数DIVERSITY_LAMBDA（MMRの関連度の重み、0〜1）を取得"""
+    value = os.environ.get("DIVERSITY_LAMBDA", "")
+    if not value.strip():
+        return DEFAULT_DIVERSITY_LAMBDA
+    return min(1.0, max(0.0, float(value)))
+
+
+def get_duplicate_threshold() -> float:
+    """環境変数DUPLICATE_THRESHOLD（ほぼ同じメッセージとみなす類似度）を取得"""
+    value = os.environ.get("DUPLICATE_THRESHOLD", "")
+    return float(value) if value.strip() else DEFAULT_DUPLICATE_THRESHOLD
+
+
+def is_diversity_enabled(diversity_lambda: float, duplicate_threshold: float) -> bool:
+    """多様化で結果が変わりうる設定かどうか"""
+    return diversity_lambda < 1.0 or duplicate_threshold <= 1.0
+
+
+def mmr_select(
+    vectors: np.ndarray,
+    relevance: np.ndarray,
+    top_k: int,
+    diversity_lambda: float = DEFAULT_DIVERSITY_LAMBDA,
+    duplicate_threshold: float = DEFAULT_DUPLICATE_THRESHOLD,
+) -> np.ndarray:
+    """
+    MMRで候補からtop_k件を選ぶ
+
+    Args:
+        vectors: 候補の正規化済みの埋め込み（shape=(候補数, 次元数)）。
+            埋め込みのない候補は0の行（他の候補と類似しないものとして扱う）
+        relevance: 候補の関連度（大きいほど関連が強い、コサイン類似度やRRFのスコア）
+        top_k: 選ぶ件数
+        diversity_lambda: 関連度の重み（1で関連度の順）
+        duplicate_threshold: 選択済みの結果とこの類似度以上の候補は除く
+
+    Returns:
+        選んだ候補の位置の配列（選んだ順）
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    count = len(relevance)
+    if count == 0 or top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    # 尺度の異なるスコア（RRFなど）でも同じ重みで扱えるよう、最大値を1にする
+    top = float(relevance.max())
+    if top > 0:
+        relevance = relevance / top
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    similarity = vectors @ vectors.T
+    max_similarity = np.zeros(count, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+
+    selected = []
+    for _ in range(min(top_k, count)):
+        scores = (
+            diversity_lambda * relevance - (1.0 - diversity_lambda) * max_similarity
+        )
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        if not available[best]:
+            break
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+        available &= similarity[best] < duplicate_threshold
+    return np.array(selected, dtype=np.intp)
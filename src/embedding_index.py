@@ -0,0 +1,738 @@
+"""
+埋め込みインデックス管理モジュール
+
+知識データベースの埋め込みから、Bot起動時にそのままメモリマップできる
+インデックスファイル群（サイドカー）を作成・読み込みします。
+
+ファイル構成（data/embedding_index/）:
+- vectors.npy: 正規化済みのfloat32行列（行の並びはids.npyと同じ）
+- ids.npy: メッセージIDの並び（int64）
+- texts.bin / text_offsets.npy: UTF-8本文の連結と各行の開始位置
+- channel_ids.npy / channel_order.npy: 各行のチャンネルIDと、
+  チャンネルID順に並べた行の位置（チャンネルごとの区画）
+- category_codes.npy: 各行のカテゴリの番号（manifestのcategoriesの位置、なしは-1）
+- importance.npy / timestamps.npy: 各行の重要度とタイムスタンプ
+- manifest.json: 件数・次元数・作成時の埋め込み世代番号・カテゴリ一覧など
+
+Bot側はnp.load(mmap_mode="r")で読み込むため、起動時間は件数によらずほぼ一定で、
+再起動時もOSのページキャッシュが共有されます。
+インデックスがない場合やDBより古い場合は、呼び出し側でDBから読み込みます。
+
+メタデータ（チャンネル・カテゴリ・重要度・時刻）による絞り込みは、
+類似度の計算前に対象の行を選んでおき、その行だけを計算します（IndexMetadata）。
+"""
+
+import json
+import os
+from itertools import chain, islice
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from knowledge_db import MESSAGE_FILTER_CONDITIONS
+
+INDEX_DIR = os.path.join(os.path.dirname(__file__), "../data/embedding_index")
+
+# インデックスファイルの形式バージョン（互換性のない変更時に更新）
+INDEX_FORMAT_VERSION = 2
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+IDS_FILE = "ids.npy"
+TEXTS_FILE = "texts.bin"
+TEXT_OFFSETS_FILE = "text_offsets.npy"
+CHANNEL_IDS_FILE = "channel_ids.npy"
+CHANNEL_ORDER_FILE = "channel_order.npy"
+CATEGORY_CODES_FILE = "category_codes.npy"
+IMPORTANCE_FILE = "importance.npy"
+TIMESTAMPS_FILE = "timestamps.npy"
+
+# 重要度がNULLの行の値（最小重要度の条件に一致しない）
+NULL_IMPORTANCE = np.iinfo(np.int32).min
+
+# インデックス作成時にまとめて正規化・書き込みする行数
+WRITE_PAGE_SIZE = 4096
+
+# 指定した行の類似度を計算するときに一度に取り出す行数
+# （取り出した行がCPUキャッシュに収まる大きさにすると、まとめて取り出すより速い）
+SCORE_CHUNK_ROWS = 1024
+
+# 複数クエリの検索で一度に計算する行数
+# （クエリ数×行数のスコア行列の大きさを抑えつつ、行列積をまとめて計算する）
+BATCH_CHUNK_ROWS = 4096
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    行列の各行をL2ノルムで正規化（ノルム0の行はそのまま）
+
+    Args:
+        matrix: shape=(件数, 次元数)の行列
+
+    Returns:
+        正規化済みのfloat32行列
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    スコアの大きい順にtop_k件の位置を返す
+
+    argpartitionで上位top_k件を選んでから並べ替えるため、
+    全件をソートする場合と異なり計算量は件数に比例します。
+
+    Args:
+        scores: 1次元のスコア配列
+        top_k: 取得件数
+
+    Returns:
+        スコアの大きい順の位置の配列
+    """
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    if top_k < len(scores):
+        candidates = np.argpartition(scores, -top_k)[-top_k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def score_rows(vectors: np.ndarray, rows: np.ndarray, query: np.ndarray):
+    """
+    行列の指定した行とクエリの内積を計算
+
+    Args:
+        vectors: 正規化済みの行列
+        rows: 計算する行の位置
+        query: 正規化済みのクエリ
+
+    Returns:
+        rowsと同じ並びのスコアの配列（float32）
+    """
+    scores = np.empty(len(rows), dtype=np.float32)
+    for start in range(0, len(rows), SCORE_CHUNK_ROWS):
+        end = min(start + SCORE_CHUNK_ROWS, len(rows))
+        scores[start:end] = np.asarray(vectors[rows[start:end]]) @ query
+    return scores
+
+
+def search_vectors(
+    vectors: np.ndarray,
+    query: np.ndarray,
+    top_k: int,
+    rows: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    正規化済みの行列から、クエリとのコサイン類似度が高い順にtop_k件を検索
+
+    行列は正規化済みのため、類似度は行列とクエリの積1回で求まります。
+
+    Args:
+        vectors: 正規化済みのfloat32行列（shape=(件数, 次元数)）
+        query: クエリの埋め込み（正規化は不要）
+        top_k: 取得件数
+        rows: 検索対象の行の位置（Noneの場合は全行、絞り込み検索で指定）
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (行の位置, コサイン類似度)
+    """
+    query = normalize_rows(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+    if rows is None:
+        scores = vectors @ query
+        indices = top_k_indices(scores, top_k)
+        return indices, scores[indices]
+
+    scores = score_rows(vectors, rows, query)
+    indices = top_k_indices(scores, top_k)
+    return rows[indices], scores[indices]
+
+
+def search_vectors_batch(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    top_k: int,
+    rows: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    複数のクエリについて、コサイン類似度が高い順にtop_k件をまとめて検索
+
+    行列はBATCH_CHUNK_ROWS行ずつ、全クエリとの積（行列同士の積）1回で計算し、
+    クエリごとの上位top_k件だけを残します。行列の読み込みはクエリ数によらず1回です。
+
+    Args:
+        vectors: 正規化済みのfloat32行列（shape=(件数, 次元数)）
+        queries: クエリの埋め込みの行列（shape=(クエリ数, 次元数)、正規化は不要）
+        top_k: クエリごとの取得件数
+        rows: 検索対象の行の位置（Noneの場合は全行、絞り込み検索で指定）
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (行の位置, コサイン類似度)。
+            shape=(クエリ数, min(top_k, 件数))で、各行は類似度の高い順
+    """
+    queries = normalize_rows(np.asarray(queries, dtype=np.float32))
+    if len(queries) == 1:
+        # 1クエリの場合は区切らずに計算する方が速い
+        found, scores = search_vectors(vectors, queries[0], top_k, rows=rows)
+        return found[np.newaxis], scores[np.newaxis]
+
+    count = len(vectors) if rows is None else len(rows)
+    top_k = max(0, min(top_k, count))
+
+    best = np.empty((len(queries), 0), dtype=np.intp)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, count if top_k > 0 else 0, BATCH_CHUNK_ROWS):
+        end = min(start + BATCH_CHUNK_ROWS, count)
+        block = vectors[start:end] if rows is None else vectors[rows[start:end]]
+        # (行数, クエリ数)の順の積の方がBLASで速い
+        scores = (np.asarray(block) @ queries.T).T
+        scores = np.concatenate([best_scores, scores], axis=1)
+        positions = np.concatenate(
+            [best, np.broadcast_to(np.arange(start, end), (len(queries), end - start))],
+            axis=1,
+        )
+        if scores.shape[1] > top_k:
+            keep = np.argpartition(scores, -top_k, axis=1)[:, -top_k:]
+            scores = np.take_along_axis(scores, keep, axis=1)
+            positions = np.take_along_axis(positions, keep, axis=1)
+        best, best_scores = positions, scores
+
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    best = np.take_along_axis(best, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    if rows is not None:
+        best = rows[best]
+    return best, best_scores
+
+
+class IndexMetadata:
+    """
+    絞り込み検索用の行ごとのメタデータ
+
+    チャンネルIDの条件はチャンネルID順に並べた行の位置（区画）から二分探索で
+    該当する行を取り出し、その他の条件はその行に対するマスクで絞り込みます。
+    """
+
+    def __init__(
+        self,
+        channel_ids: np.ndarray,
+        category_codes: np.ndarray,
+        categories: List[str],
+        importance: np.ndarray,
+        timestamps: np.ndarray,
+        channel_order: Optional[np.ndarray] = None,
+    ):
+        """
+        Args:
+            channel_ids: 各行のチャンネルID
+            category_codes: 各行のカテゴリの番号（categoriesの位置、なしは-1）
+            categories: カテゴリ名の一覧
+            importance: 各行の重要度（NULLはNULL_IMPORTANCE）
+            timestamps: 各行のタイムスタンプ（Unix時間）
+            channel_order: チャンネルID順（同じチャンネル内は行の順）に並べた行の位置
+                （省略時は初回の絞り込み時に作成）
+        """
+        self.channel_ids = channel_ids
+        self.category_codes = category_codes
+        self.categories = categories
+        self.importance = importance
+        self.timestamps = timestamps
+        self._channel_order = channel_order
+        self._sorted_channel_ids = None
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Tuple]) -> "IndexMetadata":
+        """
+        (チャンネルID, カテゴリ, 重要度, タイムスタンプ)のタプルの並びから作成
+
+        Args:
+            rows: KnowledgeDB.iter_embeddings(with_metadata=True)のメタデータの並び
+        """
+        categories = sorted({row[1] for row in rows if row[1] is not None})
+        codes = {category: i for i, category in enumerate(categories)}
+        return cls(
+            np.array([row[0] for row in rows], dtype=np.int64),
+            np.array([codes.get(row[1], -1) for row in rows], dtype=np.int32),
+            categories,
+            np.array(
+                [NULL_IMPORTANCE if row[2] is None else row[2] for row in rows],
+                dtype=np.int32,
+            ),
+            np.array([row[3] for row in rows], dtype=np.float64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.channel_ids)
+
+    def channel_rows(self, channel_id: int) -> np.ndarray:
+        """チャンネルの行の位置（昇順）"""
+        if self._channel_order is None:
+            self._channel_order = np.argsort(self.channel_ids, kind="stable")
+        if self._sorted_channel_ids is None:
+            self._sorted_channel_ids = np.asarray(self.channel_ids[self._channel_order])
+
+        start = np.searchsorted(self._sorted_channel_ids, channel_id, side="left")
+        end = np.searchsorted(self._sorted_channel_ids, channel_id, side="right")
+        return np.asarray(self._channel_order[start:end], dtype=np.intp)
+
+    def select_rows(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """
+        絞り込み条件に一致する行の位置を求める
+
+        条件はKnowledgeDB.search_textのfiltersと同じです（値がNoneの条件は無視）。
+
+        Args:
+            filters: 絞り込み条件の辞書
+                - channel_id: チャンネルID
+                - category: カテゴリ
+                - min_importance: 最小重要度
+                - since: この時刻（Unix時間）以降
+                - until: この時刻（Unix時間）より前
+
+        Returns:
+            一致する行の位置（昇順）。条件がない場合はNone（全行が対象）
+
+        Raises:
+            ValueError: 未対応の絞り込み条件が指定された場合
+        """
+        if not filters:
+            return None
+
+        unknown = set(filters) - set(MESSAGE_FILTER_CONDITIONS)
+        if unknown:
+            raise ValueError(f"未対応の絞り込み条件です: {', '.join(sorted(unknown))}")
+
+        filters = {key: value for key, value in filters.items() if value is not None}
+        if not filters:
+            return None
+
+        if "channel_id" in filters:
+            rows = self.channel_rows(int(filters["channel_id"]))
+        else:
+            rows = None
+
+        def column(values: np.ndarray) -> np.ndarray:
+            return np.asarray(values if rows is None else values[rows])
+
+        conditions = []
+        if "category" in filters:
+            if filters["category"] in self.categories:
+                code = self.categories.index(filters["category"])
+            else:
+                code = -2  # どの行にも一致しない
+            conditions.append(column(self.category_codes) == code)
+        if "min_importance" in filters:
+            conditions.append(column(self.importance) >= filters["min_importance"])
+        if "since" in filters:
+            conditions.append(column(self.timestamps) >= filters["since"])
+        if "until" in filters:
+            conditions.append(column(self.timestamps) < filters["until"])
+
+        if not conditions:
+            return rows
+        selected = np.flatnonzero(np.logical_and.reduce(conditions))
+        return selected if rows is None else rows[selected]
+
+
+class IndexTexts:
+    """
+    インデックスの本文を遅延デコードするシーケンス
+
+    本文はメモリマップしたUTF-8バイト列のまま保持し、
+    アクセスされた行だけをデコードします。
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        """
+        Args:
+            data: 本文を連結したUTF-8バイト列（uint8配列）
+            offsets: 各行の開始位置（件数+1要素、末尾はデータ長）
+        """
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("インデックスの範囲外です")
+
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return bytes(self._data[start:end]).decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class EmbeddingIndex:
+    """メモリマップした埋め込みインデックス"""
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        vectors: np.ndarray,
+        texts: IndexTexts,
+        manifest: Dict,
+        metadata: Optional[IndexMetadata] = None,
+    ):
+        """
+        Args:
+            ids: メッセージIDの配列
+            vectors: 正規化済みのfloat32行列
+            texts: 本文のシーケンス
+            manifest: manifest.jsonの内容
+            metadata: 絞り込み検索用のメタデータ（ない場合は絞り込み不可）
+        """
+        self.ids = ids
+        self.vectors = vectors
+        self.texts = texts
+        self.manifest = manifest
+        self.metadata = metadata
+        self._id_order = None
+        self._sorted_ids = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def find_rows(self, message_ids: Sequence[int]) -> np.ndarray:
+        """
+        メッセージIDの行の位置を求める
+
+        初回の呼び出し時にID順の並びを作成し、以降は二分探索で求めます。
+
+        Args:
+            message_ids: メッセージIDの並び
+
+        Returns:
+            message_idsと同じ並びの行の位置（インデックスに含まれないIDは-1）
+        """
+        if self._id_order is None:
+            order = np.argsort(self.ids, kind="stable")
+            self._sorted_ids = np.asarray(self.ids[order])
+            self._id_order = order
+
+        message_ids = np.asarray(message_ids, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            return np.full(len(message_ids), -1, dtype=np.intp)
+        positions = np.minimum(
+            np.searchsorted(self._sorted_ids, message_ids), len(self._sorted_ids) - 1
+        )
+        found = self._sorted_ids[positions] == message_ids
+        return np.where(found, self._id_order[positions], -1).astype(np.intp)
+
+    def rows_for_ids(self, message_ids: Sequence[int]) -> np.ndarray:
+        """
+        メッセージIDの行の位置を求める
+
+        Args:
+            message_ids: メッセージIDの並び
+
+        Returns:
+            インデックスに含まれるIDの行の位置（昇順、含まれないIDは除く）
+        """
+        rows = self.find_rows(message_ids)
+        return np.sort(rows[rows >= 0])
+
+    def search(
+        self, query: np.ndarray, top_k: int, rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        クエリとのコサイン類似度が高い順にtop_k件を検索
+
+        Args:
+            query: クエリの埋め込み
+            top_k: 取得件数
+            rows: 検索対象の行の位置（Noneの場合は全行）
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (行の位置, コサイン類似度)
+        """
+        return search_vectors(self.vectors, query, top_k, rows=rows)
+
+    def search_batch(
+        self, queries: np.ndarray, top_k: int, rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        複数のクエリについて、コサイン類似度が高い順にtop_k件をまとめて検索
+
+        Args:
+            queries: クエリの埋め込みの行列（shape=(クエリ数, 次元数)）
+            top_k: クエリごとの取得件数
+            rows: 検索対象の行の位置（Noneの場合は全行）
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (行の位置, コサイン類似度)の2次元配列
+        """
+        return search_vectors_batch(self.vectors, queries, top_k, rows=rows)
+
+
+def _remove_if_exists(path: str):
+    """ファイルが存在する場合は削除"""
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def read_manifest(index_dir: str = INDEX_DIR) -> Optional[Dict]:
+    """
+    manifest.jsonを読み込む
+
+    Args:
+        index_dir: インデックスのディレクトリ
+
+    Returns:
+        manifestの辞書（存在しない・読み込めない場合はNone）
+    """
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def is_index_fresh(
+    manifest: Optional[Dict], embedding_count: int, embedding_generation: int
+) -> bool:
+    """
+    インデックスがDBの現在の埋め込みと一致しているか判定
+
+    Args:
+        manifest: manifest.jsonの内容
+        embedding_count: DBの埋め込み総数
+        embedding_generation: DBの埋め込み世代番号
+
+    Returns:
+        bool: 一致している場合True
+    """
+    if not manifest:
+        return False
+    return (
+        manifest.get("version") == INDEX_FORMAT_VERSION
+        and manifest.get("embedding_count") == embedding_count
+        and manifest.get("generation") == embedding_generation
+    )
+
+
+def _save_npy(path: str, array: np.ndarray):
+    """拡張子を付け足さずに.npyファイルを保存"""
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
+def write_embedding_index(db, index_dir: str = INDEX_DIR) -> int:
+    """
+    知識DBの埋め込みからインデックスファイルを作成
+
+    行の並びはKnowledgeDB.iter_embeddingsと同じ（新しい順）です。
+    埋め込みはWRITE_PAGE_SIZE件ずつ正規化して書き込むため、作成時のメモリ使用量は
+    件数によらずほぼ一定です。各ファイルは一時ファイルに書き込んでから置き換え、
+    manifest.jsonを最後に書き込むため、作成途中のインデックスは読み込まれません。
+
+    Args:
+        db: KnowledgeDBインスタンス
+        index_dir: インデックスの出力先ディレクトリ
+
+    Returns:
+        インデックスに書き込んだ件数
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+
+    # 作成中は古いインデックスが使われないよう、先にmanifestを削除
+    _remove_if_exists(manifest_path)
+
+    embedding_count = db.get_embedding_count()
+    generation = db.get_embedding_generation()
+
+    rows = db.iter_embeddings(page_size=WRITE_PAGE_SIZE, with_metadata=True)
+    first = next(rows, None)
+    if first is None:
+        return 0
+
+    dim = first[2].shape[0]
+    temp_paths = {
+        name: os.path.join(index_dir, name + ".tmp")
+        for name in (
+            VECTORS_FILE,
+            IDS_FILE,
+            TEXTS_FILE,
+            TEXT_OFFSETS_FILE,
+            CHANNEL_IDS_FILE,
+            CHANNEL_ORDER_FILE,
+            CATEGORY_CODES_FILE,
+            IMPORTANCE_FILE,
+            TIMESTAMPS_FILE,
+        )
+    }
+
+    # 埋め込み総数で確保する（メッセージのない埋め込みがあれば後で切り詰める）
+    vectors = np.lib.format.open_memmap(
+        temp_paths[VECTORS_FILE],
+        mode="w+",
+        dtype=np.float32,
+        shape=(embedding_count, dim),
+    )
+    ids = np.empty(embedding_count, dtype=np.int64)
+    offsets = np.zeros(embedding_count + 1, dtype=np.int64)
+    channel_ids = np.empty(embedding_count, dtype=np.int64)
+    category_codes = np.empty(embedding_count, dtype=np.int32)
+    importance = np.empty(embedding_count, dtype=np.int32)
+    timestamps = np.empty(embedding_count, dtype=np.float64)
+    categories: Dict[str, int] = {}
+
+    count = 0
+    with open(temp_paths[TEXTS_FILE], "wb") as texts_file:
+        rows = chain([first], rows)
+        while True:
+            page = list(islice(rows, WRITE_PAGE_SIZE))
+            if not page:
+                break
+
+            start = count
+            count += len(page)
+            ids[start:count] = [row[0] for row in page]
+            vectors[start:count] = normalize_rows(np.vstack([row[2] for row in page]))
+
+            metadata = [row[3] for row in page]
+            channel_ids[start:count] = [item[0] for item in metadata]
+            category_codes[start:count] = [
+                -1
+                if item[1] is None
+                else categories.setdefault(item[1], len(categories))
+                for item in metadata
+            ]
+            importance[start:count] = [
+                NULL_IMPORTANCE if item[2] is None else item[2] for item in metadata
+            ]
+            timestamps[start:count] = [item[3] for item in metadata]
+
+            encoded = [row[1].encode("utf-8") for row in page]
+            texts_file.write(b"".join(encoded))
+            offsets[start + 1 : count + 1] = offsets[start] + np.cumsum(
+                [len(text) for text in encoded]
+            )
+
+    vectors.flush()
+    if count < embedding_count:
+        trimmed = np.array(vectors[:count])
+        del vectors
+        _save_npy(temp_paths[VECTORS_FILE], trimmed)
+    else:
+        del vectors
+
+    _save_npy(temp_paths[IDS_FILE], ids[:count])
+    _save_npy(temp_paths[TEXT_OFFSETS_FILE], offsets[: count + 1])
+    _save_npy(temp_paths[CHANNEL_IDS_FILE], channel_ids[:count])
+    _save_npy(
+        temp_paths[CHANNEL_ORDER_FILE],
+        np.argsort(channel_ids[:count], kind="stable").astype(np.int64),
+    )
+    _save_npy(temp_paths[CATEGORY_CODES_FILE], category_codes[:count])
+    _save_npy(temp_paths[IMPORTANCE_FILE], importance[:count])
+    _save_npy(temp_paths[TIMESTAMPS_FILE], timestamps[:count])
+
+    for name, temp_path in temp_paths.items():
+        os.replace(temp_path, os.path.join(index_dir, name))
+
+    manifest = {
+        "version": INDEX_FORMAT_VERSION,
+        "count": count,
+        "dim": int(dim),
+        "dtype": "float32",
+        "normalized": True,
+        "embedding_count": embedding_count,
+        "generation": generation,
+        "categories": list(categories),
+    }
+    temp_manifest_path = manifest_path + ".tmp"
+    with open(temp_manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_manifest_path, manifest_path)
+
+    return count
+
+
+def load_embedding_index(
+    index_dir: str = INDEX_DIR,
+    embedding_count: Optional[int] = None,
+    embedding_generation: Optional[int] = None,
+) -> Optional[EmbeddingIndex]:
+    """
+    インデックスファイルをメモリマップで読み込む
+
+    embedding_count/embedding_generationを指定した場合、
+    DBと一致しない（古い）インデックスは読み込みません。
+
+    Args:
+        index_dir: インデックスのディレクトリ
+        embedding_count: DBの埋め込み総数
+        embedding_generation: DBの埋め込み世代番号
+
+    Returns:
+        EmbeddingIndex（存在しない・古い・壊れている場合はNone）
+    """
+    manifest = read_manifest(index_dir)
+    if manifest is None or manifest.get("version") != INDEX_FORMAT_VERSION:
+        return None
+
+    if embedding_count is not None and embedding_generation is not None:
+        if not is_index_fresh(manifest, embedding_count, embedding_generation):
+            return None
+
+    try:
+        vectors = np.load(os.path.join(index_dir, VECTORS_FILE), mmap_mode="r")
+        ids = np.load(os.path.join(index_dir, IDS_FILE), mmap_mode="r")
+        offsets = np.load(os.path.join(index_dir, TEXT_OFFSETS_FILE), mmap_mode="r")
+        metadata = IndexMetadata(
+            np.load(os.path.join(index_dir, CHANNEL_IDS_FILE), mmap_mode="r"),
+            np.load(os.path.join(index_dir, CATEGORY_CODES_FILE), mmap_mode="r"),
+            manifest.get("categories", []),
+            np.load(os.path.join(index_dir, IMPORTANCE_FILE), mmap_mode="r"),
+            np.load(os.path.join(index_dir, TIMESTAMPS_FILE), mmap_mode="r"),
+            np.load(os.path.join(index_dir, CHANNEL_ORDER_FILE), mmap_mode="r"),
+        )
+        texts_path = os.path.join(index_dir, TEXTS_FILE)
+        if os.path.getsize(texts_path) > 0:
+            text_data = np.memmap(texts_path, dtype=np.uint8, mode="r")
+        else:
+            text_data = np.empty(0, dtype=np.uint8)
+    except (OSError, ValueError):
+        return None
+
+    count = manifest.get("count")
+    if (
+        vectors.shape != (count, manifest.get("dim"))
+        or ids.shape != (count,)
+        or offsets.shape != (count + 1,)
+        or any(
+            column.shape != (count,)
+            for column in (
+                metadata.channel_ids,
+                metadata.category_codes,
+                metadata.importance,
+                metadata.timestamps,
+                metadata._channel_order,
+            )
+        )
+    ):
+        return None
+
+    return EmbeddingIndex(
+        ids, vectors, IndexTexts(text_data, offsets), manifest, metadata
+    )
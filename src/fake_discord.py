@@ -0,0 +1,367 @@
+"""
+オフライン計測・テスト用の擬似Discordクライアント
+
+fetch_messages_from_guildが使う範囲（Client.get_guild・fetch_guild、Guild.text_channels、
+TextChannel.history）だけを、discord.pyと同じ条件・順序で再現します。
+履歴は合成データ（build_guild）またはフィクスチャファイル（load_fixture）から
+作成でき、実際のギルドの履歴をフィクスチャに記録することもできます（record_fixture）。
+
+記録の使用例（DISCORD_TOKEN・TARGET_GUILD_IDが必要）:
+    python src/fake_discord.py data/fixture.json --limit 5000
+
+フィクスチャはJSON形式です:
+
+    {
+      "guild_id": 1,
+      "channels": [
+        {
+          "id": 1186...,
+          "name": "general",
+          "messages": [
+            {"id": 1186..., "author_id": 1, "author_name": "user-1",
+             "bot": false, "content": "...", "created_at": "2024-01-01T00:00:00+00:00"}
+          ]
+        }
+      ]
+    }
+
+messagesは古い順に並べます。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import discord
+from discord.utils import time_snowflake
+
+# Discord APIの1リクエストあたりの最大取得件数
+HISTORY_PAGE_SIZE = 100
+
+# 合成メッセージの投稿期間の開始時刻と長さ
+BASE_TIME = datetime(2024, 1, 1, tzinfo=timezone.utc)
+HISTORY_SPAN = timedelta(days=365)
+
+
+class FakeAuthor:
+    """擬似的なメッセージ投稿者"""
+
+    def __init__(self, author_id, bot=False, name=None):
+        self.id = author_id
+        self.bot = bot
+        self.name = name or f"user-{author_id}"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMessage:
+    """擬似的なメッセージ"""
+
+    def __init__(self, message_id, author, content, created_at):
+        self.id = message_id
+        self.author = author
+        self.content = content
+        self.created_at = created_at
+
+
+class FakeRateLimit:
+    """
+    一定時間あたりのリクエスト数の上限を模した擬似レート制限
+
+    上限を超えたリクエストは、discord.pyが429応答を受けた場合と同様に
+    制限が解除されるまで待機します。ギルド内の全チャンネルで共有します。
+    """
+
+    def __init__(self, requests, period):
+        """
+        Args:
+            requests: period秒あたりのリクエスト数の上限
+            period: 制限の単位時間（秒）
+        """
+        self.requests = requests
+        self.period = period
+        self.window_start = None
+        self.used = 0
+        self.hits = 0  # 制限に達して待機した回数
+        self.waited = 0.0  # 待機した時間の合計（秒）
+
+    async def acquire(self):
+        """1リクエスト分の枠を確保（上限に達している場合は解除まで待機）"""
+        while True:
+            now = time.monotonic()
+            if self.window_start is None or now - self.window_start >= self.period:
+                self.window_start = now
+                self.used = 0
+            if self.used < self.requests:
+                self.used += 1
+                return
+            retry_after = self.period - (now - self.window_start)
+            self.hits += 1
+            self.waited += retry_after
+            await asyncio.sleep(retry_after)
+
+
+class FakeChannel:
+    """1ページごとに遅延を入れてhistoryを返す擬似テキストチャンネル"""
+
+    def __init__(self, channel_id, name, messages, page_latency=0.0, rate_limit=None):
+        """
+        Args:
+            channel_id: チャンネルID
+            name: チャンネル名
+            messages: 古い順のFakeMessageのリスト
+            page_latency: 1ページ取得あたりの遅延（秒）
+            rate_limit: 共有するFakeRateLimit（Noneの場合は制限なし）
+        """
+        self.id = channel_id
+        self.name = name
+        self.messages = messages
+        self.page_latency = page_latency
+        self.rate_limit = rate_limit
+        self.requests = 0  # historyのページ取得回数
+
+    async def history(self, limit=None, before=None, after=None, oldest_first=None):
+        """discord.TextChannel.historyと同じ条件・順序で返す"""
+        if oldest_first is None:
+            oldest_first = after is not None
+        messages = [
+            m
+            for m in self.messages
+            if (before is None or m.id < before.id)
+            and (after is None or m.id > after.id)
+        ]
+        if not oldest_first:
+            messages.reverse()
+        if limit is not None:
+            messages = messages[:limit]
+
+        for start in range(0, len(messages), HISTORY_PAGE_SIZE):
+            if self.rate_limit is not None:
+                await self.rate_limit.acquire()
+            self.requests += 1
+            await asyncio.sleep(self.page_latency)
+            for message in messages[start : start + HISTORY_PAGE_SIZE]:
+                yield message
+
+
+class FakeGuild:
+    """擬似的なギルド"""
+
+    def __init__(self, guild_id, text_channels):
+        self.id = guild_id
+        self.text_channels = text_channels
+
+    @property
+    def message_count(self):
+        """全チャンネルのメッセージ数"""
+        return sum(len(channel.messages) for channel in self.text_channels)
+
+
+class FakeClient:
+    """get_guild・fetch_guildのみを持つ擬似的なDiscord Client"""
+
+    def __init__(self, guild):
+        self.guild = guild
+
+    def get_guild(self, guild_id):
+        return self.guild if guild_id == self.guild.id else None
+
+    async def fetch_guild(self, guild_id):
+        if guild_id == self.guild.id:
+            return self.guild
+        response = SimpleNamespace(status=404, reason="Not Found")
+        raise discord.NotFound(response, "Unknown Guild")
+
+
+def build_guild(channel_count, messages_per_channel, page_latency=0.0, rate_limit=None):
+    """
+    合成メッセージを持つ擬似ギルドを作成
+
+    メッセージIDは投稿時刻から求めたスノーフレークです。実際のサーバーと同様に
+    最近ほど投稿が多くなるよう、投稿時刻は期間の後半ほど密に分布させます。
+
+    Args:
+        channel_count: チャンネル数
+        messages_per_channel: 1チャンネルあたりのメッセージ数
+        page_latency: 1ページ取得あたりの遅延（秒）
+        rate_limit: 全チャンネルで共有するFakeRateLimit
+
+    Returns:
+        FakeGuild
+    """
+    channels = []
+    for channel_index in range(channel_count):
+        messages = []
+        for i in range(messages_per_channel):
+            # 10件に1件はBotの投稿（取得時に除外される）
+            author = FakeAuthor(i % 50, bot=(i % 10 == 0))
+            created_at = (
+                BASE_TIME + HISTORY_SPAN * ((i + 1) / messages_per_channel) ** 0.5
+            )
+            # 下位22ビット（同一時刻内の識別子）にチャンネル番号と連番を入れる
+            message_id = time_snowflake(created_at) + (channel_index << 12) + i % 4096
+            messages.append(
+                FakeMessage(
+                    message_id,
+                    author,
+                    f"チャンネル{channel_index}のメッセージ {i}",
+                    created_at,
+                )
+            )
+        channels.append(
+            FakeChannel(
+                time_snowflake(BASE_TIME) + channel_index,
+                f"channel-{channel_index}",
+                messages,
+                page_latency,
+                rate_limit,
+            )
+        )
+    return FakeGuild(1, channels)
+
+
+def message_to_fixture(message):
+    """メッセージをフィクスチャの辞書に変換"""
+    return {
+        "id": message.id,
+        "author_id": message.author.id,
+        "author_name": str(message.author),
+        "bot": message.author.bot,
+        "content": message.content,
+        "created_at": message.created_at.isoformat(),
+    }
+
+
+def save_fixture(guild, path):
+    """
+    ギルドの履歴をフィクスチャファイルに保存
+
+    Args:
+        guild: FakeGuild
+        path: 保存先のパス
+    """
+    fixture = {
+        "guild_id": guild.id,
+        "channels": [
+            {
+                "id": channel.id,
+                "name": channel.name,
+                "messages": [message_to_fixture(m) for m in channel.messages],
+            }
+            for channel in guild.text_channels
+        ],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(fixture, f, ensure_ascii=False)
+
+
+def load_fixture(path, page_latency=0.0, rate_limit=None):
+    """
+    フィクスチャファイルから擬似ギルドを作成
+
+    Args:
+        path: フィクスチャファイルのパス
+        page_latency: 1ページ取得あたりの遅延（秒）
+        rate_limit: 全チャンネルで共有するFakeRateLimit
+
+    Returns:
+        FakeGuild
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        fixture = json.load(f)
+
+    authors = {}
+    channels = []
+    for channel_data in fixture["channels"]:
+        messages = []
+        for data in channel_data["messages"]:
+            author_key = (data["author_id"], data["bot"])
+            if author_key not in authors:
+                authors[author_key] = FakeAuthor(
+                    data["author_id"], bot=data["bot"], name=data["author_name"]
+                )
+            messages.append(
+                FakeMessage(
+                    data["id"],
+                    authors[author_key],
+                    data["content"],
+                    datetime.fromisoformat(data["created_at"]),
+                )
+            )
+        messages.sort(key=lambda m: m.id)
+        channels.append(
+            FakeChannel(
+                channel_data["id"],
+                channel_data["name"],
+                messages,
+                page_latency,
+                rate_limit,
+            )
+        )
+    return FakeGuild(fixture["guild_id"], channels)
+
+
+async def record_fixture(guild, path, limit=None):
+    """
+    実際のギルドの履歴をフィクスチャファイルに記録
+
+    Args:
+        guild: discord.Guild
+        path: 保存先のパス
+        limit: 1チャンネルあたりの最大件数（Noneの場合は全件）
+    """
+    channels = []
+    for channel in guild.text_channels:
+        try:
+            messages = [
+                message
+                async for message in channel.history(limit=limit, oldest_first=True)
+            ]
+        except discord.Forbidden:
+            print(f"⚠️  チャンネル (ID: {channel.id}) をスキップ: アクセス権限がありません")
+            continue
+        print(f"📝 チャンネル (ID: {channel.id}): {len(messages)}件を記録")
+        channels.append(FakeChannel(channel.id, channel.name, messages))
+    save_fixture(FakeGuild(guild.id, channels), path)
+
+
+def main():
+    """実際のギルドの履歴をフィクスチャファイルに記録"""
+    parser = argparse.ArgumentParser(description="ギルドの履歴をフィクスチャに記録")
+    parser.add_argument("path", help="保存先のパス")
+    parser.add_argument("--limit", type=int, default=None, help="1チャンネルあたりの最大件数")
+    args = parser.parse_args()
+
+    token = os.environ.get("DISCORD_TOKEN")
+    guild_id_str = os.environ.get("TARGET_GUILD_ID")
+    if not token or not guild_id_str:
+        print("❌ エラー: 環境変数 DISCORD_TOKEN と TARGET_GUILD_ID を設定してください")
+        sys.exit(1)
+
+    intents = discord.Intents.default()
+    intents.message_content = True
+    client = discord.Client(intents=intents)
+
+    @client.event
+    async def on_ready():
+        try:
+            guild = client.get_guild(int(guild_id_str))
+            if guild is None:
+                print(f"❌ エラー: ギルド (ID: {guild_id_str}) が見つかりません")
+                return
+            await record_fixture(guild, args.path, args.limit)
+            print(f"💾 フィクスチャを保存しました: {args.path}")
+        finally:
+            await client.close()
+
+    client.run(token)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,20 @@ Discord メッセージ取得スクリプト
 
 指定されたDiscordサーバーから過去のメッセージを取得し、
 SQLiteデータベースに保存します。
-既存のメッセージはスキップされ、新規メッセージのみが追加されます（増分更新）。
+データベースにはチャンネルごとの取得済み位置（最新メッセージID）を記録し、
+2回目以降はその位置より新しいメッセージのみを取得します（増分更新）。
+FULL_RESYNC=trueの場合は全履歴を再取得し、編集された本文なども反映します。
+EMBED_DURING_FETCH=trueの場合は、保存したメッセージの埋め込みも取得と並行して
+生成します（ingest_pipeline.py）。
 """
 
+import asyncio
 import json
 import os
 import sys
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import discord
 
@@ -19,10 +26,15 @@ from knowledge_db import KnowledgeDB
 # 環境変数から設定を読み取る
 TOKEN = os.environ.get("DISCORD_TOKEN")
 GUILD_ID_STR = os.environ.get("TARGET_GUILD_ID")
-EXCLUDED_CHANNELS_STR = os.environ.get(
-    "EXCLUDED_CHANNELS", ""
-)  # カンマ区切りのチャンネル名
+EXCLUDED_CHANNELS_STR = os.environ.get("EXCLUDED_CHANNELS", "")  # カンマ区切りのチャンネル名
 USE_JSON_FALLBACK = os.environ.get("USE_JSON_FALLBACK", "false").lower() == "true"
+FULL_RESYNC = os.environ.get("FULL_RESYNC", "false").lower() == "true"
+# 取得と並行して埋め込みを生成する（DBモードのみ）
+EMBED_DURING_FETCH = os.environ.get("EMBED_DURING_FETCH", "false").lower() == "true"
+FETCH_CONCURRENCY_STR = os.environ.get("FETCH_CONCURRENCY", "")  # 同時に取得するチャンネル数
+FETCH_TIME_BUDGET_STR = os.environ.get("FETCH_TIME_BUDGET", "")  # 取得時間の上限（秒）
+# 1チャンネルの全履歴を同時に取得する範囲の最大数
+FETCH_CHANNEL_WINDOWS_STR = os.environ.get("FETCH_CHANNEL_WINDOWS", "")
 
 # データ保存先
 DATA_DIR = os.path.join(os.path.dirname(__file__), "../data")
@@ -31,6 +43,19 @@ DB_PATH = os.path.join(DATA_DIR, "knowledge.db")
 
 # デフォルト設定 - DB使用時は上限なし
 DEFAULT_MESSAGE_LIMIT = None  # Noneの場合は全メッセージを取得
+DEFAULT_FETCH_CONCURRENCY = 4
+DEFAULT_FETCH_BATCH_SIZE = 1000  # 1回の書き込みにまとめる件数
+DEFAULT_CHANNEL_WINDOWS = 4  # 1チャンネルの全履歴を同時に取得する範囲の最大数
+
+# 全履歴の範囲分割: チャンネルの期間をWINDOW_PROBE_COUNT区間に分け、
+# 各区間の末尾からWINDOW_PROBE_SIZE件を取得してメッセージの密度を推定する
+WINDOW_PROBE_COUNT = 8
+WINDOW_PROBE_SIZE = 100  # Discord APIの1リクエストあたりの最大取得件数
+# 1範囲あたりの推定件数の下限（これより少ないチャンネルは分割しない）
+MIN_WINDOW_MESSAGES = 5000
+
+# 保存件数がこの件数増えるごとに進捗を表示
+PROGRESS_INTERVAL = 10000
 
 
 def validate_environment():
@@ -52,6 +77,43 @@ def validate_environment():
     return True
 
 
+def get_fetch_concurrency():
+    """環境変数FETCH_CONCURRENCYから同時取得数を取得（未設定・不正な値は既定値）"""
+    try:
+        concurrency = int(FETCH_CONCURRENCY_STR)
+    except ValueError:
+        return DEFAULT_FETCH_CONCURRENCY
+    return max(1, concurrency)
+
+
+def get_channel_windows():
+    """環境変数FETCH_CHANNEL_WINDOWSから1チャンネルの同時取得範囲数を取得"""
+    try:
+        windows = int(FETCH_CHANNEL_WINDOWS_STR)
+    except ValueError:
+        return DEFAULT_CHANNEL_WINDOWS
+    return max(1, windows)
+
+
+def get_fetch_deadline(started):
+    """
+    環境変数FETCH_TIME_BUDGETから取得時間の上限を求める
+
+    Args:
+        started: スクリプト開始時のtime.monotonic()の値
+
+    Returns:
+        上限のtime.monotonic()の値（未設定・不正な値の場合はNone）
+    """
+    try:
+        budget = float(FETCH_TIME_BUDGET_STR)
+    except ValueError:
+        return None
+    if budget <= 0:
+        return None
+    return started + budget
+
+
 def ensure_data_directory():
     """dataディレクトリの存在を確認し、必要に応じて作成"""
     if not os.path.exists(DATA_DIR):
@@ -59,23 +121,494 @@ def ensure_data_directory():
         print(f"📁 dataディレクトリを作成しました: {DATA_DIR}")
 
 
+def message_to_dict(message, channel):
+    """
+    Discordのメッセージをmessagesテーブルの形式の辞書に変換
+
+    Args:
+        message: discord.Message
+        channel: メッセージのチャンネル
+
+    Returns:
+        メッセージデータの辞書
+    """
+    return {
+        "id": message.id,
+        "channel_id": channel.id,
+        "channel_name": channel.name,
+        "author_id": message.author.id,
+        "author_name": str(message.author),
+        "content": message.content,
+        "created_at": message.created_at.isoformat(),
+        "timestamp": message.created_at.timestamp(),
+    }
+
+
+def is_knowledge_message(message):
+    """Botの投稿や本文が空のメッセージを除外する"""
+    return not message.author.bot and bool(message.content.strip())
+
+
+class FetchStats:
+    """メッセージ取得の進捗カウンター（取得中も随時更新される）"""
+
+    def __init__(self):
+        self.channels = 0  # 取得が完了したチャンネル数
+        self.fetched = 0  # Botの投稿なども含めて取得した件数
+        self.saved = 0  # 保存対象として書き込んだ件数
+        self.inserted = 0  # 新規追加した件数
+        self.updated = 0  # 既存メッセージを更新した件数（全件再取得時のみ）
+        self.batches = 0  # 書き込んだバッチ数
+        self.interrupted = 0  # 取得時間の上限により中断・未着手のチャンネル数
+        self.elapsed = 0.0  # 取得開始から全バッチの保存までの時間
+        self.write_seconds = 0.0  # DBへの書き込みにかかった時間の合計
+        self.max_queue_depth = 0  # 書き込みキューの最大の待ちバッチ数
+        self.messages = []  # JSONモードでのみ保持するメッセージ
+
+    def summary(self):
+        """進捗を1行の文字列で返す"""
+        text = f"取得: {self.fetched:,}件, 保存: {self.saved:,}件（新規: {self.inserted:,}件"
+        if self.updated:
+            text += f", 更新: {self.updated:,}件"
+        return text + "）"
+
+
+def is_past_deadline(deadline):
+    """取得時間の上限（time.monotonic()の値）を過ぎたか判定"""
+    return deadline is not None and time.monotonic() >= deadline
+
+
+async def fetch_new_messages(
+    channel,
+    queue,
+    stats,
+    after,
+    message_limit=DEFAULT_MESSAGE_LIMIT,
+    batch_size=DEFAULT_FETCH_BATCH_SIZE,
+    deadline=None,
+):
+    """
+    取得済み位置より新しいメッセージを古い順に取得し、書き込みキューに送る
+
+    古い順に取得するため、バッチごとにその時点の最新メッセージを
+    取得済み位置として記録できます（中断しても次回は続きから取得）。
+
+    キューには(channel, メッセージのリスト, 取得済み位置として記録する
+    メッセージ, チェックポイント)を送ります。キューが満杯の間は取得を
+    待機するため、未保存のメッセージはキューの上限分までしかメモリに
+    保持されません。
+
+    Args:
+        channel: テキストチャンネル
+        queue: 書き込みキュー
+        stats: 進捗カウンター
+        after: このメッセージより新しいメッセージのみを取得
+        message_limit: 取得する最大メッセージ数
+        batch_size: 1回の書き込みにまとめる件数
+        deadline: 取得時間の上限（time.monotonic()の値、Noneの場合は無制限）
+
+    Returns:
+        Tuple[int, int, bool]: (除外分も含めた取得件数, 保存対象の件数,
+            最後まで取得した場合True)
+    """
+    batch = []
+    fetched = 0
+    kept = 0
+    # Botの投稿などで除外したメッセージも含めた最新のメッセージ
+    newest = None
+
+    async for message in channel.history(limit=message_limit, after=after):
+        fetched += 1
+        stats.fetched += 1
+        newest = message
+        if is_knowledge_message(message):
+            batch.append(message_to_dict(message, channel))
+
+        stopping = is_past_deadline(deadline)
+        if len(batch) >= batch_size or stopping:
+            kept += len(batch)
+            await queue.put((channel, batch, newest, None))
+            batch = []
+        if stopping:
+            return fetched, kept, False
+
+    kept += len(batch)
+    if newest is not None:
+        await queue.put((channel, batch, newest, None))
+
+    return fetched, kept, True
+
+
+async def backfill_channel_messages(
+    channel,
+    queue,
+    stats,
+    checkpoint,
+    message_limit=DEFAULT_MESSAGE_LIMIT,
+    batch_size=DEFAULT_FETCH_BATCH_SIZE,
+    deadline=None,
+):
+    """
+    チャンネルの1範囲の履歴を新しい順に取得し、書き込みキューに送る
+
+    範囲(range_start, range_end)のうち、cursor（保存済みの最も古いメッセージID）
+    より古いメッセージを取得します。バッチごとにcursorを進めたチェックポイントを
+    送るため、中断した場合も次回は続きから取得します。
+    範囲の取得が完了すると、complete=Trueのチェックポイントを送ります。
+
+    Args:
+        channel: テキストチャンネル
+        queue: 書き込みキュー
+        stats: 進捗カウンター
+        checkpoint: 取得する範囲のチェックポイント
+            （KnowledgeDB.get_crawl_checkpointsの要素と同じ形式）
+        message_limit: 取得する最大メッセージ数
+        batch_size: 1回の書き込みにまとめる件数
+        deadline: 取得時間の上限（time.monotonic()の値、Noneの場合は無制限）
+
+    Returns:
+        Tuple[int, int, bool]: (除外分も含めた取得件数, 保存対象の件数,
+            最後まで取得した場合True)
+    """
+    progress = {
+        key: checkpoint[key]
+        for key in (
+            "range_start",
+            "range_end",
+            "cursor",
+            "last_message_id",
+            "last_timestamp",
+        )
+    }
+    before = discord.Object(id=checkpoint["cursor"] or checkpoint["range_end"])
+    after = None
+    if checkpoint["range_start"] > 0:
+        after = discord.Object(id=checkpoint["range_start"])
+
+    batch = []
+    fetched = 0
+    kept = 0
+
+    async for message in channel.history(
+        limit=message_limit, before=before, after=after, oldest_first=False
+    ):
+        fetched += 1
+        stats.fetched += 1
+        progress["cursor"] = message.id
+        if is_knowledge_message(message):
+            batch.append(message_to_dict(message, channel))
+
+        stopping = is_past_deadline(deadline)
+        if len(batch) >= batch_size or stopping:
+            kept += len(batch)
+            await queue.put((channel, batch, None, dict(progress, complete=False)))
+            batch = []
+        if stopping:
+            return fetched, kept, False
+
+    kept += len(batch)
+    await queue.put((channel, batch, None, dict(progress, complete=True)))
+
+    return fetched, kept, True
+
+
+def plan_windows(lower, upper, densities, max_windows, min_window_messages):
+    """
+    推定したメッセージの密度から、推定件数がほぼ等しくなる範囲の境界を求める
+
+    メッセージIDはスノーフレーク（上位ビットが投稿時刻）のため、ID空間上で
+    分割すると時間範囲での分割になります。[lower, upper)をlen(densities)個の
+    区間に等分し、各区間の密度（IDあたりの件数）から累積件数を求めて分割します。
+
+    Args:
+        lower: 範囲の下限ID
+        upper: 範囲の上限ID
+        densities: 各区間の推定密度（古い区間から順）
+        max_windows: 最大範囲数
+        min_window_messages: 1範囲あたりの推定件数の下限
+
+    Returns:
+        List[int]: 境界IDのリスト（先頭がlower、末尾がupper、範囲数は要素数-1）
+    """
+    if upper <= lower or not densities:
+        return [lower, upper]
+
+    step = (upper - lower) / len(densities)
+    counts = [density * step for density in densities]
+    total = sum(counts)
+    windows = int(min(max_windows, total // max(1, min_window_messages)))
+    if windows <= 1:
+        return [lower, upper]
+
+    target = total / windows
+    bounds = [lower]
+    accumulated = 0.0
+    for index, count in enumerate(counts):
+        segment_start = lower + index * step
+        # この区間内で累積件数がtargetの倍数を超える位置で分割
+        while (
+            count > 0
+            and len(bounds) < windows
+            and accumulated + count >= target * len(bounds)
+        ):
+            needed = target * len(bounds) - accumulated
+            bound = int(segment_start + step * needed / count)
+            if bound <= bounds[-1] or bound >= upper:
+                break
+            bounds.append(bound)
+        accumulated += count
+
+    bounds.append(upper)
+    return bounds
+
+
+async def estimate_density(channel, segment_start, segment_end):
+    """
+    区間(segment_start, segment_end)の末尾からメッセージを取得して密度を推定
+
+    Returns:
+        float: IDあたりのメッセージ件数
+    """
+    messages = [
+        message
+        async for message in channel.history(
+            limit=WINDOW_PROBE_SIZE, before=discord.Object(id=segment_end)
+        )
+    ]
+    in_segment = [message for message in messages if message.id > segment_start]
+    if len(in_segment) == WINDOW_PROBE_SIZE:
+        # 取得した件数がちょうど区間内に収まる場合は、その期間の密度
+        return WINDOW_PROBE_SIZE / max(1, segment_end - in_segment[-1].id)
+    # 区間内のメッセージを全て取得できた
+    return len(in_segment) / max(1, segment_end - segment_start)
+
+
+async def plan_channel_windows(channel, max_windows):
+    """
+    チャンネルの全履歴を同時に取得する範囲に分割
+
+    最新のメッセージと、チャンネル作成時刻（チャンネルIDのスノーフレーク）の
+    間をWINDOW_PROBE_COUNT区間に分けて各区間の密度を推定し、
+    推定件数がほぼ等しくなるよう範囲を決めます。
+
+    Args:
+        channel: テキストチャンネル
+        max_windows: 最大範囲数
+
+    Returns:
+        List[Dict]: 新しい範囲から順のチェックポイントのリスト
+            （メッセージがない場合は空リスト）
+    """
+    latest = [message async for message in channel.history(limit=WINDOW_PROBE_SIZE)]
+    if not latest:
+        return []
+
+    newest = latest[0]
+    lower = min(channel.id, latest[-1].id - 1)
+    upper = newest.id + 1
+    bounds = [lower, upper]
+
+    # 1ページに収まらないチャンネルのみ密度を推定して分割
+    if max_windows > 1 and len(latest) == WINDOW_PROBE_SIZE:
+        step = (upper - lower) / WINDOW_PROBE_COUNT
+        densities = await asyncio.gather(
+            *(
+                estimate_density(
+                    channel, int(lower + index * step), int(lower + (index + 1) * step)
+                )
+                for index in range(WINDOW_PROBE_COUNT)
+            )
+        )
+        bounds = plan_windows(lower, upper, densities, max_windows, MIN_WINDOW_MESSAGES)
+
+    # 最も古い範囲は下限なし（range_start=0）で取得する
+    bounds[0] = 0
+    return [
+        {
+            "range_start": bounds[index],
+            "range_end": bounds[index + 1],
+            "cursor": None,
+            "complete": False,
+            "last_message_id": newest.id,
+            "last_timestamp": newest.created_at.timestamp(),
+        }
+        for index in reversed(range(len(bounds) - 1))
+    ]
+
+
+async def backfill_channel_windows(
+    channel,
+    queue,
+    stats,
+    checkpoints,
+    message_limit=DEFAULT_MESSAGE_LIMIT,
+    batch_size=DEFAULT_FETCH_BATCH_SIZE,
+    deadline=None,
+):
+    """
+    チャンネルの未完了の範囲を同時に取得
+
+    いずれかの範囲の取得が失敗した場合は、残りの範囲の取得を中止して
+    終了を待ってからエラーを伝えます。
+
+    Returns:
+        Tuple[int, int, bool]: (除外分も含めた取得件数, 保存対象の件数,
+            全範囲を最後まで取得した場合True)
+    """
+    tasks = [
+        asyncio.ensure_future(
+            backfill_channel_messages(
+                channel, queue, stats, checkpoint, message_limit, batch_size, deadline
+            )
+        )
+        for checkpoint in checkpoints
+        if not checkpoint["complete"]
+    ]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return (
+        sum(result[0] for result in results),
+        sum(result[1] for result in results),
+        all(result[2] for result in results),
+    )
+
+
+def save_batch(db, channel, messages, mark, checkpoint, full_resync):
+    """
+    メッセージのバッチを保存し、続けて取得済み位置・チェックポイントを記録する
+
+    Returns:
+        Tuple[int, int]: (新規追加件数, 更新件数)
+    """
+    inserted = updated = 0
+    if messages:
+        if full_resync:
+            inserted, updated, _ = db.upsert_messages_batch(messages)
+        else:
+            inserted, _ = db.insert_messages_batch(messages)
+    if mark is not None:
+        db.update_channel_sync_state(
+            channel.id, channel.name, mark.id, mark.created_at.timestamp()
+        )
+    if checkpoint is not None:
+        db.save_crawl_checkpoint(channel.id, channel.name, **checkpoint)
+    return inserted, updated
+
+
+async def write_batches(queue, stats, db=None, full_resync=False, saved_queue=None):
+    """
+    書き込みキューのバッチを順に保存する（Noneを受け取ると終了）
+
+    DBへの書き込みは専用スレッドで行うため、書き込み中もチャンネルの取得は
+    継続します。キューは1つのタスクが順に処理するため、同じチャンネルの
+    取得済み位置・チェックポイントは必ずそれ以前のバッチを保存した後に
+    記録されます。
+
+    saved_queueを指定した場合、保存したメッセージのリストを送ります
+    （後段の処理が詰まっている間は保存も待機する）。
+    """
+    loop = asyncio.get_running_loop()
+    next_progress = PROGRESS_INTERVAL
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        while True:
+            stats.max_queue_depth = max(stats.max_queue_depth, queue.qsize())
+            item = await queue.get()
+            if item is None:
+                break
+
+            channel, messages, mark, checkpoint = item
+            if db is not None:
+                began = time.perf_counter()
+                inserted, updated = await loop.run_in_executor(
+                    executor,
+                    save_batch,
+                    db,
+                    channel,
+                    messages,
+                    mark,
+                    checkpoint,
+                    full_resync,
+                )
+                stats.write_seconds += time.perf_counter() - began
+                stats.inserted += inserted
+                stats.updated += updated
+            else:
+                stats.messages.extend(messages)
+                stats.inserted += len(messages)
+            stats.saved += len(messages)
+            stats.batches += 1
+            if saved_queue is not None and messages:
+                await saved_queue.put(messages)
+
+            if stats.saved >= next_progress:
+                print(f"   💾 {stats.summary()}, 書き込み待ち: {queue.qsize()}バッチ")
+                next_progress = stats.saved + PROGRESS_INTERVAL
+
+
 async def fetch_messages_from_guild(
-    client, guild_id, message_limit=DEFAULT_MESSAGE_LIMIT, excluded_channels=None
+    client,
+    guild_id,
+    message_limit=DEFAULT_MESSAGE_LIMIT,
+    excluded_channels=None,
+    db=None,
+    full_resync=False,
+    concurrency=DEFAULT_FETCH_CONCURRENCY,
+    batch_size=DEFAULT_FETCH_BATCH_SIZE,
+    deadline=None,
+    windows=DEFAULT_CHANNEL_WINDOWS,
+    saved_queue=None,
 ):
     """
     指定されたギルドからメッセージを取得
 
+    最大concurrency個のチャンネルを同時に取得します。Discordのレート制限は
+    エンドポイント（チャンネル）ごとに適用され、制限に達した場合の待機は
+    discord.pyが行うため、同時取得数を増やしても制限を超えることはありません。
+
+    取得したメッセージはbatch_size件ずつ上限付きのキューに送られ、
+    取得と並行して保存されます。dbを指定した場合はメモリ使用量がギルドの
+    規模によらず一定で、途中で失敗してもそれまでの分は保存済みです。
+    チャンネルの取得済み位置はメッセージの保存後に記録され、次回は
+    記録した位置より新しいメッセージのみを取得します
+    （位置が未記録のチャンネルは全履歴を取得）。
+
+    全履歴の取得はバッチごとにチェックポイントを記録するため、deadlineで
+    中断した場合やエラーで停止した場合も、次回は続きから取得します。
+    メッセージの多いチャンネルの全履歴は、メッセージIDの範囲で最大windows個に
+    分割して同時に取得します（範囲はメッセージの密度から推定件数が揃うよう決定）。
+
     Args:
         client: Discord Client
         guild_id: ギルドID
         message_limit: 各チャンネルから取得する最大メッセージ数
         excluded_channels: 除外するチャンネル名のセット（オプション）
+        db: 保存先のKnowledgeDB（省略時はメッセージをFetchStats.messagesに保持）
+        full_resync: Trueの場合は取得済み位置を無視して全履歴を再取得し、
+            既存メッセージの編集も反映する
+        concurrency: 同時に取得するチャンネル数
+        batch_size: 1回の書き込みにまとめる件数
+        deadline: 取得時間の上限（time.monotonic()の値、Noneの場合は無制限）。
+            上限を過ぎると取得中のバッチを保存して中断する
+        windows: 1チャンネルの全履歴を同時に取得する範囲の最大数
+        saved_queue: 保存したメッセージのリストを送るキュー（オプション）
 
     Returns:
-        メッセージのリスト
+        FetchStats（ギルドが見つからない場合はNone）
     """
     if excluded_channels is None:
         excluded_channels = set()
+    sync_states = {}
+    checkpoints = {}
+    if db is not None:
+        checkpoints = db.get_crawl_checkpoints()
+        if not full_resync:
+            sync_states = db.get_channel_sync_states()
     guild = client.get_guild(guild_id)
 
     if guild is None:
@@ -91,56 +624,142 @@ async def fetch_messages_from_guild(
             return None
 
     print(f"✅ ギルド (ID: {guild.id}) に接続しました")
-    print(f"📊 チャンネル数: {len(guild.text_channels)}")
+    print(f"📊 チャンネル数: {len(guild.text_channels)}（同時取得数: {concurrency}）")
     print()
 
-    all_messages = []
-
+    channels = []
     for channel in guild.text_channels:
         # 除外チャンネルリストに含まれている場合はスキップ
         if channel.name in excluded_channels:
-            print(
-                f"⏩ チャンネル (ID: {channel.id}) をスキップ（除外リストに含まれています）"
-            )
+            print(f"⏩ チャンネル (ID: {channel.id}) をスキップ（除外リストに含まれています）")
             continue
+        channels.append(channel)
+
+    concurrency = max(1, concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    # 未保存のメッセージはおよそ(同時取得数 × 2)バッチ分まで
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    stats = FetchStats()
+
+    async def crawl(channel):
+        async with semaphore:
+            if is_past_deadline(deadline):
+                stats.interrupted += 1
+                return
 
-        print(f"📝 チャンネル (ID: {channel.id}) からメッセージを取得中...")
+            began = time.perf_counter()
+            fetched = kept = 0
+            finished = True
+            try:
+                if channel.id in checkpoints:
+                    # 前回中断した全履歴の取得を再開
+                    label = "全履歴（再開）"
+                    channel_checkpoints = checkpoints[channel.id]
+                elif channel.id in sync_states:
+                    label = "新着"
+                    channel_checkpoints = None
+                else:
+                    label = "全履歴"
+                    channel_checkpoints = await plan_channel_windows(channel, windows)
+                    # 範囲の計画を先に記録しておく（キューの順に保存されるため、
+                    # どの範囲の完了よりも前に全範囲が記録される）
+                    for checkpoint in channel_checkpoints:
+                        await queue.put((channel, [], None, checkpoint))
+
+                if channel_checkpoints is None:
+                    after = discord.Object(
+                        id=sync_states[channel.id]["last_message_id"]
+                    )
+                    fetched, kept, finished = await fetch_new_messages(
+                        channel,
+                        queue,
+                        stats,
+                        after,
+                        message_limit,
+                        batch_size,
+                        deadline,
+                    )
+                else:
+                    pending = [c for c in channel_checkpoints if not c["complete"]]
+                    if len(pending) > 1:
+                        label += f" {len(pending)}範囲"
+                    fetched, kept, finished = await backfill_channel_windows(
+                        channel,
+                        queue,
+                        stats,
+                        channel_checkpoints,
+                        message_limit,
+                        batch_size,
+                        deadline,
+                    )
+            except discord.Forbidden:
+                print(f"⚠️  チャンネル (ID: {channel.id}) をスキップ: アクセス権限がありません")
+                return
+            except Exception as e:
+                print(f"⚠️  チャンネル (ID: {channel.id}) でエラー: {e}")
+                return
 
-        try:
-            messages = []
-            # チャンネルごとにメッセージをバッチで取得して一度に追加（パフォーマンス最適化）
-            channel_messages = [
-                {
-                    "id": message.id,
-                    "channel_id": channel.id,
-                    "channel_name": channel.name,
-                    "author_id": message.author.id,
-                    "author_name": str(message.author),
-                    "content": message.content,
-                    "created_at": message.created_at.isoformat(),
-                    "timestamp": message.created_at.timestamp(),
-                }
-                async for message in channel.history(limit=message_limit)
-                if not message.author.bot and message.content.strip()
-            ]
-            messages.extend(channel_messages)
+            elapsed = time.perf_counter() - began
+            rate = fetched / elapsed if elapsed > 0 else 0.0
+            if finished:
+                stats.channels += 1
+            else:
+                stats.interrupted += 1
+                label += " ⏸ 時間切れのため中断"
+            print(
+                f"📝 チャンネル (ID: {channel.id}) {label}: {kept}件を取得"
+                f"（{fetched}件 / {elapsed:.1f}秒, {rate:.0f}件/秒）"
+            )
 
-            all_messages.extend(messages)
-            print(f"   → {len(messages)}件のメッセージを取得")
+    began = time.perf_counter()
+    writer = asyncio.ensure_future(
+        write_batches(queue, stats, db, full_resync, saved_queue)
+    )
+    crawls = [asyncio.ensure_future(crawl(channel)) for channel in channels]
+    crawler = asyncio.gather(*crawls)
 
-        except discord.Forbidden:
-            print("   ⚠️  スキップ: アクセス権限がありません")
-        except Exception as e:
-            print(f"   ⚠️  エラー: {e}")
+    try:
+        # 書き込みが失敗した場合は取得を中断してエラーを伝える
+        await asyncio.wait({writer, crawler}, return_when=asyncio.FIRST_COMPLETED)
+        if writer.done():
+            crawler.cancel()
+            writer.result()
+        await crawler
+    except BaseException:
+        # 取得・書き込みの全てのタスクを終了させてからエラーを伝える
+        # （gatherは中止した最初のタスクの終了で完了するため、各タスクの終了を待つ。
+        # 保存されなかったバッチはチェックポイントも記録されないため、
+        # 次回の実行で取得し直す）
+        crawler.cancel()
+        writer.cancel()
+        await asyncio.gather(*crawls, writer, return_exceptions=True)
+        raise
+    await queue.put(None)
+    await writer
+    stats.elapsed = time.perf_counter() - began
 
     print()
-    print(f"✅ 合計 {len(all_messages)}件のメッセージを取得しました")
+    print(f"✅ {stats.channels}チャンネルの取得が完了しました（{stats.elapsed:.1f}秒）")
+    print(f"   {stats.summary()}")
+    if stats.interrupted:
+        print(f"⏸  取得時間の上限に達したため{stats.interrupted}チャンネルの取得を中断しました")
+        print("   次回の実行で続きから取得します")
 
-    return all_messages
+    return stats
+
+
+def load_embedding_model():
+    """埋め込みモデルをロード（sentence-transformersは埋め込み生成時のみ必要）"""
+    from prepare_dataset import load_model
+
+    return load_model()
 
 
 async def main():
     """メイン処理"""
+    started = time.monotonic()
+    deadline = get_fetch_deadline(started)
+
     print("=" * 60)
     print("Discord メッセージ取得スクリプト")
     print("=" * 60)
@@ -153,6 +772,10 @@ async def main():
     # dataディレクトリの準備
     ensure_data_directory()
 
+    if deadline is not None:
+        print(f"⏱  取得時間の上限: {deadline - started:.0f}秒")
+        print()
+
     # データベース初期化
     db = None
     if not USE_JSON_FALLBACK:
@@ -165,6 +788,15 @@ async def main():
         print("📊 データベースモード: JSON（後方互換）")
         print()
 
+    # 埋め込みモデルはDiscordへのログイン・取得と並行してロードする
+    model_future = None
+    if db is not None and EMBED_DURING_FETCH:
+        print("🧠 取得と並行して埋め込みを生成します")
+        print()
+        model_future = asyncio.get_running_loop().run_in_executor(
+            None, load_embedding_model
+        )
+
     # Discord Clientのセットアップ
     intents = discord.Intents.default()
     intents.guilds = True
@@ -189,16 +821,36 @@ async def main():
                 ch.strip() for ch in EXCLUDED_CHANNELS_STR.split(",") if ch.strip()
             ]
 
-            # メッセージの取得
-            messages = await fetch_messages_from_guild(
-                client, guild_id, excluded_channels=excluded_channels
+            if db is not None and FULL_RESYNC:
+                print("🔁 全件再取得モード: 全履歴を取得し直します")
+                print()
+
+            fetch_options = dict(
+                excluded_channels=excluded_channels,
+                full_resync=FULL_RESYNC,
+                concurrency=get_fetch_concurrency(),
+                deadline=deadline,
+                windows=get_channel_windows(),
             )
 
-            if messages is None:
+            # メッセージの取得（DBモードでは取得と並行して保存される）
+            if model_future is not None:
+                # 循環importを避けるためここでimportする
+                from ingest_pipeline import fetch_and_embed
+
+                stats, _ = await fetch_and_embed(
+                    client, guild_id, db, model_future, **fetch_options
+                )
+            else:
+                stats = await fetch_messages_from_guild(
+                    client, guild_id, db=db, **fetch_options
+                )
+
+            if stats is None:
                 await client.close()
                 return
 
-            if len(messages) == 0:
+            if stats.saved == 0 and (db is None or db.get_message_count() == 0):
                 print("⚠️  警告: メッセージが1件も取得できませんでした")
                 print("   以下の点を確認してください:")
                 print("   - Botがサーバーに参加しているか")
@@ -209,11 +861,9 @@ async def main():
 
             # データベースまたはJSONに保存
             if db is not None:
-                # データベースに保存（増分更新）
-                print("💾 データベースに保存中...")
-                inserted, skipped = db.insert_messages_batch(messages)
-                print(f"   新規追加: {inserted}件")
-                print(f"   既存スキップ: {skipped}件")
+                # 取得したメッセージは保存済み
+                if stats.saved == 0:
+                    print("✅ 前回の取得以降の新しいメッセージはありません")
                 total_count = db.get_message_count()
                 print(f"   累積総数: {total_count}件")
                 print()
@@ -221,7 +871,7 @@ async def main():
             else:
                 # JSONファイルに保存（後方互換）
                 with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-                    json.dump(messages, f, ensure_ascii=False, indent=2)
+                    json.dump(stats.messages, f, ensure_ascii=False, indent=2)
                 print(f"💾 メッセージを保存しました: {OUTPUT_PATH}")
 
             print()
@@ -253,12 +903,14 @@ async def main():
     except Exception as e:
         print(f"❌ エラー: 接続中に問題が発生しました: {e}")
         sys.exit(1)
+    finally:
+        # WALの内容をDBファイルに書き戻すため接続を閉じる
+        if db is not None:
+            db.close()
 
     if not success:
         sys.exit(1)
 
 
 if __name__ == "__main__":
-    import asyncio
-
     asyncio.run(main())
@@ -0,0 +1,138 @@
+"""
+ハイブリッド検索モジュール
+
+ベクトル検索とキーワード検索（FTS5）の順位を、Reciprocal Rank Fusion（RRF）で
+統合します。all-MiniLM-L6-v2は日本語の固有名詞や型番・エラー文字列などの
+完全一致に弱いため、キーワード検索で見つかるメッセージを補います。
+
+RRFは各検索での順位rから weight / (k + r) を求めて合計するため、
+BM25とコサイン類似度のように尺度の異なるスコアを正規化せずに統合できます。
+
+設定（環境変数）:
+- HYBRID_VECTOR_WEIGHT: ベクトル検索の重み（既定値: 1.0）
+- HYBRID_LEXICAL_WEIGHT: キーワード検索の重み（既定値: 1.0、0でキーワード検索を行わない）
+- HYBRID_RRF_K: RRFの定数k（既定値: 60、小さいほど上位の順位を重視）
+- HYBRID_LEXICAL_TIMEOUT: ベクトル検索の完了後にキーワード検索を待つ秒数
+  （既定値: 0.5、超えた場合はベクトル検索のみの結果を返す）
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Hashable, List, Sequence, Tuple
+
+DEFAULT_VECTOR_WEIGHT = 1.0
+DEFAULT_LEXICAL_WEIGHT = 1.0
+DEFAULT_RRF_K = 60
+DEFAULT_LEXICAL_TIMEOUT = 0.5
+
+# 統合前に各検索から取得する候補数（top_kの倍数と最小値）
+CANDIDATE_FACTOR = 4
+MIN_CANDIDATES = 20
+
+# 計測する段階と表示名（表示順）
+SEARCH_STAGES = (
+    ("filter", "絞り込み"),
+    ("encode", "埋め込み"),
+    ("vector", "ベクトル"),
+    ("weighting", "重み付け"),
+    ("lexical", "キーワード"),
+    ("wait", "キーワード待ち"),
+    ("fusion", "統合"),
+    ("diversity", "多様化"),
+)
+
+
+def _get_float_env(name: str, default: float) -> float:
+    """環境変数を0以上の実数として取得（未指定の場合は既定値）"""
+    value = os.environ.get(name, "")
+    return max(0.0, float(value)) if value.strip() else default
+
+
+def get_vector_weight() -> float:
+    """環境変数HYBRID_VECTOR_WEIGHT（ベクトル検索の重み）を取得"""
+    return _get_float_env("HYBRID_VECTOR_WEIGHT", DEFAULT_VECTOR_WEIGHT)
+
+
+def get_lexical_weight() -> float:
+    """環境変数HYBRID_LEXICAL_WEIGHT（キーワード検索の重み）を取得"""
+    return _get_float_env("HYBRID_LEXICAL_WEIGHT", DEFAULT_LEXICAL_WEIGHT)
+
+
+def get_rrf_k() -> float:
+    """環境変数HYBRID_RRF_K（RRFの定数k）を取得"""
+    return _get_float_env("HYBRID_RRF_K", DEFAULT_RRF_K)
+
+
+def get_lexical_timeout() -> float:
+    """環境変数HYBRID_LEXICAL_TIMEOUT（キーワード検索を待つ秒数）を取得"""
+    return _get_float_env("HYBRID_LEXICAL_TIMEOUT", DEFAULT_LEXICAL_TIMEOUT)
+
+
+def candidate_count(top_k: int) -> int:
+    """統合前に各検索から取得する候補数"""
+    return max(top_k * CANDIDATE_FACTOR, MIN_CANDIDATES)
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Hashable]],
+    weights: Sequence[float],
+    k: float = DEFAULT_RRF_K,
+) -> List[Tuple[Hashable, float]]:
+    """
+    複数の検索結果の順位をRRFで統合
+
+    Args:
+        rankings: 検索ごとの結果（上位から順に並べたキー）
+        weights: 検索ごとの重み（0の検索は無視）
+        k: RRFの定数
+
+    Returns:
+        List[Tuple[Hashable, float]]: (キー, 統合スコア)のリスト（スコアの高い順、
+            同点の場合は先に現れた順）
+    """
+    scores: Dict[Hashable, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        if weight <= 0:
+            continue
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+class SearchTimings:
+    """検索の段階ごとの所要時間（ミリ秒）"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.notes: List[str] = []
+        self.total = 0.0
+        self._began = time.perf_counter()
+
+    @contextmanager
+    def measure(self, stage: str):
+        """withブロックの所要時間をstageとして記録（同じstageは合計）"""
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - began) * 1000
+            self.stages[stage] = self.stages.get(stage, 0.0) + elapsed
+
+    def note(self, text: str):
+        """所要時間の表示に添える注記（検索の一部を省いた場合など）を追加"""
+        self.notes.append(text)
+
+    def finish(self):
+        """検索開始からの合計時間を記録"""
+        self.total = (time.perf_counter() - self._began) * 1000
+
+    def summary(self) -> str:
+        """所要時間の1行表示"""
+        stages = " / ".join(
+            f"{label} {self.stages[stage]:.1f}ms"
+            for stage, label in SEARCH_STAGES
+            if stage in self.stages
+        )
+        notes = "".join(f" ※{text}" for text in self.notes)
+        return f"合計 {self.total:.1f}ms（{stages}）{notes}"
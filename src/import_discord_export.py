@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Discordのエクスポートファイルからの一括インポートスクリプト
+
+DiscordChatExporterのJSON形式（チャンネルごとの1ファイル）を読み込み、
+SQLiteデータベースに保存します。大規模なギルドの初回取得では、
+channel.historyで全履歴をページングするより大幅に高速です。
+
+ファイルは先頭から順に読み込み、メッセージを1件ずつデコードするため、
+ファイルの大きさによらずメモリ使用量は一定です。Botの投稿・本文が空の
+メッセージ・システムメッセージはfetch_messages.pyと同様に除外します。
+
+インポートしたチャンネルには取得済み位置（最新メッセージID）を記録するため、
+以降のfetch_messages.pyはエクスポート後に投稿されたメッセージのみを取得します。
+
+使用例:
+    python src/import_discord_export.py exports/
+    python src/import_discord_export.py exports/general.json exports/random.json
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from discord.utils import snowflake_time
+
+from knowledge_db import KnowledgeDB
+
+# データ保存先
+DATA_DIR = os.path.join(os.path.dirname(__file__), "../data")
+DB_PATH = os.path.join(DATA_DIR, "knowledge.db")
+
+# 1回のファイル読み込みの文字数
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+# 1回の書き込みにまとめる件数
+DEFAULT_IMPORT_BATCH_SIZE = 5000
+
+# 通常の投稿として扱うメッセージの種類（参加通知・ピン留め等のシステムメッセージは除外）
+KNOWLEDGE_MESSAGE_TYPES = {"Default", "Reply"}
+
+MESSAGES_ARRAY = re.compile(r'"messages"\s*:\s*\[')
+SEPARATOR = re.compile(r"[\s,]*")
+
+
+def iter_export_messages(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    エクスポートファイルのメッセージを1件ずつ読み込む
+
+    ファイル先頭のギルド・チャンネル情報（messages配列より前の項目）を
+    まとめてデコードした後、messages配列の要素を順にデコードします。
+
+    Args:
+        path: エクスポートファイルのパス
+        chunk_size: 1回に読み込む文字数
+
+    Yields:
+        Tuple[Dict, Dict]: (ギルド・チャンネル情報, メッセージ)
+
+    Raises:
+        ValueError: messages配列が見つからない、またはファイルが途中で終わっている場合
+    """
+    decoder = json.JSONDecoder()
+
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        while True:
+            match = MESSAGES_ARRAY.search(buffer)
+            if match:
+                break
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError(f"messages配列が見つかりません: {path}")
+            buffer += chunk
+
+        header = json.loads(buffer[: match.start()].rstrip().rstrip(",") + "}")
+        pos = match.end()
+
+        while True:
+            pos = SEPARATOR.match(buffer, pos).end()
+            if pos == len(buffer):
+                buffer = f.read(chunk_size)
+                pos = 0
+                if not buffer:
+                    raise ValueError(f"ファイルが途中で終わっています: {path}")
+                continue
+            if buffer[pos] == "]":
+                return
+
+            try:
+                message, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # メッセージの途中で読み込みが終わっているため続きを読む
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise ValueError(f"ファイルが途中で終わっています: {path}")
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+
+            yield header, message
+            pos = end
+
+
+def author_display_name(author):
+    """str(discord.User)と同じ形式の投稿者名"""
+    discriminator = author.get("discriminator", "0")
+    if discriminator in ("0", "0000"):
+        return author["name"]
+    return f"{author['name']}#{discriminator}"
+
+
+def is_knowledge_export_message(message):
+    """Botの投稿・本文が空のメッセージ・システムメッセージを除外する"""
+    return (
+        message.get("type", "Default") in KNOWLEDGE_MESSAGE_TYPES
+        and not message["author"].get("isBot", False)
+        and bool(message.get("content", "").strip())
+    )
+
+
+def export_message_to_dict(message, channel):
+    """
+    エクスポートのメッセージをmessagesテーブルの形式の辞書に変換
+
+    Args:
+        message: エクスポートのメッセージ
+        channel: エクスポートのチャンネル情報
+
+    Returns:
+        メッセージデータの辞書
+    """
+    message_id = int(message["id"])
+    # discord.Message.created_atと同様にIDから投稿時刻を求める
+    created_at = snowflake_time(message_id)
+    return {
+        "id": message_id,
+        "channel_id": int(channel["id"]),
+        "channel_name": channel["name"],
+        "author_id": int(message["author"]["id"]),
+        "author_name": author_display_name(message["author"]),
+        "content": message["content"],
+        "created_at": created_at.isoformat(),
+        "timestamp": created_at.timestamp(),
+    }
+
+
+class ImportStats:
+    """インポートの進捗カウンター"""
+
+    def __init__(self):
+        self.files = 0  # 読み込んだファイル数
+        self.read = 0  # 除外分も含めて読み込んだメッセージ数
+        self.kept = 0  # 保存対象のメッセージ数
+        self.inserted = 0  # 新規に追加したメッセージ数
+        self.bytes = 0  # 読み込んだファイルの合計サイズ
+        self.elapsed = 0.0
+
+    def summary(self):
+        """進捗の1行表示"""
+        rate = self.read / self.elapsed if self.elapsed > 0 else 0.0
+        mb_per_sec = self.bytes / 1024 / 1024 / self.elapsed if self.elapsed > 0 else 0
+        return (
+            f"{self.files}ファイル, 読み込み: {self.read:,}件, "
+            f"保存対象: {self.kept:,}件, 新規: {self.inserted:,}件 "
+            f"（{rate:,.0f}件/秒, {mb_per_sec:.1f}MB/秒）"
+        )
+
+
+def save_export_batch(db, messages, stats):
+    """メッセージのバッチを保存（書き込みスレッドで実行）"""
+    inserted, _ = db.insert_messages_batch(messages)
+    stats.inserted += inserted
+
+
+def import_export_file(db, path, executor, pending, stats, batch_size):
+    """
+    1つのエクスポートファイルをインポート
+
+    ファイルの読み込み・デコードと並行して、前のバッチを書き込みスレッドで
+    保存します（書き込み待ちは最大1バッチ）。チャンネルの取得済み位置は、
+    そのチャンネルの全バッチの保存後に記録されます。
+
+    Returns:
+        Future: 最後に投入した書き込み
+    """
+    channel = None
+    date_range = None
+    batch = []
+    latest = None
+    read_before, kept_before = stats.read, stats.kept
+
+    def submit(fn, *args):
+        nonlocal pending
+        if pending is not None:
+            pending.result()
+        pending = executor.submit(fn, *args)
+
+    for header, message in iter_export_messages(path):
+        if channel is None:
+            channel = header["channel"]
+            date_range = header.get("dateRange") or {}
+        stats.read += 1
+
+        message_id = int(message["id"])
+        if latest is None or message_id > latest:
+            latest = message_id
+
+        if not is_knowledge_export_message(message):
+            continue
+        batch.append(export_message_to_dict(message, channel))
+        stats.kept += 1
+
+        if len(batch) >= batch_size:
+            submit(save_export_batch, db, batch, stats)
+            batch = []
+
+    if batch:
+        submit(save_export_batch, db, batch, stats)
+
+    stats.files += 1
+    stats.bytes += os.path.getsize(path)
+    if latest is None:
+        print(f"   ⏩ {os.path.basename(path)}: メッセージがありません")
+        return pending
+
+    submit(
+        db.update_channel_sync_state,
+        int(channel["id"]),
+        channel["name"],
+        latest,
+        snowflake_time(latest).timestamp(),
+    )
+    print(
+        f"   📝 #{channel['name']} (ID: {channel['id']}): "
+        f"{stats.kept - kept_before:,}/{stats.read - read_before:,}件を読み込み"
+    )
+    if date_range.get("after"):
+        print(
+            f"   ⚠️  {date_range['after']}以前のメッセージは含まれていません"
+            "（取得する場合はFULL_RESYNC=trueでfetch_messages.pyを実行）"
+        )
+    return pending
+
+
+def find_export_files(paths):
+    """引数のファイル・ディレクトリからエクスポートファイル（*.json）を列挙"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(
+                    os.path.join(root, name)
+                    for name in sorted(names)
+                    if name.endswith(".json")
+                )
+        else:
+            files.append(path)
+    return files
+
+
+def import_exports(db, paths, batch_size=DEFAULT_IMPORT_BATCH_SIZE):
+    """
+    エクスポートファイルを順にインポート
+
+    Args:
+        db: 保存先のKnowledgeDB
+        paths: エクスポートファイルのパスのリスト
+        batch_size: 1回の書き込みにまとめる件数
+
+    Returns:
+        ImportStats
+    """
+    stats = ImportStats()
+    began = time.perf_counter()
+
+    pending = None
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for path in paths:
+            try:
+                pending = import_export_file(
+                    db, path, executor, pending, stats, batch_size
+                )
+            except (ValueError, KeyError) as e:
+                print(f"   ⚠️  {path} をスキップ: エクスポート形式ではありません ({e})")
+            stats.elapsed = time.perf_counter() - began
+        if pending is not None:
+            pending.result()
+
+    stats.elapsed = time.perf_counter() - began
+    return stats
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="Discordのエクスポートファイルの一括インポート")
+    parser.add_argument("paths", nargs="+", help="エクスポートファイル（JSON）またはそのディレクトリ")
+    parser.add_argument("--db", default=DB_PATH, help="保存先のデータベース")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_IMPORT_BATCH_SIZE,
+        help="1回の書き込みにまとめる件数",
+    )
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Discord エクスポート インポートスクリプト")
+    print("=" * 60)
+    print()
+
+    paths = find_export_files(args.paths)
+    if not paths:
+        print("❌ エラー: エクスポートファイル（*.json）が見つかりません")
+        sys.exit(1)
+    print(f"📂 エクスポートファイル: {len(paths)}件")
+    print()
+
+    db = KnowledgeDB(args.db)
+    try:
+        stats = import_exports(db, paths, args.batch_size)
+        total_count = db.get_message_count()
+    finally:
+        # WALの内容をDBファイルに書き戻すため接続を閉じる
+        db.close()
+
+    print()
+    print(f"✅ インポートが完了しました: {stats.summary()}")
+    print(f"   累積総数: {total_count}件")
+    print()
+    print("次のステップ:")
+    print("  1. python src/fetch_messages.py を実行してエクスポート後のメッセージを取得")
+    print("  2. python src/prepare_dataset.py を実行して埋め込みデータを生成")
+    print()
+
+
+if __name__ == "__main__":
+    main()
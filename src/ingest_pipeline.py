@@ -0,0 +1,184 @@
+"""
+取得・埋め込み生成の一体型パイプライン
+
+fetch_messages.pyで取得・保存したメッセージを、そのまま埋め込みの生成に流します。
+
+    channel.history → [書き込みキュー] → DBに保存 → [埋め込みキュー] → model.encode → DBに保存
+
+各段の間は上限付きのキューで、後段が詰まると前段が待機するため、
+メモリ使用量はギルドの規模によらず一定です。埋め込みの生成は専用スレッドで
+行うため、Discordからの取得（ネットワーク待ち）と埋め込みの計算（CPU）が
+並行して進みます。生成に失敗したメッセージは埋め込み未生成のまま残り、
+prepare_dataset.pyで生成されます。
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fetch_messages import fetch_messages_from_guild
+
+# 埋め込み生成待ちのバッチ数の上限（1バッチはfetch_messagesの書き込み単位）
+EMBED_QUEUE_SIZE = 4
+
+
+class EmbedStats:
+    """埋め込み生成段の進捗カウンター"""
+
+    def __init__(self):
+        self.received = 0  # 埋め込みキューから受け取ったメッセージ数
+        self.embedded = 0  # 新規に保存した埋め込み数
+        self.skipped = 0  # 生成済み・本文が空のためスキップした件数
+        self.failed = 0  # 生成に失敗した件数（prepare_dataset.pyで再生成）
+        self.batches = 0  # 処理したバッチ数
+        self.encode_seconds = 0.0  # model.encodeにかかった時間の合計
+        self.write_seconds = 0.0  # 埋め込みの保存にかかった時間の合計
+        self.max_queue_depth = 0  # 埋め込みキューの最大の待ちバッチ数
+        self.elapsed = 0.0  # パイプライン全体の経過時間
+
+
+def embed_messages(db, model, messages):
+    """
+    メッセージのうち埋め込みが未生成のものを生成・保存する
+
+    Args:
+        db: KnowledgeDBインスタンス
+        model: SentenceTransformerモデル（encodeを持つオブジェクト）
+        messages: メッセージデータの辞書のリスト
+
+    Returns:
+        Tuple[int, int, float, float]: (保存件数, スキップ件数,
+            生成にかかった秒数, 保存にかかった秒数)
+    """
+    contents = {
+        message["id"]: message["content"]
+        for message in messages
+        if message["content"].strip()
+    }
+    message_ids = db.filter_messages_without_embeddings(list(contents))
+    skipped = len(messages) - len(message_ids)
+    if not message_ids:
+        return 0, skipped, 0.0, 0.0
+
+    began = time.perf_counter()
+    embeddings = model.encode(
+        [contents[message_id] for message_id in message_ids], show_progress_bar=False
+    )
+    encoded = time.perf_counter()
+    saved = db.insert_embeddings_batch(message_ids, embeddings)
+    written = time.perf_counter()
+
+    return saved, skipped, encoded - began, written - encoded
+
+
+async def embed_saved_batches(queue, db, model, stats):
+    """
+    埋め込みキューのメッセージのリストを順に処理する（Noneを受け取ると終了）
+
+    生成に失敗したバッチは件数を記録して読み飛ばすため、
+    前段（取得・保存）が埋め込みの失敗で止まることはありません。
+    modelにはロード中のモデルのFutureも指定できます。
+    """
+    loop = asyncio.get_running_loop()
+
+    if asyncio.isfuture(model):
+        # モデルのロード中も取得は進み、キューが埋まるまでは待たされない
+        try:
+            model = await model
+        except Exception as e:
+            print(f"   ⚠️  埋め込みモデルのロードに失敗しました: {e}")
+            model = None
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        while True:
+            stats.max_queue_depth = max(stats.max_queue_depth, queue.qsize())
+            messages = await queue.get()
+            if messages is None:
+                break
+
+            stats.received += len(messages)
+            if model is None:
+                stats.failed += len(messages)
+                continue
+            try:
+                result = await loop.run_in_executor(
+                    executor, embed_messages, db, model, messages
+                )
+            except Exception as e:
+                stats.failed += len(messages)
+                print(f"   ⚠️  埋め込み生成エラー（{len(messages)}件は後で再生成）: {e}")
+                continue
+
+            saved, skipped, encode_seconds, write_seconds = result
+            stats.embedded += saved
+            stats.skipped += skipped
+            stats.encode_seconds += encode_seconds
+            stats.write_seconds += write_seconds
+            stats.batches += 1
+
+
+def _rate(count, seconds):
+    """件数/秒（時間が0の場合は0）"""
+    return count / seconds if seconds > 0 else 0.0
+
+
+def print_pipeline_report(fetch_stats, embed_stats):
+    """パイプラインの段ごとの処理量とキューの最大待ち数を表示"""
+    print("📊 パイプラインの段ごとの処理量")
+    print(
+        f"   取得:     {fetch_stats.fetched:>10,}件  {fetch_stats.elapsed:7.1f}秒  "
+        f"{_rate(fetch_stats.fetched, fetch_stats.elapsed):>9,.0f}件/秒"
+    )
+    print(
+        f"   DB保存:   {fetch_stats.saved:>10,}件  {fetch_stats.write_seconds:7.1f}秒  "
+        f"{_rate(fetch_stats.saved, fetch_stats.write_seconds):>9,.0f}件/秒  "
+        f"最大待ち: {fetch_stats.max_queue_depth}バッチ"
+    )
+    print(
+        f"   埋め込み: {embed_stats.embedded:>10,}件  "
+        f"{embed_stats.encode_seconds:7.1f}秒  "
+        f"{_rate(embed_stats.embedded, embed_stats.encode_seconds):>9,.0f}件/秒  "
+        f"最大待ち: {embed_stats.max_queue_depth}バッチ"
+    )
+    print(
+        f"   埋め込み保存: {embed_stats.write_seconds:.1f}秒, "
+        f"スキップ: {embed_stats.skipped:,}件, 失敗: {embed_stats.failed:,}件"
+    )
+    print(f"   全体: {embed_stats.elapsed:.1f}秒")
+
+
+async def fetch_and_embed(client, guild_id, db, model, **fetch_options):
+    """
+    メッセージの取得・保存と埋め込みの生成・保存を並行して行う
+
+    Args:
+        client: Discord Client
+        guild_id: ギルドID
+        db: 保存先のKnowledgeDB
+        model: SentenceTransformerモデル、またはロード中のモデルのFuture
+        **fetch_options: fetch_messages_from_guildに渡すその他の引数
+
+    Returns:
+        Tuple[FetchStats, EmbedStats]: 各段の進捗カウンター
+            （ギルドが見つからない場合、FetchStatsはNone）
+    """
+    queue = asyncio.Queue(maxsize=EMBED_QUEUE_SIZE)
+    embed_stats = EmbedStats()
+    embedder = asyncio.ensure_future(embed_saved_batches(queue, db, model, embed_stats))
+
+    began = time.perf_counter()
+    try:
+        fetch_stats = await fetch_messages_from_guild(
+            client, guild_id, db=db, saved_queue=queue, **fetch_options
+        )
+    finally:
+        # 取得が失敗した場合も、保存済みのメッセージの埋め込みは生成しておく
+        await queue.put(None)
+        await embedder
+    embed_stats.elapsed = time.perf_counter() - began
+
+    if fetch_stats is not None:
+        print()
+        print_pipeline_report(fetch_stats, embed_stats)
+
+    return fetch_stats, embed_stats
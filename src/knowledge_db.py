@@ -5,16 +5,231 @@ SQLiteを使用して知識データを管理します。
 - メッセージの永続的な蓄積（上限なし）
 - 増分更新対応（既存メッセージはスキップ）
 - メタデータ管理（カテゴリ、重要度など）
+- 埋め込みベクトルのバイナリ保存（float32 BLOB）
+- スレッドごとの永続接続（WALモード、プリペアドステートメントのキャッシュ）
 """
 
 import json
 import os
 import sqlite3
-from typing import Dict, List, Optional, Tuple
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# 埋め込みベクトルの保存形式
+EMBEDDING_DTYPE = "float32"
+
+# 埋め込みを一括挿入する際の1トランザクションあたりの件数
+DEFAULT_EMBEDDING_CHUNK_SIZE = 5000
+
+# 旧形式（JSON）から変換する際のバッチサイズ
+DEFAULT_MIGRATION_BATCH_SIZE = 1000
+
+# 接続ごとに設定するPRAGMA（WALで読み書きを並行させ、fsync回数を抑える）
+SQLITE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", "-65536"),  # 負値はKiB単位（64MiB）
+    ("mmap_size", "268435456"),  # 256MiB
+    ("temp_store", "MEMORY"),
+)
+
+# 接続ごとにキャッシュするプリペアドステートメント数
+STATEMENT_CACHE_SIZE = 256
+
+# ストリーミング読み込み（iter_*）で1回に取得する行数
+DEFAULT_PAGE_SIZE = 1000
+
+# iter_messagesが返すタプルの列順
+MESSAGE_COLUMNS = (
+    "id",
+    "channel_id",
+    "channel_name",
+    "author_id",
+    "author_name",
+    "content",
+    "created_at",
+    "timestamp",
+    "category",
+    "importance",
+)
+
+
+def encode_embedding(
+    embedding: Union[Sequence[float], np.ndarray],
+) -> Tuple[bytes, str, int]:
+    """
+    埋め込みベクトルをBLOB保存用のバイト列に変換
+
+    Args:
+        embedding: 埋め込みベクトル（リストまたはnumpy配列）
+
+    Returns:
+        Tuple[bytes, str, int]: (バイト列, dtype名, 次元数)
+    """
+    vector = np.asarray(embedding, dtype=EMBEDDING_DTYPE).reshape(-1)
+    return vector.tobytes(), EMBEDDING_DTYPE, int(vector.shape[0])
+
+
+def decode_embedding(
+    value: Union[bytes, str],
+    dtype: Optional[str] = None,
+    dim: Optional[int] = None,
+) -> np.ndarray:
+    """
+    保存された埋め込みベクトルをnumpy配列に復元
+
+    バイナリ形式（BLOB）と旧形式（JSONテキスト）の両方に対応します。
+
+    Args:
+        value: embedding_vector列の値
+        dtype: 保存時のdtype名（旧形式ではNone）
+        dim: 保存時の次元数（旧形式ではNone）
+
+    Returns:
+        float32の1次元numpy配列
+
+    Raises:
+        ValueError: 記録された次元数とデータ長が一致しない場合
+    """
+    if isinstance(value, str):
+        return np.asarray(json.loads(value), dtype=EMBEDDING_DTYPE)
+
+    vector = np.frombuffer(value, dtype=dtype or EMBEDDING_DTYPE)
+    if dim is not None and vector.shape[0] != dim:
+        raise ValueError(f"埋め込みの次元数が一致しません: 記録値={dim}, 実データ={vector.shape[0]}")
+    return vector.astype(EMBEDDING_DTYPE, copy=False)
+
+
+# messagesテーブルへの挿入（既存IDはスキップ）
+INSERT_MESSAGE_SQL = """
+    INSERT INTO messages
+    (id, channel_id, channel_name, author_id, author_name,
+     content, created_at, timestamp, category, importance)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO NOTHING
+"""
+
+# 現在の埋め込みの世代番号（書き込みを行うトランザクションでは、世代番号を進める前の値）
+CURRENT_GENERATION_SQL = """
+    SELECT COALESCE(MAX(value), 0) FROM db_state WHERE key = 'embedding_generation'
+"""
+
+# embeddingsテーブルへの挿入（既存IDはスキップ、追加時の世代番号を記録）
+INSERT_EMBEDDING_SQL = f"""
+    INSERT INTO embeddings (message_id, embedding_vector, dtype, dim, generation)
+    VALUES (?, ?, ?, ?, ({CURRENT_GENERATION_SQL}))
+    ON CONFLICT(message_id) DO NOTHING
+"""
+
+# channel_sync_stateの更新（取得済み位置は後退しない）
+UPSERT_SYNC_STATE_SQL = """
+    INSERT INTO channel_sync_state
+        (channel_id, channel_name, last_message_id, last_timestamp)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(channel_id) DO UPDATE SET
+        channel_name = excluded.channel_name,
+        last_timestamp = CASE
+            WHEN excluded.last_message_id > last_message_id
+            THEN excluded.last_timestamp ELSE last_timestamp END,
+        last_message_id = MAX(last_message_id, excluded.last_message_id),
+        synced_at = CURRENT_TIMESTAMP
+"""
+
+
+def _message_row(message: Dict) -> Tuple:
+    """メッセージ辞書をINSERT_MESSAGE_SQLのパラメータに変換"""
+    return (
+        message["id"],
+        message["channel_id"],
+        message["channel_name"],
+        message["author_id"],
+        message["author_name"],
+        message["content"],
+        message["created_at"],
+        message["timestamp"],
+        message.get("category"),
+        message.get("importance", 0),
+    )
+
+
+def _escape_like(text: str) -> str:
+    """LIKE句のワイルドカード文字をエスケープ（ESCAPE '\\'と併用）"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+# OR検索で照合する3文字の語の最大数と、出現数を調べる語の最大数
+MAX_OR_SEARCH_TERMS = 8
+MAX_VOCAB_LOOKUPS = 64
+
+# OR検索で照合しない語の出現割合（これを超えるメッセージに現れる語は除く）
+COMMON_TERM_RATIO = 0.05
+
+# search_textで指定できる絞り込み条件と、対応するSQL条件
+MESSAGE_FILTER_CONDITIONS = {
+    "channel_id": "m.channel_id = ?",
+    "category": "m.category = ?",
+    "min_importance": "m.importance >= ?",
+    "since": "m.timestamp >= ?",
+    "until": "m.timestamp < ?",
+}
+
+
+def _split_trigrams(terms: Sequence[str]) -> List[str]:
+    """
+    3文字以上の語を重複する3文字ずつの断片に分割（重複は除く）
+
+    空白で区切られていない日本語の文でも、trigramの索引で部分的に照合するために使います。
+    """
+    trigrams = []
+    for term in terms:
+        trigrams.extend(term[i : i + 3] for i in range(len(term) - 2))
+    return list(dict.fromkeys(trigrams))
+
+
+def _build_message_filters(filters: Optional[Dict]) -> Tuple[str, List]:
+    """
+    絞り込み条件の辞書をmessagesテーブル（別名m）へのSQL条件に変換
+
+    Args:
+        filters: 絞り込み条件の辞書（値がNoneの条件は無視）
+
+    Returns:
+        Tuple[str, List]: (" AND ..."形式のSQL条件, パラメータ)
+
+    Raises:
+        ValueError: 未対応の絞り込み条件が指定された場合
+    """
+    if not filters:
+        return "", []
+
+    unknown = set(filters) - set(MESSAGE_FILTER_CONDITIONS)
+    if unknown:
+        raise ValueError(f"未対応の絞り込み条件です: {', '.join(sorted(unknown))}")
+
+    # セキュリティ注: SQL条件は定数のみで、値はパラメータとして渡す
+    clause = ""
+    params = []
+    for key, condition in MESSAGE_FILTER_CONDITIONS.items():
+        value = filters.get(key)
+        if value is not None:
+            clause += " AND " + condition
+            params.append(value)
+    return clause, params
 
 
 class KnowledgeDB:
-    """知識データベース管理クラス"""
+    """
+    知識データベース管理クラス
+
+    接続はスレッドごとに1本を保持して再利用します。
+    使用後はclose()を呼ぶか、with文で使用してください。
+
+    Example:
+        with KnowledgeDB() as db:
+            db.insert_messages_batch(messages)
+    """
 
     def __init__(self, db_path: Optional[str] = None):
         """
@@ -26,9 +241,81 @@ class KnowledgeDB:
         if db_path is None:
             db_path = os.path.join(os.path.dirname(__file__), "../data/knowledge.db")
         self.db_path = db_path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
         self._ensure_data_directory()
         self._init_database()
 
+    def __enter__(self) -> "KnowledgeDB":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """
+        現在のスレッド用の接続を取得（未接続の場合は作成してPRAGMAを設定）
+
+        Returns:
+            sqlite3.Connection: スレッド専用の永続接続
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        conn = self._open_connection()
+        self._local.conn = conn
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def _open_connection(self) -> sqlite3.Connection:
+        """
+        PRAGMAを設定した新しい接続を作成
+
+        Returns:
+            sqlite3.Connection: 新しい接続
+        """
+        # close()で他スレッドの接続も閉じるため、スレッド間チェックは無効化する
+        conn = sqlite3.connect(
+            self.db_path,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            check_same_thread=False,
+        )
+        for name, value in SQLITE_PRAGMAS:
+            # セキュリティ注: PRAGMA名と値は定数のみ
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _iter_query(
+        self, query: str, params: Sequence, page_size: int
+    ) -> Iterator[Tuple]:
+        """
+        クエリ結果をfetchmanyでpage_size行ずつ読み込み、1行ずつ返す
+
+        読み込み中に同じスレッドで書き込みが行われても影響しないよう、
+        専用の接続を使用し、読み終えた時点（または中断時）に閉じます。
+
+        Args:
+            query: SELECT文
+            params: クエリパラメータ
+            page_size: 1回に取得する行数
+
+        Yields:
+            行のタプル
+        """
+        conn = self._open_connection()
+        try:
+            cursor = conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(page_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
     def _ensure_data_directory(self):
         """dataディレクトリの存在を確認し、必要に応じて作成"""
         db_dir = os.path.dirname(self.db_path)
@@ -37,7 +324,8 @@ class KnowledgeDB:
 
     def _init_database(self):
         """データベーステーブルを初期化"""
-        with sqlite3.connect(self.db_path) as conn:
+        conn = self._get_connection()
+        with conn:
             cursor = conn.cursor()
 
             # メッセージテーブル
@@ -64,18 +352,107 @@ class KnowledgeDB:
                 """
                 CREATE TABLE IF NOT EXISTS embeddings (
                     message_id INTEGER PRIMARY KEY,
-                    embedding_vector TEXT NOT NULL,
+                    embedding_vector BLOB NOT NULL,
+                    dtype TEXT DEFAULT NULL,
+                    dim INTEGER DEFAULT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    generation INTEGER NOT NULL DEFAULT 0,
                     FOREIGN KEY (message_id) REFERENCES messages(id)
                 )
             """
             )
 
+            # 削除した埋め込みと削除時の世代番号（Botの差分更新用）
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embedding_deletions (
+                    message_id INTEGER PRIMARY KEY,
+                    generation INTEGER NOT NULL
+                )
+            """
+            )
+
+            # DBの状態値（埋め込みの世代番号など）
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS db_state (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            """
+            )
+
+            # チャンネルごとの取得済み位置（増分取得用）
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS channel_sync_state (
+                    channel_id INTEGER PRIMARY KEY,
+                    channel_name TEXT NOT NULL,
+                    last_message_id INTEGER NOT NULL,
+                    last_timestamp REAL NOT NULL,
+                    synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """
+            )
+
+            # 全履歴取得の途中経過（中断後の再開用）
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS crawl_checkpoints (
+                    channel_id INTEGER NOT NULL,
+                    range_start INTEGER NOT NULL,
+                    range_end INTEGER NOT NULL,
+                    cursor INTEGER DEFAULT NULL,
+                    complete INTEGER NOT NULL DEFAULT 0,
+                    last_message_id INTEGER NOT NULL,
+                    last_timestamp REAL NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (channel_id, range_start)
+                )
+            """
+            )
+
+            # 旧スキーマ（JSONテキストのみ）のDBにはdtype/dim列を追加
+            cursor.execute("PRAGMA table_info(embeddings)")
+            embedding_columns = {row[1] for row in cursor.fetchall()}
+            if "dtype" not in embedding_columns:
+                cursor.execute(
+                    "ALTER TABLE embeddings ADD COLUMN dtype TEXT DEFAULT NULL"
+                )
+            if "dim" not in embedding_columns:
+                cursor.execute(
+                    "ALTER TABLE embeddings ADD COLUMN dim INTEGER DEFAULT NULL"
+                )
+            # 追加時の世代番号のないDBの既存の埋め込みは世代0とみなす
+            if "generation" not in embedding_columns:
+                cursor.execute(
+                    "ALTER TABLE embeddings "
+                    "ADD COLUMN generation INTEGER NOT NULL DEFAULT 0"
+                )
+            cursor.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_embeddings_generation
+                ON embeddings(generation)
+            """
+            )
+            cursor.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS embeddings_delete_log
+                AFTER DELETE ON embeddings BEGIN
+                    INSERT OR REPLACE INTO embedding_deletions(message_id, generation)
+                    VALUES (old.message_id, ({CURRENT_GENERATION_SQL}));
+                END
+            """
+            )
+
             # インデックス作成（検索性能向上）
+            # (channel_id, channel_name)の複合インデックスはチャンネルIDでの検索と
+            # チャンネル名変更の反映の両方に使われるため、単独インデックスは削除する
+            cursor.execute("DROP INDEX IF EXISTS idx_messages_channel_id")
             cursor.execute(
                 """
-                CREATE INDEX IF NOT EXISTS idx_messages_channel_id
-                ON messages(channel_id)
+                CREATE INDEX IF NOT EXISTS idx_messages_channel
+                ON messages(channel_id, channel_name)
             """
             )
             cursor.execute(
@@ -97,99 +474,202 @@ class KnowledgeDB:
             """
             )
 
+            self.fts_enabled = self._init_fts(cursor)
+
             conn.commit()
 
-    def insert_message(self, message: Dict) -> bool:
+    def _init_fts(self, cursor: sqlite3.Cursor) -> bool:
         """
-        メッセージを挿入（既存の場合はスキップ）
+        本文の全文検索用FTS5テーブルと同期用トリガーを作成
+
+        日本語の本文は単語の区切りがないため、trigramトークナイザーで
+        3文字単位の部分一致検索を行います。
+        FTS5テーブルを新規作成した場合は、既存メッセージから索引を構築します。
+        索引はトリガーでメッセージの挿入・削除・本文更新と同じトランザクション内で
+        更新するため、検索は読み取りだけで行えます。
 
         Args:
-            message: メッセージデータの辞書
+            cursor: _init_database内のカーソル
 
         Returns:
-            bool: 新規挿入された場合True、既存でスキップされた場合False
+            bool: 全文検索が利用可能な場合True
+                （SQLiteがFTS5またはtrigramに対応していない場合False）
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        )
+        exists = cursor.fetchone() is not None
 
-            # 既存チェック
-            cursor.execute("SELECT id FROM messages WHERE id = ?", (message["id"],))
-            if cursor.fetchone() is not None:
+        if not exists:
+            try:
+                cursor.execute(
+                    """
+                    CREATE VIRTUAL TABLE messages_fts USING fts5(
+                        content,
+                        content='messages',
+                        content_rowid='id',
+                        tokenize='trigram'
+                    )
+                """
+                )
+            except sqlite3.OperationalError:
                 return False
 
-            # 新規挿入
+        # 語（3文字の断片）ごとの出現メッセージ数（OR検索で照合する語の選択に使う）
+        cursor.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts_vocab
+            USING fts5vocab(messages_fts, 'row')
+        """
+        )
+
+        # 旧形式（反映待ちのIDを記録するトリガー）のDBは、反映待ちの行を索引に
+        # 追加してからトリガーを作り直す
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master "
+            "WHERE type = 'table' AND name = 'messages_fts_pending'"
+        )
+        if cursor.fetchone() is not None:
             cursor.execute(
                 """
-                INSERT INTO messages
-                (id, channel_id, channel_name, author_id, author_name,
-                 content, created_at, timestamp, category, importance)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    message["id"],
-                    message["channel_id"],
-                    message["channel_name"],
-                    message["author_id"],
-                    message["author_name"],
-                    message["content"],
-                    message["created_at"],
-                    message["timestamp"],
-                    message.get("category"),
-                    message.get("importance", 0),
-                ),
+                INSERT INTO messages_fts(rowid, content)
+                SELECT m.id, m.content FROM messages_fts_pending p
+                JOIN messages m ON m.id = p.id
+            """
             )
-            conn.commit()
-            return True
+            for trigger in ("insert", "delete", "update"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS messages_fts_{trigger}")
+            cursor.execute("DROP TABLE messages_fts_pending")
+
+        cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert
+            AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+            END
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete
+            AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts(messages_fts, rowid, content)
+                VALUES ('delete', old.id, old.content);
+            END
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS messages_fts_update
+            AFTER UPDATE OF content ON messages BEGIN
+                INSERT INTO messages_fts(messages_fts, rowid, content)
+                VALUES ('delete', old.id, old.content);
+                INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+            END
+        """
+        )
+
+        if not exists:
+            cursor.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+        return True
+
+    def insert_message(self, message: Dict) -> bool:
+        """
+        メッセージを挿入（既存の場合はスキップ）
+
+        Args:
+            message: メッセージデータの辞書
+
+        Returns:
+            bool: 新規挿入された場合True、既存でスキップされた場合False
+        """
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.execute(INSERT_MESSAGE_SQL, _message_row(message))
+            return cursor.rowcount == 1
 
     def insert_messages_batch(self, messages: List[Dict]) -> Tuple[int, int]:
         """
         複数のメッセージを一括挿入
 
+        1トランザクション内で`INSERT ... ON CONFLICT DO NOTHING`を
+        executemanyで実行するため、件数によらず往復は1回です。
+
         Args:
             messages: メッセージデータの辞書のリスト
 
         Returns:
             Tuple[int, int]: (新規挿入数, スキップ数)
         """
-        inserted = 0
-        skipped = 0
+        rows = [_message_row(message) for message in messages]
+        if not rows:
+            return 0, 0
 
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        conn = self._get_connection()
+        with conn:
+            inserted = conn.executemany(INSERT_MESSAGE_SQL, rows).rowcount
 
-            for message in messages:
-                # 既存チェック
-                cursor.execute("SELECT id FROM messages WHERE id = ?", (message["id"],))
-                if cursor.fetchone() is not None:
-                    skipped += 1
-                    continue
+        return inserted, len(rows) - inserted
 
-                # 新規挿入
-                cursor.execute(
-                    """
-                    INSERT INTO messages
-                    (id, channel_id, channel_name, author_id, author_name,
-                     content, created_at, timestamp, category, importance)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        message["id"],
-                        message["channel_id"],
-                        message["channel_name"],
-                        message["author_id"],
-                        message["author_name"],
-                        message["content"],
-                        message["created_at"],
-                        message["timestamp"],
-                        message.get("category"),
-                        message.get("importance", 0),
-                    ),
-                )
-                inserted += 1
+    def upsert_messages_batch(self, messages: List[Dict]) -> Tuple[int, int, int]:
+        """
+        複数のメッセージを一括挿入し、既存メッセージの変更可能な項目を更新
 
-            conn.commit()
+        既存メッセージは本文（編集）、投稿者名、チャンネル名を更新します。
+        本文が変わったメッセージは埋め込みを削除し、次回のprepare_dataset.py
+        実行時に再生成されるようにします。
+        また、チャンネル名が変わった場合は同じチャンネルの全メッセージに反映します。
+
+        Args:
+            messages: メッセージデータの辞書のリスト
+
+        Returns:
+            Tuple[int, int, int]: (新規挿入数, 更新数, 変更なし数)
+        """
+        rows = [_message_row(message) for message in messages]
+        if not rows:
+            return 0, 0, 0
+
+        conn = self._get_connection()
+        with conn:
+            # 本文が変わるメッセージの埋め込みは古くなるため削除
+            deleted = conn.executemany(
+                """
+                DELETE FROM embeddings
+                WHERE message_id = ?
+                  AND EXISTS (
+                      SELECT 1 FROM messages WHERE id = ? AND content != ?
+                  )
+                """,
+                [(row[0], row[0], row[5]) for row in rows],
+            ).rowcount
+            if deleted > 0:
+                self._bump_embedding_generation(conn)
+
+            updated = conn.executemany(
+                """
+                UPDATE messages
+                SET channel_name = ?1, author_name = ?2, content = ?3
+                WHERE id = ?4
+                  AND (channel_name != ?1 OR author_name != ?2 OR content != ?3)
+                """,
+                [(row[2], row[4], row[5], row[0]) for row in rows],
+            ).rowcount
 
-        return inserted, skipped
+            inserted = conn.executemany(INSERT_MESSAGE_SQL, rows).rowcount
+
+            # チャンネル名の変更をバッチ外の既存メッセージにも反映
+            channel_names = {row[1]: row[2] for row in rows}
+            conn.executemany(
+                """
+                UPDATE messages SET channel_name = ?1
+                WHERE channel_id = ?2 AND channel_name != ?1
+                """,
+                [(name, channel_id) for channel_id, name in channel_names.items()],
+            )
+
+        return inserted, updated, len(rows) - inserted - updated
 
     def get_all_messages(
         self,
@@ -206,9 +686,10 @@ class KnowledgeDB:
         Returns:
             メッセージデータの辞書のリスト
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        conn = self._get_connection()
+        with conn:
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
 
             query = "SELECT * FROM messages WHERE 1=1"
             params = []
@@ -235,9 +716,10 @@ class KnowledgeDB:
         Returns:
             メッセージデータの辞書のリスト
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        conn = self._get_connection()
+        with conn:
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
 
             cursor.execute(
                 """
@@ -251,86 +733,515 @@ class KnowledgeDB:
 
             return [dict(row) for row in rows]
 
-    def insert_embedding(self, message_id: int, embedding: List[float]) -> bool:
+    def _select_rare_terms(
+        self, terms: List[str], limit: int = MAX_OR_SEARCH_TERMS
+    ) -> List[str]:
         """
-        埋め込みベクトルを挿入
+        索引に含まれる語のうち、出現するメッセージ数の少ないlimit個を選ぶ
+
+        全メッセージのCOMMON_TERM_RATIOを超えるメッセージに現れる語は、
+        BM25での寄与がほぼないため除きます（全ての語が該当する場合は除かない）。
 
         Args:
-            message_id: メッセージID
-            embedding: 埋め込みベクトル
+            terms: 3文字の語のリスト（先頭のMAX_VOCAB_LOOKUPS個まで調べる）
+            limit: 選ぶ語の数
 
         Returns:
-            bool: 新規挿入された場合True、既存でスキップされた場合False
+            出現するメッセージ数の少ない順の語のリスト（索引にない語は含まない）
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        counts = {}
+        conn = self._get_connection()
+        with conn:
+            for term in terms[:MAX_VOCAB_LOOKUPS]:
+                # trigramトークナイザーは大文字・小文字を区別せずに索引する
+                row = conn.execute(
+                    "SELECT doc FROM messages_fts_vocab WHERE term = ?",
+                    (term.lower(),),
+                ).fetchone()
+                if row is not None:
+                    counts[term] = row[0]
+            total = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+        terms = sorted(counts, key=counts.get)
+        rare_terms = [
+            term for term in terms if counts[term] <= total * COMMON_TERM_RATIO
+        ]
+        return (rare_terms or terms)[:limit]
+
+    def search_text(
+        self,
+        query: str,
+        limit: int = 10,
+        filters: Optional[Dict] = None,
+        match_all: bool = True,
+    ) -> List[Tuple[int, float]]:
+        """
+        本文のキーワード検索（FTS5、BM25でランク付け）
 
-            # 既存チェック
-            cursor.execute(
-                "SELECT message_id FROM embeddings WHERE message_id = ?",
-                (message_id,),
+        空白区切りの各語を全て含むメッセージを検索します（AND検索）。
+        trigramトークナイザーは3文字未満の語を索引で扱えないため、
+        2文字以下の語は本文の部分一致（LIKE）で絞り込みます。
+
+        match_all=Falseの場合は、各語を3文字ずつの断片に分けていずれかを含む
+        メッセージを検索し（OR検索）、多くの断片に一致するほど上位になります。
+        空白で区切られていない質問文をそのまま検索する場合に使います。
+        「ください」のように多くのメッセージに現れる断片は順位への寄与が小さく
+        検索を遅くするため、出現するメッセージ数の少ない断片から
+        MAX_OR_SEARCH_TERMS個だけを照合します。
+
+        Args:
+            query: 検索文字列
+            limit: 最大取得件数
+            filters: 絞り込み条件の辞書（省略時は全て）
+                - channel_id: チャンネルID
+                - category: カテゴリ
+                - min_importance: 最小重要度
+                - since: この時刻（Unix時間）以降
+                - until: この時刻（Unix時間）より前
+            match_all: FalseのときOR検索（3文字以上の語がない場合は部分一致のOR）
+
+        Returns:
+            List[Tuple[int, float]]: (メッセージID, スコア)のリスト（スコアの高い順）
+                スコアはBM25（大きいほど関連度が高い）。
+                索引を使えない短い語のみの検索では全て0.0（新しい順）
+
+        Raises:
+            ValueError: 未対応の絞り込み条件が指定された場合
+        """
+        terms = query.split()
+        if not terms:
+            return []
+
+        filter_clause, filter_params = _build_message_filters(filters)
+
+        if not self.fts_enabled:
+            match_terms = []
+            like_terms = terms
+        elif match_all:
+            match_terms = [term for term in terms if len(term) >= 3]
+            like_terms = [term for term in terms if len(term) < 3]
+        else:
+            trigrams = _split_trigrams(terms)
+            match_terms = self._select_rare_terms(trigrams)
+            if trigrams and not match_terms:
+                # どの断片も索引にない（一致するメッセージがない）
+                return []
+            like_terms = [] if trigrams else terms
+
+        like_condition = "m.content LIKE ? ESCAPE '\\'"
+        if match_all or not like_terms:
+            like_clause = "".join(" AND " + like_condition for _ in like_terms)
+        else:
+            like_clause = (
+                " AND (" + " OR ".join([like_condition] * len(like_terms)) + ")"
             )
-            if cursor.fetchone() is not None:
-                return False
+        like_params = [f"%{_escape_like(term)}%" for term in like_terms]
 
-            # 新規挿入
-            cursor.execute(
+        if match_terms:
+            # 各語をフレーズとして引用符で囲み、FTS5の構文として解釈させない
+            match_query = (" " if match_all else " OR ").join(
+                '"' + term.replace('"', '""') + '"' for term in match_terms
+            )
+            sql = (
+                "SELECT m.id, -bm25(messages_fts) AS score "
+                "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                "WHERE messages_fts MATCH ?"
+                + like_clause
+                + filter_clause
+                + " ORDER BY score DESC LIMIT ?"
+            )
+            params = [match_query, *like_params, *filter_params, limit]
+        else:
+            sql = (
+                "SELECT m.id, 0.0 AS score FROM messages m WHERE 1=1"
+                + like_clause
+                + filter_clause
+                + " ORDER BY m.timestamp DESC LIMIT ?"
+            )
+            params = [*like_params, *filter_params, limit]
+
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.execute(sql, params)
+            return [(row[0], row[1]) for row in cursor.fetchall()]
+
+    def get_message_contents(self, message_ids: Sequence[int]) -> Dict[int, str]:
+        """
+        指定したメッセージIDの本文を取得
+
+        Args:
+            message_ids: メッセージIDのリスト
+
+        Returns:
+            Dict[int, str]: メッセージIDと本文の辞書（存在しないIDは含まない）
+        """
+        if not message_ids:
+            return {}
+
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.execute(
+                """
+                SELECT id, content FROM messages
+                WHERE id IN (SELECT value FROM json_each(?))
+            """,
+                (json.dumps([int(message_id) for message_id in message_ids]),),
+            )
+            return {row[0]: row[1] for row in cursor.fetchall()}
+
+    def iter_messages(
+        self,
+        category: Optional[str] = None,
+        min_importance: Optional[int] = None,
+        page_size: int = DEFAULT_PAGE_SIZE,
+    ) -> Iterator[Tuple]:
+        """
+        メッセージを新しい順にストリーミング取得
+
+        get_all_messagesと異なり全件をメモリに載せないため、
+        メッセージ数によらず使用メモリはpage_size行分に収まります。
+
+        Args:
+            category: カテゴリでフィルタ（省略時は全て）
+            min_importance: 最小重要度でフィルタ（省略時は全て）
+            page_size: 1回に取得する行数
+
+        Yields:
+            MESSAGE_COLUMNSの順に並んだ行のタプル
+        """
+        query = f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM messages WHERE 1=1"
+        params = []
+
+        if category is not None:
+            query += " AND category = ?"
+            params.append(category)
+
+        if min_importance is not None:
+            query += " AND importance >= ?"
+            params.append(min_importance)
+
+        query += " ORDER BY timestamp DESC"
+
+        return self._iter_query(query, params, page_size)
+
+    def iter_pending_embeddings(
+        self, page_size: int = DEFAULT_PAGE_SIZE
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        埋め込みが未生成のメッセージを古い順にストリーミング取得
+
+        読み込みながらinsert_embeddings_batchで書き込む用途を想定し、
+        ページごとにID順のキーセットで再検索します。長時間の読み込みで
+        WALのチェックポイントを妨げないよう、ページ間で読み込みを保持しません。
+
+        Args:
+            page_size: 1回に取得する行数
+
+        Yields:
+            Tuple[int, str]: (メッセージID, 本文)
+        """
+        conn = self._get_connection()
+        # SQLiteのINTEGERの最小値から開始
+        last_id = -(2**63)
+
+        while True:
+            # メッセージIDはSnowflake（時系列順）のため、ID順は投稿順と一致する
+            cursor = conn.execute(
                 """
-                INSERT INTO embeddings (message_id, embedding_vector)
-                VALUES (?, ?)
+                SELECT m.id, m.content FROM messages m
+                LEFT JOIN embeddings e ON m.id = e.message_id
+                WHERE e.message_id IS NULL AND m.id > ?
+                ORDER BY m.id
+                LIMIT ?
                 """,
-                (message_id, json.dumps(embedding)),
+                (last_id, page_size),
             )
-            conn.commit()
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            yield from rows
+            last_id = rows[-1][0]
+
+    def get_pending_embedding_count(self) -> int:
+        """
+        埋め込みが未生成のメッセージ数を取得
+
+        Returns:
+            埋め込み未生成のメッセージ数
+        """
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.execute(
+                """
+                SELECT COUNT(*) FROM messages m
+                LEFT JOIN embeddings e ON m.id = e.message_id
+                WHERE e.message_id IS NULL
+                """
+            )
+            return cursor.fetchone()[0]
+
+    def filter_messages_without_embeddings(
+        self, message_ids: Sequence[int]
+    ) -> List[int]:
+        """
+        指定したメッセージIDのうち、埋め込みが未生成のものを返す
+
+        Args:
+            message_ids: メッセージIDのリスト
+
+        Returns:
+            埋め込みが未生成のメッセージIDのリスト（指定した順序のまま）
+        """
+        if not message_ids:
+            return []
+
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.execute(
+                """
+                SELECT message_id FROM embeddings
+                WHERE message_id IN (SELECT value FROM json_each(?))
+            """,
+                (json.dumps([int(message_id) for message_id in message_ids]),),
+            )
+            embedded = {row[0] for row in cursor.fetchall()}
+        return [message_id for message_id in message_ids if message_id not in embedded]
+
+    def insert_embedding(
+        self, message_id: int, embedding: Union[Sequence[float], np.ndarray]
+    ) -> bool:
+        """
+        埋め込みベクトルを挿入
+
+        ベクトルはfloat32のバイナリ形式（BLOB）で保存されます。
+
+        Args:
+            message_id: メッセージID
+            embedding: 埋め込みベクトル（リストまたはnumpy配列）
+
+        Returns:
+            bool: 新規挿入された場合True、既存でスキップされた場合False
+        """
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.execute(
+                INSERT_EMBEDDING_SQL, (message_id, *encode_embedding(embedding))
+            )
+            if cursor.rowcount == 0:
+                return False
+            self._bump_embedding_generation(conn)
             return True
 
+    def insert_embeddings_batch(
+        self,
+        message_ids: Sequence[int],
+        embeddings: np.ndarray,
+        chunk_size: int = DEFAULT_EMBEDDING_CHUNK_SIZE,
+    ) -> int:
+        """
+        複数の埋め込みベクトルを一括挿入（既存の場合はスキップ）
+
+        chunk_size件ごとに1トランザクションでexecutemanyするため、
+        行ごとの接続・存在チェック・コミットは発生しません。
+        各行はPythonのリストに変換せず、float32のバイト列として直接書き込みます。
+
+        Args:
+            message_ids: メッセージIDのシーケンス（embeddingsの行と同じ順序）
+            embeddings: shape=(件数, 次元数)の2次元配列
+            chunk_size: 1トランザクションで書き込む件数
+
+        Returns:
+            新規挿入数
+
+        Raises:
+            ValueError: 配列の形状とメッセージIDの件数が一致しない場合
+        """
+        if len(message_ids) == 0:
+            return 0
+
+        matrix = np.ascontiguousarray(embeddings, dtype=EMBEDDING_DTYPE)
+        if matrix.ndim != 2 or matrix.shape[0] != len(message_ids):
+            raise ValueError(
+                f"埋め込みの形状が不正です: shape={matrix.shape}, メッセージID数={len(message_ids)}"
+            )
+
+        dim = int(matrix.shape[1])
+        inserted = 0
+        conn = self._get_connection()
+
+        for start in range(0, len(message_ids), chunk_size):
+            end = start + chunk_size
+            rows = (
+                (int(message_id), vector.tobytes(), EMBEDDING_DTYPE, dim)
+                for message_id, vector in zip(message_ids[start:end], matrix[start:end])
+            )
+            with conn:
+                chunk_inserted = conn.executemany(INSERT_EMBEDDING_SQL, rows).rowcount
+                if chunk_inserted > 0:
+                    self._bump_embedding_generation(conn)
+            inserted += chunk_inserted
+
+        return inserted
+
+    def iter_embeddings(
+        self,
+        category: Optional[str] = None,
+        min_importance: Optional[int] = None,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        with_metadata: bool = False,
+        since_generation: Optional[int] = None,
+    ) -> Iterator[Tuple]:
+        """
+        埋め込みデータを新しい順にストリーミング取得
+
+        バイナリ形式と旧形式（JSON）の行が混在していても読み込めます。
+
+        Args:
+            category: カテゴリでフィルタ（省略時は全て）
+            min_importance: 最小重要度でフィルタ（省略時は全て）
+            page_size: 1回に取得する行数
+            with_metadata: Trueの場合、絞り込み検索用のメタデータも返す
+            since_generation: 世代番号がこの値だったとき以降に追加された埋め込みのみ取得
+                （get_embedding_generationで取得した値を渡す、省略時は全て）
+
+        Yields:
+            Tuple[int, str, np.ndarray]: (メッセージID, 本文, float32の埋め込み)
+                with_metadata=Trueの場合は末尾に
+                (チャンネルID, カテゴリ, 重要度, タイムスタンプ)のタプルが付く
+        """
+        if since_generation is None:
+            source = "messages m INNER JOIN embeddings e ON m.id = e.message_id"
+        else:
+            # 差分は少ないため世代番号の索引から読む（CROSS JOINで結合順を固定）
+            source = "embeddings e CROSS JOIN messages m ON m.id = e.message_id"
+        query = f"""
+            SELECT m.id, m.content, e.embedding_vector, e.dtype, e.dim,
+                m.channel_id, m.category, m.importance, m.timestamp
+            FROM {source}
+            WHERE 1=1
+        """
+        params = []
+
+        if category is not None:
+            query += " AND m.category = ?"
+            params.append(category)
+
+        if min_importance is not None:
+            query += " AND m.importance >= ?"
+            params.append(min_importance)
+
+        if since_generation is not None:
+            query += " AND e.generation >= ?"
+            params.append(since_generation)
+
+        query += " ORDER BY m.timestamp DESC"
+
+        for row in self._iter_query(query, params, page_size):
+            message_id, content, value, dtype, dim = row[:5]
+            vector = decode_embedding(value, dtype, dim)
+            if with_metadata:
+                yield message_id, content, vector, row[5:]
+            else:
+                yield message_id, content, vector
+
     def get_all_embeddings(
         self,
         category: Optional[str] = None,
         min_importance: Optional[int] = None,
-    ) -> Tuple[List[str], List[List[float]]]:
+    ) -> Tuple[List[str], np.ndarray]:
         """
         全埋め込みデータを取得
 
+        バイナリ形式と旧形式（JSON）の行が混在していても読み込めます。
+
         Args:
             category: カテゴリでフィルタ（省略時は全て）
             min_importance: 最小重要度でフィルタ（省略時は全て）
 
         Returns:
-            Tuple[List[str], List[List[float]]]: (テキストリスト, 埋め込みリスト)
+            Tuple[List[str], np.ndarray]: (テキストリスト, 埋め込み行列)
+                埋め込み行列はshape=(件数, 次元数)のfloat32配列
+        """
+        texts = []
+        vectors = []
+        for _, content, vector in self.iter_embeddings(category, min_importance):
+            texts.append(content)
+            vectors.append(vector)
+
+        if not vectors:
+            return texts, np.empty((0, 0), dtype=EMBEDDING_DTYPE)
+
+        return texts, np.vstack(vectors)
+
+    def count_legacy_embeddings(self) -> int:
+        """
+        旧形式（JSONテキスト）で保存された埋め込みの件数を取得
+
+        Returns:
+            旧形式の埋め込み件数
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        conn = self._get_connection()
+        with conn:
             cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COUNT(*) FROM embeddings "
+                "WHERE typeof(embedding_vector) = 'text'"
+            )
+            return cursor.fetchone()[0]
 
-            query = """
-                SELECT m.content, e.embedding_vector
-                FROM messages m
-                INNER JOIN embeddings e ON m.id = e.message_id
-                WHERE 1=1
-            """
-            params = []
+    def migrate_embeddings_to_binary(
+        self, batch_size: int = DEFAULT_MIGRATION_BATCH_SIZE
+    ) -> int:
+        """
+        旧形式（JSONテキスト）の埋め込みをバイナリ形式へその場で変換
 
-            if category is not None:
-                query += " AND m.category = ?"
-                params.append(category)
+        batch_size件ごとにコミットするため、途中で中断しても
+        変換済みの行は保持され、再実行時は残りの行のみ変換されます。
+        変換中も読み込み側は両形式に対応しているため、Botは動作を継続できます。
 
-            if min_importance is not None:
-                query += " AND m.importance >= ?"
-                params.append(min_importance)
+        Args:
+            batch_size: 1トランザクションで変換する件数
 
-            query += " ORDER BY m.timestamp DESC"
+        Returns:
+            変換した埋め込みの件数
+        """
+        migrated = 0
 
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.cursor()
 
-            texts = []
-            embeddings = []
-            for row in rows:
-                texts.append(row["content"])
-                embeddings.append(json.loads(row["embedding_vector"]))
+            while True:
+                cursor.execute(
+                    """
+                    SELECT message_id, embedding_vector FROM embeddings
+                    WHERE typeof(embedding_vector) = 'text'
+                    LIMIT ?
+                    """,
+                    (batch_size,),
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                updates = []
+                for message_id, embedding_json in rows:
+                    blob, dtype, dim = encode_embedding(json.loads(embedding_json))
+                    updates.append((blob, dtype, dim, message_id))
+
+                cursor.executemany(
+                    """
+                    UPDATE embeddings
+                    SET embedding_vector = ?, dtype = ?, dim = ?
+                    WHERE message_id = ?
+                    """,
+                    updates,
+                )
+                conn.commit()
+                migrated += len(updates)
 
-            return texts, embeddings
+        return migrated
 
     def get_message_count(self) -> int:
         """
@@ -339,7 +1250,8 @@ class KnowledgeDB:
         Returns:
             メッセージ総数
         """
-        with sqlite3.connect(self.db_path) as conn:
+        conn = self._get_connection()
+        with conn:
             cursor = conn.cursor()
             cursor.execute("SELECT COUNT(*) FROM messages")
             return cursor.fetchone()[0]
@@ -351,11 +1263,229 @@ class KnowledgeDB:
         Returns:
             埋め込み総数
         """
-        with sqlite3.connect(self.db_path) as conn:
+        conn = self._get_connection()
+        with conn:
             cursor = conn.cursor()
             cursor.execute("SELECT COUNT(*) FROM embeddings")
             return cursor.fetchone()[0]
 
+    def get_embedding_generation(self) -> int:
+        """
+        埋め込みの世代番号を取得
+
+        埋め込みが追加・削除されるたびに増加します。
+        埋め込みから作成したキャッシュ（インデックスファイルなど）が
+        最新かどうかの判定に使用します。
+
+        Returns:
+            世代番号（埋め込みが一度も書き込まれていない場合は0）
+        """
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.execute(
+                "SELECT value FROM db_state WHERE key = 'embedding_generation'"
+            )
+            row = cursor.fetchone()
+            return row[0] if row is not None else 0
+
+    def get_deleted_embedding_ids(self, since_generation: int) -> List[int]:
+        """
+        世代番号がsince_generationだったとき以降に削除された埋め込みのメッセージIDを取得
+
+        本文の編集で削除された埋め込みは、再生成後もここに含まれます
+        （iter_embeddingsのsince_generationで再生成後の埋め込みを取得します）。
+
+        Args:
+            since_generation: get_embedding_generationで取得した世代番号
+
+        Returns:
+            メッセージIDのリスト
+        """
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.execute(
+                "SELECT message_id FROM embedding_deletions WHERE generation >= ?",
+                (since_generation,),
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _bump_embedding_generation(self, conn: sqlite3.Connection):
+        """埋め込みの世代番号を進める（呼び出し元のトランザクション内で実行）"""
+        conn.execute(
+            """
+            INSERT INTO db_state (key, value) VALUES ('embedding_generation', 1)
+            ON CONFLICT(key) DO UPDATE SET value = value + 1
+            """
+        )
+
+    def get_channel_sync_states(self) -> Dict[int, Dict]:
+        """
+        全チャンネルの取得済み位置を取得
+
+        Returns:
+            チャンネルIDをキーとする辞書
+            （値はchannel_name, last_message_id, last_timestamp, synced_atの辞書）
+        """
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.execute(
+                """
+                SELECT channel_id, channel_name, last_message_id, last_timestamp,
+                       synced_at
+                FROM channel_sync_state
+            """
+            )
+            return {
+                row[0]: {
+                    "channel_name": row[1],
+                    "last_message_id": row[2],
+                    "last_timestamp": row[3],
+                    "synced_at": row[4],
+                }
+                for row in cursor.fetchall()
+            }
+
+    def update_channel_sync_state(
+        self,
+        channel_id: int,
+        channel_name: str,
+        last_message_id: int,
+        last_timestamp: float,
+    ):
+        """
+        チャンネルの取得済み位置を記録
+
+        位置は後退しないため、全件再取得で古いメッセージまでしか
+        取得できなかった場合も既存の位置が維持されます。
+        メッセージを保存した後に呼び出してください。
+
+        Args:
+            channel_id: チャンネルID
+            channel_name: チャンネル名
+            last_message_id: 取得済みの最新メッセージID
+            last_timestamp: 取得済みの最新メッセージのタイムスタンプ
+        """
+        conn = self._get_connection()
+        with conn:
+            conn.execute(
+                UPSERT_SYNC_STATE_SQL,
+                (channel_id, channel_name, last_message_id, last_timestamp),
+            )
+
+    def get_crawl_checkpoints(self) -> Dict[int, List[Dict]]:
+        """
+        取得途中のチャンネルのチェックポイントを取得
+
+        Returns:
+            チャンネルIDをキーとし、範囲ごとのチェックポイントの辞書
+            （range_start, range_end, cursor, complete, last_message_id,
+            last_timestamp）のリストを値とする辞書（range_startの昇順）
+        """
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.execute(
+                """
+                SELECT channel_id, range_start, range_end, cursor, complete,
+                       last_message_id, last_timestamp
+                FROM crawl_checkpoints
+                ORDER BY channel_id, range_start
+            """
+            )
+            checkpoints = {}
+            for row in cursor.fetchall():
+                checkpoints.setdefault(row[0], []).append(
+                    {
+                        "range_start": row[1],
+                        "range_end": row[2],
+                        "cursor": row[3],
+                        "complete": bool(row[4]),
+                        "last_message_id": row[5],
+                        "last_timestamp": row[6],
+                    }
+                )
+            return checkpoints
+
+    def save_crawl_checkpoint(
+        self,
+        channel_id: int,
+        channel_name: str,
+        range_start: int,
+        range_end: int,
+        cursor: Optional[int],
+        last_message_id: int,
+        last_timestamp: float,
+        complete: bool = False,
+    ) -> bool:
+        """
+        全履歴取得の進捗（チェックポイント）を記録
+
+        範囲(range_start, range_end)のメッセージを新しい順に取得し、
+        cursorまで保存済みであることを記録します。メッセージを保存した後に
+        呼び出してください。チャンネルの全範囲が完了した場合は、同じ
+        トランザクション内でlast_message_idを取得済み位置として記録し、
+        チェックポイントを削除します。
+
+        Args:
+            channel_id: チャンネルID
+            channel_name: チャンネル名
+            range_start: 範囲の下限（このIDより新しいメッセージが対象、0は最古から）
+            range_end: 範囲の上限（このIDより古いメッセージが対象）
+            cursor: 保存済みの最も古いメッセージID（未着手の場合None）
+            last_message_id: 全範囲の完了時に記録する取得済み位置
+            last_timestamp: last_message_idのメッセージのタイムスタンプ
+            complete: この範囲の取得が完了した場合True
+
+        Returns:
+            bool: チャンネルの全範囲の取得が完了した場合True
+        """
+        conn = self._get_connection()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO crawl_checkpoints
+                    (channel_id, range_start, range_end, cursor, complete,
+                     last_message_id, last_timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(channel_id, range_start) DO UPDATE SET
+                    range_end = excluded.range_end,
+                    cursor = excluded.cursor,
+                    complete = excluded.complete,
+                    last_message_id = excluded.last_message_id,
+                    last_timestamp = excluded.last_timestamp,
+                    updated_at = CURRENT_TIMESTAMP
+            """,
+                (
+                    channel_id,
+                    range_start,
+                    range_end,
+                    cursor,
+                    int(complete),
+                    last_message_id,
+                    last_timestamp,
+                ),
+            )
+            if not complete:
+                return False
+
+            remaining = conn.execute(
+                """
+                SELECT COUNT(*) FROM crawl_checkpoints
+                WHERE channel_id = ? AND complete = 0
+            """,
+                (channel_id,),
+            ).fetchone()[0]
+            if remaining > 0:
+                return False
+
+            conn.execute(
+                UPSERT_SYNC_STATE_SQL,
+                (channel_id, channel_name, last_message_id, last_timestamp),
+            )
+            conn.execute(
+                "DELETE FROM crawl_checkpoints WHERE channel_id = ?", (channel_id,)
+            )
+            return True
+
     def update_message_metadata(
         self,
         message_id: int,
@@ -365,6 +1495,9 @@ class KnowledgeDB:
         """
         メッセージのメタデータを更新
 
+        埋め込みのあるメッセージの場合は、埋め込みを現在の世代で追加し直したものとして
+        世代番号を進めます（埋め込みインデックスの絞り込み用のメタデータを更新するため）。
+
         Args:
             message_id: メッセージID
             category: カテゴリ
@@ -373,7 +1506,8 @@ class KnowledgeDB:
         Returns:
             bool: 更新された場合True、存在しない場合False
         """
-        with sqlite3.connect(self.db_path) as conn:
+        conn = self._get_connection()
+        with conn:
             cursor = conn.cursor()
 
             # 存在チェック
@@ -401,9 +1535,32 @@ class KnowledgeDB:
             set_clause = ", ".join(updates)
             query = "UPDATE messages SET " + set_clause + " WHERE id = ?"
             cursor.execute(query, params)
+
+            cursor.execute(
+                f"""
+                UPDATE embeddings SET generation = ({CURRENT_GENERATION_SQL})
+                WHERE message_id = ?
+                """,
+                (message_id,),
+            )
+            if cursor.rowcount > 0:
+                self._bump_embedding_generation(conn)
             conn.commit()
 
             return True
 
     def close(self):
-        """データベース接続を閉じる（通常は不要: context managerを使用）"""
+        """
+        全スレッドのデータベース接続を閉じる
+
+        最後の接続を閉じた時点でWALの内容がDBファイルに書き戻されるため、
+        DBファイルをコピー・アーカイブする前に必ず呼び出してください。
+        close()後に再びメソッドを呼び出した場合は新しい接続が作成されます。
+        """
+        with self._connections_lock:
+            connections = self._connections
+            self._connections = []
+            self._local = threading.local()
+
+        for conn in connections:
+            conn.close()
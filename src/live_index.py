@@ -0,0 +1,475 @@
+"""
+知識データの差分更新モジュール
+
+Botの起動後に追加・削除された埋め込みを、再起動せずに検索へ反映します。
+
+- 検索は一時点の知識データ（IndexSnapshot）を1つ参照して行います。
+  更新時は新しいIndexSnapshotを作ってから参照を置き換えるため、
+  実行中の検索は更新の途中の状態を参照しません
+- 更新はDBの埋め込み世代番号をポーリングで確認し、前回の読み込み以降に
+  追加・削除された埋め込みだけをDBから読み込みます。追加された埋め込みは
+  メモリ上の小さな行列（差分）として保持し、削除・再生成された埋め込みの行は
+  埋め込みインデックスの検索結果から除きます
+- prepare_dataset.pyで最新の埋め込みインデックスが作成された場合は、
+  差分を捨ててインデックスを読み込み直します（メモリマップのため件数によらず高速）
+
+設定（環境変数）:
+- INDEX_REFRESH_INTERVAL: 更新を確認する間隔（秒、既定値: 60、0で更新しない）
+"""
+
+import os
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ann_index import load_ann_index
+from embedding_index import (
+    INDEX_DIR,
+    EmbeddingIndex,
+    IndexMetadata,
+    load_embedding_index,
+    normalize_rows,
+    read_manifest,
+    search_vectors,
+    search_vectors_batch,
+    top_k_indices,
+)
+from quantized_index import load_quantized_index
+
+DEFAULT_REFRESH_INTERVAL = 60.0
+
+# 除く行がある場合に全行の検索で多めに取得する件数の最小値
+# （除く行の数にかかわらず、最初はtop_k + max(top_k, この値)件までを取得する）
+MIN_HIDDEN_OVERFETCH = 16
+
+
+def get_refresh_interval() -> float:
+    """環境変数INDEX_REFRESH_INTERVAL（更新を確認する間隔、秒）を取得"""
+    value = os.environ.get("INDEX_REFRESH_INTERVAL", "")
+    return max(0.0, float(value)) if value.strip() else DEFAULT_REFRESH_INTERVAL
+
+
+def build_delta_index(rows: Sequence[Tuple]) -> Optional[EmbeddingIndex]:
+    """
+    DBから読み込んだ埋め込みからメモリ上のインデックスを作成
+
+    Args:
+        rows: KnowledgeDB.iter_embeddings(with_metadata=True)の行の並び
+
+    Returns:
+        EmbeddingIndex（行がない場合はNone）
+    """
+    if not rows:
+        return None
+    return EmbeddingIndex(
+        np.array([row[0] for row in rows], dtype=np.int64),
+        normalize_rows(np.vstack([row[2] for row in rows])),
+        [row[1] for row in rows],
+        {},
+        IndexMetadata.from_rows([row[3] for row in rows]),
+    )
+
+
+class IndexSnapshot:
+    """
+    検索に使う一時点の知識データ（作成後は変更しない）
+
+    埋め込みインデックス（とANN・量子化インデックス）に、その作成後に追加された
+    埋め込み（差分）を加え、削除・再生成された埋め込みの行を除いたものです。
+    行の位置は埋め込みインデックスの行を0から、差分の行をその後ろから数えます。
+    """
+
+    def __init__(
+        self,
+        index: EmbeddingIndex,
+        ann_index=None,
+        quantized_index=None,
+        generation: Optional[int] = None,
+        delta_rows: Sequence[Tuple] = (),
+        hidden_rows: Optional[np.ndarray] = None,
+    ):
+        """
+        Args:
+            index: 埋め込みインデックス
+            ann_index: indexに対応するANNインデックス（ない場合はNone）
+            quantized_index: indexに対応する量子化インデックス（ない場合はNone）
+            generation: 反映済みのDBの埋め込み世代番号（JSONモードではNone）
+            delta_rows: index作成後に追加された埋め込み
+                （KnowledgeDB.iter_embeddings(with_metadata=True)の行）
+            hidden_rows: 検索結果から除くindexの行の位置（昇順）
+        """
+        self.index = index
+        self.ann_index = ann_index
+        self.quantized_index = quantized_index
+        self.generation = generation
+        self.delta_rows = list(delta_rows)
+        self.delta = build_delta_index(self.delta_rows)
+        if hidden_rows is None:
+            hidden_rows = np.empty(0, dtype=np.intp)
+        self.hidden_rows = hidden_rows
+
+    def __len__(self) -> int:
+        return len(self.index) - len(self.hidden_rows) + len(self.delta_rows)
+
+    def message_id(self, position: int) -> int:
+        """行の位置のメッセージID"""
+        if position < len(self.index):
+            return int(self.index.ids[position])
+        return int(self.delta.ids[position - len(self.index)])
+
+    def text(self, position: int) -> str:
+        """行の位置の本文"""
+        if position < len(self.index):
+            return self.index.texts[position]
+        return self.delta.texts[position - len(self.index)]
+
+    def vectors(self, positions: Sequence[int]) -> np.ndarray:
+        """行の位置の正規化済みの埋め込み（shape=(件数, 次元数)）"""
+        positions = np.asarray(positions, dtype=np.intp)
+        result = np.empty((len(positions), self.index.vectors.shape[1]), np.float32)
+        in_index = positions < len(self.index)
+        result[in_index] = self.index.vectors[positions[in_index]]
+        if not in_index.all():
+            result[~in_index] = self.delta.vectors[
+                positions[~in_index] - len(self.index)
+            ]
+        return result
+
+    def row_metadata(
+        self, positions: Sequence[int]
+    ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        行の位置のタイムスタンプと重要度
+
+        Returns:
+            (タイムスタンプ, 重要度)。メタデータのない（JSONモードの）場合はNone
+        """
+        if self.index.metadata is None:
+            return None
+        positions = np.asarray(positions, dtype=np.intp)
+        in_index = positions < len(self.index)
+        timestamps = np.empty(len(positions), dtype=np.float64)
+        importance = np.empty(len(positions), dtype=np.int32)
+        timestamps[in_index] = self.index.metadata.timestamps[positions[in_index]]
+        importance[in_index] = self.index.metadata.importance[positions[in_index]]
+        if not in_index.all():
+            delta_positions = positions[~in_index] - len(self.index)
+            timestamps[~in_index] = self.delta.metadata.timestamps[delta_positions]
+            importance[~in_index] = self.delta.metadata.importance[delta_positions]
+        return timestamps, importance
+
+    def vectors_for_ids(self, message_ids: Sequence[int]) -> np.ndarray:
+        """
+        メッセージIDの正規化済みの埋め込み
+
+        Args:
+            message_ids: メッセージIDの並び
+
+        Returns:
+            message_idsと同じ並びの行列（検索対象に埋め込みがないIDは0の行）
+        """
+        positions = self.index.find_rows(message_ids)
+        positions[self._is_hidden(positions)] = -1
+        if self.delta is not None:
+            delta_positions = self.delta.find_rows(message_ids)
+            in_delta = delta_positions >= 0
+            positions[in_delta] = delta_positions[in_delta] + len(self.index)
+
+        result = np.zeros((len(positions), self.index.vectors.shape[1]), np.float32)
+        found = positions >= 0
+        result[found] = self.vectors(positions[found])
+        return result
+
+    def select_rows(self, filters) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        絞り込み条件に一致する行の位置を求める
+
+        Args:
+            filters: 絞り込み条件の辞書（IndexMetadata.select_rowsと同じ）
+
+        Returns:
+            (埋め込みインデックスの行の位置, 差分の行の位置)。条件がない場合はNone
+
+        Raises:
+            ValueError: メタデータのない（JSONモードの）インデックスの場合、
+                または未対応の絞り込み条件が指定された場合
+        """
+        if not filters or all(value is None for value in filters.values()):
+            return None
+        if self.index.metadata is None:
+            raise ValueError("JSONモードでは絞り込み検索を利用できません")
+
+        rows = self.index.metadata.select_rows(filters)
+        if self.delta is None:
+            return rows, np.empty(0, dtype=np.intp)
+        return rows, self.delta.metadata.select_rows(filters)
+
+    def _is_hidden(self, positions: np.ndarray) -> np.ndarray:
+        """行の位置が除く行かどうか（hidden_rowsは昇順のため二分探索で判定）"""
+        hidden = self.hidden_rows
+        if len(hidden) == 0:
+            return np.zeros(np.shape(positions), dtype=bool)
+        found = np.minimum(np.searchsorted(hidden, positions), len(hidden) - 1)
+        return hidden[found] == positions
+
+    def _search_visible(
+        self, search: Callable[[int], Tuple[np.ndarray, np.ndarray]], top_k: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        除く行を含む全行の検索で、除いた後にtop_k件が残るだけ取得
+
+        取得件数はtop_k + min(除く行の数, max(top_k, MIN_HIDDEN_OVERFETCH))から始め、
+        除いた後にtop_k件に満たないクエリがある場合だけ倍にして取得し直します
+        （除く行の数が増えても、検索1回あたりの取得件数は増えない）。
+
+        Args:
+            search: 取得件数を受け取り(行の位置, スコア)を返す検索
+                （1クエリは1次元、複数クエリはクエリごとの行の2次元）
+            top_k: 除いた後に必要な件数
+
+        Returns:
+            (行の位置, スコア, 除く行でない場合Trueのマスク)
+        """
+        needed = top_k + len(self.hidden_rows)
+        fetch = top_k + min(len(self.hidden_rows), max(top_k, MIN_HIDDEN_OVERFETCH))
+        while True:
+            found, scores = search(fetch)
+            visible = ~self._is_hidden(found)
+            enough = np.all(visible.sum(axis=-1) >= top_k)
+            # 取得件数がtop_k + 除く行の数に達していれば、除いた後もtop_k件残る
+            if enough or found.shape[-1] < fetch or fetch >= needed:
+                return found, scores, visible
+            fetch = min(fetch * 2, needed)
+
+    def _search_index(
+        self, query: np.ndarray, top_k: int, rows: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """埋め込みインデックスの検索（ANN・量子化インデックスがあれば使用）"""
+        vectors = self.index.vectors
+
+        def search(count):
+            if self.ann_index is not None:
+                return self.ann_index.search(
+                    vectors, query, count, quantized=self.quantized_index, rows=rows
+                )
+            if self.quantized_index is not None:
+                return self.quantized_index.search(vectors, query, count, rows=rows)
+            return search_vectors(vectors, query, count, rows=rows)
+
+        if len(self.hidden_rows) == 0:
+            return search(top_k)
+        if rows is not None:
+            # 絞り込み検索では対象の行から除いておく
+            rows = rows[~self._is_hidden(rows)]
+            return search(top_k)
+
+        found, scores, visible = self._search_visible(search, top_k)
+        return found[visible][:top_k], scores[visible][:top_k]
+
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int,
+        selection: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        クエリとのコサイン類似度が高い順にtop_k件を検索
+
+        Args:
+            query: クエリの埋め込み（正規化は不要）
+            top_k: 取得件数
+            selection: select_rowsで求めた行の位置（Noneの場合は全行）
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (行の位置, コサイン類似度)
+        """
+        index_rows, delta_rows = selection if selection is not None else (None, None)
+        found, scores = self._search_index(query, top_k, index_rows)
+        if self.delta is None:
+            return found, scores
+
+        delta_found, delta_scores = self.delta.search(query, top_k, rows=delta_rows)
+        found = np.concatenate([found, delta_found + len(self.index)])
+        scores = np.concatenate([scores, delta_scores])
+        best = top_k_indices(scores, top_k)
+        return found[best], scores[best]
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        top_k: int,
+        selection: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        複数のクエリについて、コサイン類似度が高い順にtop_k件を検索
+
+        埋め込みインデックスと差分は、それぞれ全クエリとの行列同士の積で
+        まとめて計算します。ANN・量子化インデックスがある場合は、
+        それぞれの方式でクエリごとに検索します（どちらも計算する行が少ないため）。
+
+        Args:
+            queries: クエリの埋め込みの行列（shape=(クエリ数, 次元数)、正規化は不要）
+            top_k: クエリごとの取得件数
+            selection: select_rowsで求めた行の位置（Noneの場合は全行）
+
+        Returns:
+            クエリごとの(行の位置, コサイン類似度)のリスト
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if self.ann_index is not None or self.quantized_index is not None:
+            return [self.search(query, top_k, selection) for query in queries]
+
+        index_rows, delta_rows = selection if selection is not None else (None, None)
+
+        def search(count):
+            return search_vectors_batch(
+                self.index.vectors, queries, count, rows=index_rows
+            )
+
+        visible = None
+        if len(self.hidden_rows) == 0:
+            found, scores = search(top_k)
+        elif index_rows is not None:
+            index_rows = index_rows[~self._is_hidden(index_rows)]
+            found, scores = search(top_k)
+        else:
+            found, scores, visible = self._search_visible(search, top_k)
+        if self.delta is not None:
+            delta_found, delta_scores = self.delta.search_batch(
+                queries, top_k, rows=delta_rows
+            )
+
+        results = []
+        for i in range(len(queries)):
+            rows, row_scores = found[i], scores[i]
+            if visible is not None:
+                rows = rows[visible[i]][:top_k]
+                row_scores = row_scores[visible[i]][:top_k]
+            if self.delta is not None:
+                rows = np.concatenate([rows, delta_found[i] + len(self.index)])
+                row_scores = np.concatenate([row_scores, delta_scores[i]])
+                best = top_k_indices(row_scores, top_k)
+                rows, row_scores = rows[best], row_scores[best]
+            results.append((rows, row_scores))
+        return results
+
+    def with_indexes(self, ann_index, quantized_index) -> "IndexSnapshot":
+        """
+        ANN・量子化インデックスを置き換えたIndexSnapshotを作成（同じ場合は自身）
+        """
+        if ann_index is self.ann_index and quantized_index is self.quantized_index:
+            return self
+        return IndexSnapshot(
+            self.index,
+            ann_index,
+            quantized_index,
+            self.generation,
+            self.delta_rows,
+            self.hidden_rows,
+        )
+
+    def with_changes(
+        self, rows: Sequence[Tuple], deleted_ids: Sequence[int], generation: int
+    ) -> "IndexSnapshot":
+        """
+        追加・削除された埋め込みを反映した新しいIndexSnapshotを作成
+
+        処理量は差分の件数に比例します（埋め込みインデックスはそのまま共有）。
+        同じ埋め込みを重ねて反映しても結果は変わりません。
+
+        Args:
+            rows: 追加された埋め込み（KnowledgeDB.iter_embeddings(with_metadata=True)の行）
+            deleted_ids: 削除された埋め込みのメッセージID
+            generation: 反映後のDBの埋め込み世代番号
+
+        Returns:
+            新しいIndexSnapshot
+        """
+        # 追加された埋め込みと同じIDの既存の行は、古い（または重複した）行として除く
+        changed_ids = set(deleted_ids) | {row[0] for row in rows}
+        hidden_rows = self.hidden_rows
+        if changed_ids:
+            hidden_rows = np.union1d(
+                hidden_rows, self.index.rows_for_ids(sorted(changed_ids))
+            )
+
+        delta_rows: List[Tuple] = [
+            row for row in self.delta_rows if row[0] not in changed_ids
+        ]
+        delta_rows.extend(rows)
+        return IndexSnapshot(
+            self.index,
+            self.ann_index,
+            self.quantized_index,
+            generation,
+            delta_rows,
+            hidden_rows,
+        )
+
+
+def load_index_snapshot(db, index_dir: str = INDEX_DIR) -> Optional[IndexSnapshot]:
+    """
+    DBと一致する最新の埋め込みインデックスからIndexSnapshotを作成
+
+    Args:
+        db: KnowledgeDBインスタンス
+        index_dir: インデックスのディレクトリ
+
+    Returns:
+        IndexSnapshot（インデックスがない・古い・空の場合はNone）
+    """
+    index = load_embedding_index(
+        index_dir, db.get_embedding_count(), db.get_embedding_generation()
+    )
+    if index is None or len(index) == 0:
+        return None
+    return IndexSnapshot(
+        index,
+        load_ann_index(index_dir, index.manifest),
+        load_quantized_index(index_dir, index.manifest),
+        index.manifest["generation"],
+    )
+
+
+def refresh_snapshot(
+    db, snapshot: IndexSnapshot, index_dir: str = INDEX_DIR
+) -> Optional[IndexSnapshot]:
+    """
+    DBの埋め込みの追加・削除を反映したIndexSnapshotを作成
+
+    DBと一致する新しい埋め込みインデックスが作成されていればそれを読み込み、
+    そうでなければ前回の反映以降の差分だけをDBから読み込みます。
+
+    Args:
+        db: KnowledgeDBインスタンス
+        snapshot: 現在のIndexSnapshot
+        index_dir: インデックスのディレクトリ
+
+    Returns:
+        新しいIndexSnapshot（変更がない場合はNone）
+    """
+    generation = db.get_embedding_generation()
+    manifest = read_manifest(index_dir) or {}
+    if manifest.get("generation") != snapshot.index.manifest.get("generation"):
+        reloaded = load_index_snapshot(db, index_dir)
+        if reloaded is not None:
+            return reloaded
+
+    # 埋め込みインデックスの読み込み後に作成されたANN・量子化インデックスを追加
+    updated = snapshot.with_indexes(
+        snapshot.ann_index or load_ann_index(index_dir, snapshot.index.manifest),
+        snapshot.quantized_index
+        or load_quantized_index(index_dir, snapshot.index.manifest),
+    )
+
+    if generation == snapshot.generation:
+        return updated if updated is not snapshot else None
+    snapshot = updated
+
+    # 世代番号の取得後に書き込まれた埋め込みも読み込まれるが、
+    # 次回の反映で同じ埋め込みを重ねて反映するだけなので問題ない
+    rows = list(
+        db.iter_embeddings(with_metadata=True, since_generation=snapshot.generation)
+    )
+    deleted_ids = db.get_deleted_embedding_ids(snapshot.generation)
+    return snapshot.with_changes(rows, deleted_ids, generation)
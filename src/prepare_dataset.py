@@ -2,17 +2,37 @@
 埋め込みデータ生成スクリプト
 
 メッセージデータから埋め込みベクトルを生成します。
-データベースモード: 未生成メッセージのみ処理（増分更新）
+データベースモード: 未生成メッセージのみ分割して処理（増分更新）
 JSONモード: 全メッセージを処理（後方互換）
 """
 
 import json
 import os
 import sys
+from itertools import islice
 
 from sentence_transformers import SentenceTransformer
 
+from ann_index import (
+    build_ann_index,
+    get_ann_min_vectors,
+    load_ann_index,
+    remove_ann_index,
+)
+from embedding_index import (
+    INDEX_DIR,
+    is_index_fresh,
+    load_embedding_index,
+    read_manifest,
+    write_embedding_index,
+)
 from knowledge_db import KnowledgeDB
+from quantized_index import (
+    build_quantized_index,
+    is_quantization_enabled,
+    load_quantized_index,
+    remove_quantized_index,
+)
 
 DATA_PATH = os.path.join(os.path.dirname(__file__), "../data/messages.json")
 OUTPUT_PATH = os.path.join(os.path.dirname(__file__), "../data/embeddings.json")
@@ -20,6 +40,132 @@ DB_PATH = os.path.join(os.path.dirname(__file__), "../data/knowledge.db")
 
 USE_JSON_FALLBACK = os.environ.get("USE_JSON_FALLBACK", "false").lower() == "true"
 
+# データベースモードで1回に埋め込みを生成・保存するメッセージ数
+# （メモリ使用量はメッセージ総数によらずこの件数分に収まる）
+ENCODE_CHUNK_SIZE = 5000
+
+
+def load_model():
+    """埋め込みモデルをロード"""
+    print("🔄 埋め込みモデルをロード中...")
+    model = SentenceTransformer("all-MiniLM-L6-v2")
+    print("✅ モデルのロード完了")
+    print()
+    return model
+
+
+def embed_pending_messages(db, model, pending_count, chunk_size=ENCODE_CHUNK_SIZE):
+    """
+    埋め込み未生成のメッセージをchunk_size件ずつ読み込み、生成・保存する
+
+    Args:
+        db: KnowledgeDBインスタンス
+        model: SentenceTransformerモデル
+        pending_count: 未生成メッセージ数（進捗表示用）
+        chunk_size: 1回に処理するメッセージ数
+
+    Returns:
+        新規保存した埋め込み数
+    """
+    pending = db.iter_pending_embeddings()
+    processed = 0
+    saved_count = 0
+
+    while True:
+        chunk = list(islice(pending, chunk_size))
+        if not chunk:
+            break
+        processed += len(chunk)
+
+        # 空コンテンツを除外しつつIDと整合性を保持
+        message_ids = []
+        texts = []
+        for message_id, content in chunk:
+            if not isinstance(content, str):
+                continue
+            if not content.strip():
+                continue
+            message_ids.append(message_id)
+            texts.append(content)
+
+        if texts:
+            embeddings = model.encode(texts)
+            saved_count += db.insert_embeddings_batch(message_ids, embeddings)
+
+        print(f"   進捗: {processed}/{pending_count}件")
+
+    return saved_count
+
+
+def update_embedding_index(db):
+    """
+    Bot起動用の埋め込みインデックスを必要に応じて作成
+
+    DBの埋め込み件数・世代番号とインデックスが一致している場合は作成せず、
+    ANN・量子化インデックスの更新のみ行います。
+
+    Args:
+        db: KnowledgeDBインスタンス
+    """
+    manifest = read_manifest(INDEX_DIR)
+    if is_index_fresh(
+        manifest, db.get_embedding_count(), db.get_embedding_generation()
+    ):
+        print("✅ 埋め込みインデックスは最新です")
+    else:
+        print("🔄 埋め込みインデックスを作成中...")
+        count = write_embedding_index(db, INDEX_DIR)
+        print(f"✅ 埋め込みインデックスを作成しました: {count}件 ({INDEX_DIR})")
+
+    update_ann_index()
+    update_quantized_index()
+
+
+def update_ann_index():
+    """
+    埋め込みインデックスに対応するANNインデックスを必要に応じて作成
+
+    前回のANNインデックスがあれば学習済みの重心を再利用し、
+    新しい埋め込みだけをリストに割り当てます。
+    件数がANN_MIN_VECTORS未満の場合は作成しません（全件検索で十分高速）。
+    """
+    index = load_embedding_index(INDEX_DIR)
+    if index is None or len(index) < get_ann_min_vectors():
+        remove_ann_index(INDEX_DIR)
+        return
+
+    if load_ann_index(INDEX_DIR, index.manifest) is not None:
+        print("✅ ANNインデックスは最新です")
+        return
+
+    print("🔄 ANNインデックスを作成中...")
+    manifest = build_ann_index(index, INDEX_DIR)
+    print(
+        f"✅ ANNインデックスを作成しました: {manifest['nlist']}リスト"
+        f"（新たに割り当てた埋め込み: {manifest['assigned']}件）"
+    )
+
+
+def update_quantized_index():
+    """
+    埋め込みインデックスに対応する量子化インデックス（int8）を必要に応じて作成
+
+    QUANTIZE_EMBEDDINGS=trueの場合のみ作成し、それ以外の場合は削除します。
+    スケールは埋め込みインデックスの作成のたびに学習し直します。
+    """
+    index = load_embedding_index(INDEX_DIR)
+    if index is None or len(index) == 0 or not is_quantization_enabled():
+        remove_quantized_index(INDEX_DIR)
+        return
+
+    if load_quantized_index(INDEX_DIR, index.manifest) is not None:
+        print("✅ 量子化インデックスは最新です")
+        return
+
+    print("🔄 量子化インデックス（int8）を作成中...")
+    manifest = build_quantized_index(index, INDEX_DIR)
+    print(f"✅ 量子化インデックスを作成しました: {manifest['count']}件")
+
 
 def main():
     """メイン処理"""
@@ -35,32 +181,47 @@ def main():
         print("📊 データベースモード: SQLite（増分更新）")
         db = KnowledgeDB(DB_PATH)
 
-        # 未生成メッセージを取得
-        messages = db.get_messages_without_embeddings()
+        # 旧形式（JSON）の埋め込みをバイナリ形式へ変換
+        legacy_count = db.count_legacy_embeddings()
+        if legacy_count > 0:
+            print(f"🔄 旧形式の埋め込み{legacy_count}件をバイナリ形式に変換中...")
+            migrated = db.migrate_embeddings_to_binary()
+            print(f"   変換完了: {migrated}件")
+            print()
+
         total_messages = db.get_message_count()
         existing_embeddings = db.get_embedding_count()
+        pending_count = db.get_pending_embedding_count()
 
         print(f"   メッセージ総数: {total_messages}件")
         print(f"   既存埋め込み: {existing_embeddings}件")
-        print(f"   未生成メッセージ: {len(messages)}件")
+        print(f"   未生成メッセージ: {pending_count}件")
         print()
 
-        if len(messages) == 0:
+        if pending_count == 0:
             print("✅ 全てのメッセージに埋め込みが生成済みです")
+            update_embedding_index(db)
+            db.close()
             return
 
-        # メッセージ本文のみ抽出（空コンテンツを除外しつつIDと整合性を保持）
-        texts = []
-        message_ids = []
-        for msg in messages:
-            content = msg.get("content", "")
-            if not isinstance(content, str):
-                continue
-            if not content.strip():
-                continue
-            texts.append(content)
-            message_ids.append(msg["id"])
+        model = load_model()
+
+        # 埋め込みを分割して生成し、その都度データベースに保存
+        print(f"🔄 {pending_count}件のメッセージの埋め込みを生成・保存中...")
+        saved_count = embed_pending_messages(db, model, pending_count)
+        print("✅ 埋め込み生成完了")
+        print()
 
+        total_embeddings = db.get_embedding_count()
+        print(f"   新規追加: {saved_count}件")
+        print(f"   累積総数: {total_embeddings}件")
+        print()
+        print(f"✅ データベースへの保存が完了しました: {DB_PATH}")
+        print()
+
+        update_embedding_index(db)
+        # WALの内容をDBファイルに書き戻すため接続を閉じる
+        db.close()
     else:
         print("📊 JSONモード（後方互換）")
         print()
@@ -79,33 +240,14 @@ def main():
         print(f"   メッセージ総数: {len(texts)}件")
         print()
 
-    # 埋め込みモデルのロード
-    print("🔄 埋め込みモデルをロード中...")
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    print("✅ モデルのロード完了")
-    print()
-
-    # 埋め込み生成
-    print(f"🔄 {len(texts)}件のメッセージの埋め込みを生成中...")
-    embeddings = model.encode(texts, show_progress_bar=True)
-    print("✅ 埋め込み生成完了")
-    print()
+        model = load_model()
 
-    # データベースまたはJSONに保存
-    if use_db:
-        # データベースに保存
-        print("💾 データベースに保存中...")
-        saved_count = 0
-        for message_id, embedding in zip(message_ids, embeddings):
-            if db.insert_embedding(message_id, embedding.tolist()):
-                saved_count += 1
-
-        total_embeddings = db.get_embedding_count()
-        print(f"   新規追加: {saved_count}件")
-        print(f"   累積総数: {total_embeddings}件")
+        # 埋め込み生成
+        print(f"🔄 {len(texts)}件のメッセージの埋め込みを生成中...")
+        embeddings = model.encode(texts, show_progress_bar=True)
+        print("✅ 埋め込み生成完了")
         print()
-        print(f"✅ データベースへの保存が完了しました: {DB_PATH}")
-    else:
+
         # JSONファイルに保存
         output = [
             {"text": text, "embedding": emb.tolist()}
@@ -0,0 +1,318 @@
+"""
+量子化インデックスモジュール
+
+埋め込みインデックス（embedding_index.py）の正規化済み行列を、次元ごとの
+スケールでint8に量子化したコードを作成・読み込みします。
+
+- 作成: 標本から次元ごとの絶対値の上位パーセンタイルを求めてスケールとし、
+  各成分を-127〜127に丸めたコードを保存します
+- 検索: コードでクエリとの近似スコアを求めて候補を絞り込み、
+  候補の行だけをfloat32の行列で厳密に計算し直して並べ替えます
+
+Botは全件のスコア計算でint8のコード（float32の1/4の大きさ）だけを読むため、
+float32の行列は候補の行だけをファイルから読み込みます（プロセスに常駐しません）。
+
+ファイル構成（埋め込みインデックスと同じディレクトリ）:
+- int8_codes.npy: 量子化したコード（件数×次元数のint8、行の並びはvectors.npyと同じ）
+- int8_scales.npy: 次元ごとのスケール（float32）
+- int8.json: 対応する埋め込みインデックスの件数と世代番号など
+"""
+
+import json
+import mmap
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from embedding_index import normalize_rows, top_k_indices
+
+# 量子化インデックスの形式バージョン（互換性のない変更時に更新）
+QUANT_FORMAT_VERSION = 1
+
+QUANT_MANIFEST_FILE = "int8.json"
+CODES_FILE = "int8_codes.npy"
+SCALES_FILE = "int8_scales.npy"
+
+# 厳密に計算し直す候補数の既定値
+DEFAULT_RERANK_CANDIDATES = 64
+
+# スケールの学習に使う最大の行数と、外れ値を丸めるパーセンタイル
+TRAIN_SAMPLE_ROWS = 100_000
+CLIP_PERCENTILE = 99.99
+
+# 量子化で一度に処理する行数（作成時のメモリ使用量をこの行数分に抑える）
+CHUNK_ROWS = 8192
+
+# 近似スコアの計算で一度にfloat32に変換する行数
+# （変換結果がCPUキャッシュに収まる大きさにすると、全件の計算が最も速い）
+SCORE_CHUNK_ROWS = 512
+
+
+def is_quantization_enabled() -> bool:
+    """環境変数QUANTIZE_EMBEDDINGS（量子化インデックスを作成するか）を取得"""
+    return os.environ.get("QUANTIZE_EMBEDDINGS", "false").lower() == "true"
+
+
+def get_rerank_candidates() -> int:
+    """環境変数QUANT_RERANK_CANDIDATES（厳密に計算し直す候補数）を取得"""
+    value = os.environ.get("QUANT_RERANK_CANDIDATES", "")
+    return max(1, int(value)) if value.strip() else DEFAULT_RERANK_CANDIDATES
+
+
+def train_scales(vectors: np.ndarray, seed: int = 0) -> np.ndarray:
+    """
+    次元ごとのスケールを学習
+
+    標本の各次元の絶対値のCLIP_PERCENTILEパーセンタイルを127に対応させます。
+
+    Args:
+        vectors: 正規化済みの行列
+        seed: 乱数シード
+
+    Returns:
+        次元ごとのスケール（float32）
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), TRAIN_SAMPLE_ROWS)
+    sample_rows = np.sort(rng.choice(len(vectors), sample_size, replace=False))
+    sample = np.abs(np.asarray(vectors[sample_rows], dtype=np.float32))
+
+    limits = np.percentile(sample, CLIP_PERCENTILE, axis=0)
+    limits[limits <= 0] = 1.0
+    return (limits / 127).astype(np.float32)
+
+
+def quantize(vectors: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """行列をint8のコードに量子化"""
+    codes = np.rint(np.asarray(vectors, dtype=np.float32) / scales)
+    return np.clip(codes, -127, 127).astype(np.int8)
+
+
+def read_rows(vectors: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """
+    行列の指定した行を読み込む
+
+    np.load(mmap_mode="r")で読み込んだ行列は、ページフォールト時の先読みで
+    周辺の行までプロセスに常駐しないよう、ファイルから1行ずつ読み込みます。
+
+    Args:
+        vectors: 行列（メモリマップまたは通常の配列）
+        rows: 昇順に並べた行の位置
+
+    Returns:
+        指定した行のコピー
+    """
+    if not isinstance(vectors, np.memmap) or not isinstance(vectors.base, mmap.mmap):
+        return np.asarray(vectors[rows])
+
+    row_bytes = vectors.shape[1] * vectors.dtype.itemsize
+    result = np.empty((len(rows), vectors.shape[1]), dtype=vectors.dtype)
+    fd = os.open(vectors.filename, os.O_RDONLY)
+    try:
+        for i, row in enumerate(rows):
+            data = os.pread(fd, row_bytes, vectors.offset + int(row) * row_bytes)
+            result[i] = np.frombuffer(data, dtype=vectors.dtype)
+    finally:
+        os.close(fd)
+    return result
+
+
+def rerank(
+    vectors: np.ndarray, rows: np.ndarray, query: np.ndarray, top_k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    候補の行をfloat32の行列で厳密に計算し直し、上位top_k件を返す
+
+    Args:
+        vectors: 正規化済みのfloat32行列
+        rows: 候補の行の位置
+        query: 正規化済みのクエリ
+        top_k: 取得件数
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (行の位置, コサイン類似度)
+    """
+    # メモリマップからの読み込みが前から順になるよう並べる
+    rows = np.sort(rows)
+    scores = read_rows(vectors, rows) @ query
+    best = top_k_indices(scores, top_k)
+    return rows[best], scores[best]
+
+
+class Int8Index:
+    """int8に量子化した埋め込みによる検索インデックス"""
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray, manifest: Dict):
+        """
+        Args:
+            codes: 量子化したコード（件数×次元数のint8）
+            scales: 次元ごとのスケール
+            manifest: int8.jsonの内容
+        """
+        self.codes = codes
+        self.scales = scales
+        self.manifest = manifest
+
+    def scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None):
+        """
+        クエリとの近似スコア（内積）を計算
+
+        Args:
+            query: 正規化済みのクエリ
+            rows: 計算する行の位置（Noneの場合は全行）
+
+        Returns:
+            近似スコアの配列（float32）
+        """
+        weights = (query * self.scales).astype(np.float32)
+        total = len(self.codes) if rows is None else len(rows)
+        scores = np.empty(total, dtype=np.float32)
+        for start in range(0, total, SCORE_CHUNK_ROWS):
+            end = min(start + SCORE_CHUNK_ROWS, total)
+            if rows is None:
+                chunk = self.codes[start:end]
+            else:
+                chunk = self.codes[rows[start:end]]
+            scores[start:end] = chunk.astype(np.float32) @ weights
+        return scores
+
+    def search(
+        self,
+        vectors: np.ndarray,
+        query: np.ndarray,
+        top_k: int,
+        rows: Optional[np.ndarray] = None,
+        candidates: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        近似スコアで候補を絞り込み、float32で計算し直した上位top_k件を返す
+
+        Args:
+            vectors: インデックス作成時と同じ正規化済みのfloat32行列
+            query: クエリの埋め込み（正規化は不要）
+            top_k: 取得件数
+            rows: 検索対象の行の位置（Noneの場合は全行、ANNインデックスや絞り込み条件から渡される）
+            candidates: 計算し直す候補数（省略時は環境変数QUANT_RERANK_CANDIDATESまたは既定値）
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (行の位置, コサイン類似度)
+        """
+        query = normalize_rows(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        candidates = max(candidates or get_rerank_candidates(), top_k)
+
+        best = top_k_indices(self.scores(query, rows), candidates)
+        if rows is not None:
+            best = rows[best]
+        return rerank(vectors, best, query, top_k)
+
+
+def read_quantized_manifest(index_dir: str) -> Optional[Dict]:
+    """int8.jsonを読み込む（存在しない・読み込めない場合はNone）"""
+    path = os.path.join(index_dir, QUANT_MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def remove_quantized_index(index_dir: str):
+    """量子化インデックスのファイルを削除"""
+    for name in (QUANT_MANIFEST_FILE, CODES_FILE, SCALES_FILE):
+        path = os.path.join(index_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def build_quantized_index(index, index_dir: str) -> Dict:
+    """
+    埋め込みインデックスから量子化インデックスを作成
+
+    コードはCHUNK_ROWS行ずつ量子化してファイルに直接書き込むため、
+    作成時のメモリ使用量は件数によらずほぼ一定です。
+
+    Args:
+        index: 埋め込みインデックス（EmbeddingIndex）
+        index_dir: 出力先ディレクトリ（埋め込みインデックスと同じ）
+
+    Returns:
+        作成したint8.jsonの内容
+    """
+    vectors = index.vectors
+    count, dim = vectors.shape
+    scales = train_scales(vectors)
+
+    # 作成中の量子化インデックスが使われないよう、先にmanifestを削除
+    manifest_path = os.path.join(index_dir, QUANT_MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    temp_codes_path = os.path.join(index_dir, CODES_FILE + ".tmp")
+    codes = np.lib.format.open_memmap(
+        temp_codes_path, mode="w+", dtype=np.int8, shape=(count, dim)
+    )
+    for start in range(0, count, CHUNK_ROWS):
+        end = min(start + CHUNK_ROWS, count)
+        codes[start:end] = quantize(vectors[start:end], scales)
+    codes.flush()
+    del codes
+    os.replace(temp_codes_path, os.path.join(index_dir, CODES_FILE))
+
+    temp_scales_path = os.path.join(index_dir, SCALES_FILE + ".tmp")
+    with open(temp_scales_path, "wb") as f:
+        np.save(f, scales)
+    os.replace(temp_scales_path, os.path.join(index_dir, SCALES_FILE))
+
+    manifest = {
+        "version": QUANT_FORMAT_VERSION,
+        "type": "int8",
+        "dim": int(dim),
+        "count": int(count),
+        "index_generation": index.manifest.get("generation"),
+        "index_count": index.manifest.get("count"),
+    }
+    temp_manifest_path = manifest_path + ".tmp"
+    with open(temp_manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_manifest_path, manifest_path)
+
+    return manifest
+
+
+def load_quantized_index(index_dir: str, index_manifest: Dict) -> Optional[Int8Index]:
+    """
+    量子化インデックスをメモリマップで読み込む
+
+    埋め込みインデックス（index_manifest）と対応していない場合は読み込みません。
+
+    Args:
+        index_dir: インデックスのディレクトリ
+        index_manifest: 埋め込みインデックスのmanifest.jsonの内容
+
+    Returns:
+        Int8Index（存在しない・対応していない・壊れている場合はNone）
+    """
+    manifest = read_quantized_manifest(index_dir)
+    if (
+        manifest is None
+        or manifest.get("version") != QUANT_FORMAT_VERSION
+        or manifest.get("index_generation") != index_manifest.get("generation")
+        or manifest.get("index_count") != index_manifest.get("count")
+    ):
+        return None
+
+    try:
+        codes = np.load(os.path.join(index_dir, CODES_FILE), mmap_mode="r")
+        scales = np.load(os.path.join(index_dir, SCALES_FILE))
+    except (OSError, ValueError):
+        return None
+
+    if codes.shape != (manifest["count"], manifest["dim"]) or scales.shape != (
+        manifest["dim"],
+    ):
+        return None
+
+    return Int8Index(codes, scales, manifest)
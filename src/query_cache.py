@@ -0,0 +1,176 @@
+"""
+クエリ埋め込みキャッシュモジュール
+
+同じ質問が繰り返された場合に、埋め込みモデルでの計算（CPUでは検索1回あたりの
+最大の固定費）を省くため、クエリの埋め込みを件数上限付きのLRUで保持します。
+
+- キーは正規化した質問文（Unicode正規化NFKC・小文字化・連続する空白の統一）です。
+  埋め込みは元の質問文から計算し、キーが同じ質問には最初に計算した埋め込みを使います
+  （all-MiniLM-L6-v2は大文字・小文字を区別しません）
+- 埋め込みモデルが別のインスタンスに変わった場合は全て破棄します
+- ヒット・ミスの回数と件数をstats()で確認できます
+
+設定（環境変数）:
+- QUERY_CACHE_SIZE: 保持するクエリ数の上限（既定値: 256、0でキャッシュしない）
+"""
+
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Sequence
+
+import numpy as np
+
+DEFAULT_QUERY_CACHE_SIZE = 256
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def get_query_cache_size() -> int:
+    """環境変数QUERY_CACHE_SIZE（保持するクエリ数の上限）を取得"""
+    value = os.environ.get("QUERY_CACHE_SIZE", "")
+    return max(0, int(value)) if value.strip() else DEFAULT_QUERY_CACHE_SIZE
+
+
+def normalize_query(query: str) -> str:
+    """
+    キャッシュのキーにする質問文の正規化
+
+    Unicode正規化（NFKC、全角英数字を半角にする）・小文字化を行い、
+    連続する空白を1つの半角スペースにして前後の空白を除きます。
+    """
+    query = unicodedata.normalize("NFKC", query).lower()
+    return _WHITESPACE_PATTERN.sub(" ", query).strip()
+
+
+class QueryEmbeddingCache:
+    """クエリの埋め込みのLRUキャッシュ（スレッドセーフ）"""
+
+    def __init__(self, maxsize: int = DEFAULT_QUERY_CACHE_SIZE):
+        """
+        Args:
+            maxsize: 保持するクエリ数の上限（0でキャッシュしない）
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._model = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def encode(self, model, query: str) -> np.ndarray:
+        """
+        クエリの埋め込みを取得（キャッシュにない場合はモデルで計算して保持）
+
+        Args:
+            model: 埋め込みモデル（encodeメソッドを持つオブジェクト）
+            query: 質問文
+
+        Returns:
+            float32の埋め込み（読み取り専用）
+        """
+        key = normalize_query(query)
+        with self._lock:
+            if model is not self._model:
+                # 埋め込みモデルが変わった場合は保持している埋め込みを破棄
+                self._entries.clear()
+                self._model = model
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        # モデルの計算中はロックを保持しない（同じクエリを同時に計算する場合がある）
+        vector = np.array(model.encode(query), dtype=np.float32)
+        vector.flags.writeable = False
+
+        with self._lock:
+            if self.maxsize > 0 and model is self._model:
+                self._entries[key] = vector
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return vector
+
+    def encode_batch(self, model, queries: Sequence[str]) -> np.ndarray:
+        """
+        複数のクエリの埋め込みを取得（キャッシュにないクエリはモデルでまとめて計算）
+
+        Args:
+            model: 埋め込みモデル（文字列のリストを受け取るencodeメソッドを持つ）
+            queries: 質問文のリスト
+
+        Returns:
+            float32の埋め込みの行列（shape=(クエリ数, 次元数)、queriesと同じ並び）
+        """
+        keys = [normalize_query(query) for query in queries]
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            if model is not self._model:
+                self._entries.clear()
+                self._model = model
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is None:
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = vector
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+
+        # キャッシュにないクエリは重複を除いて1回のバッチで計算（キーごとに最初の質問文）
+        missing: Dict[str, str] = {}
+        for key, query in zip(keys, queries):
+            if key not in found:
+                missing.setdefault(key, query)
+        if missing:
+            computed = {}
+            vectors = np.asarray(model.encode(list(missing.values())))
+            for key, vector in zip(missing, vectors):
+                # 行ごとに複製して、キャッシュがバッチ全体の行列を保持しないようにする
+                vector = np.array(vector, dtype=np.float32)
+                vector.flags.writeable = False
+                computed[key] = vector
+            found.update(computed)
+            with self._lock:
+                if self.maxsize > 0 and model is self._model:
+                    for key, vector in computed.items():
+                        self._entries[key] = vector
+                        self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+
+        if not keys:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack([found[key] for key in keys])
+
+    def clear(self):
+        """保持している埋め込みとヒット・ミスの回数を破棄"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict:
+        """
+        キャッシュの状態
+
+        Returns:
+            dict: size（件数）, maxsize（上限）, hits, misses, hit_rate（ヒット率）
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
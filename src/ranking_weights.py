@@ -0,0 +1,128 @@
+"""
+検索結果の重み付けモジュール
+
+コサイン類似度だけで順位を決めると、数年前の古い回答も最近の回答と同じように
+上位に入ります。そこで、ベクトル検索の候補のスコアに新しさ（時間の経過による減衰）と
+重要度を加えて並べ替えます。
+
+    スコア = コサイン類似度
+            + RECENCY_WEIGHT × 0.5 ^ (経過日数 / RECENCY_HALF_LIFE_DAYS)
+            + IMPORTANCE_WEIGHT × 重要度 / 10
+
+- 新しさと重要度は、埋め込みインデックスの行ごとのメタデータ（timestamps.npy・
+  importance.npy、起動後の差分は読み込んだメタデータ）から候補の行の分だけ取り出し、
+  候補全体を1回の配列演算で計算します
+- 重み付けは多めに取得した候補（top_kの数倍）に対して行うため、類似度の低い
+  メッセージが新しさ・重要度だけで上位に入ることはありません
+
+設定（環境変数）:
+- RECENCY_WEIGHT: 新しさの重み（既定値: 0.05、0で新しさを考慮しない）
+- RECENCY_HALF_LIFE_DAYS: 新しさの重みが半分になる経過日数（既定値: 365）
+- IMPORTANCE_WEIGHT: 重要度の重み（既定値: 0.05、0で重要度を考慮しない）
+"""
+
+import os
+
+import numpy as np
+
+DEFAULT_RECENCY_WEIGHT = 0.05
+DEFAULT_RECENCY_HALF_LIFE_DAYS = 365.0
+DEFAULT_IMPORTANCE_WEIGHT = 0.05
+
+# 重要度の上限（0-10、NULLや範囲外の値は0〜10に収める）
+MAX_IMPORTANCE = 10
+
+SECONDS_PER_DAY = 86400.0
+
+
+def _get_float(name: str, default: float) -> float:
+    """環境変数を0以上の小数として取得（未設定の場合は既定値）"""
+    value = os.environ.get(name, "")
+    return max(0.0, float(value)) if value.strip() else default
+
+
+def get_recency_weight() -> float:
+    """環境変数RECENCY_WEIGHT（新しさの重み）を取得"""
+    return _get_float("RECENCY_WEIGHT", DEFAULT_RECENCY_WEIGHT)
+
+
+def get_recency_half_life_days() -> float:
+    """環境変数RECENCY_HALF_LIFE_DAYS（新しさの重みが半分になる日数）を取得"""
+    return _get_float("RECENCY_HALF_LIFE_DAYS", DEFAULT_RECENCY_HALF_LIFE_DAYS)
+
+
+def get_importance_weight() -> float:
+    """環境変数IMPORTANCE_WEIGHT（重要度の重み）を取得"""
+    return _get_float("IMPORTANCE_WEIGHT", DEFAULT_IMPORTANCE_WEIGHT)
+
+
+def weight_scores(
+    similarity: np.ndarray,
+    timestamps: np.ndarray,
+    importance: np.ndarray,
+    now: float,
+    recency_weight: float = DEFAULT_RECENCY_WEIGHT,
+    half_life_days: float = DEFAULT_RECENCY_HALF_LIFE_DAYS,
+    importance_weight: float = DEFAULT_IMPORTANCE_WEIGHT,
+) -> np.ndarray:
+    """
+    コサイン類似度に新しさと重要度の重みを加えたスコアを計算
+
+    Args:
+        similarity: 候補のコサイン類似度
+        timestamps: 候補のタイムスタンプ（Unix時間）
+        importance: 候補の重要度（0-10、NULLはNULL_IMPORTANCE）
+        now: 現在時刻（Unix時間）
+        recency_weight: 新しさの重み
+        half_life_days: 新しさの重みが半分になる経過日数
+        importance_weight: 重要度の重み
+
+    Returns:
+        候補と同じ並びのスコア（float32）
+    """
+    scores = np.asarray(similarity, dtype=np.float32).copy()
+    if recency_weight > 0 and half_life_days > 0:
+        # 未来のタイムスタンプは経過0日として扱う
+        age_days = np.maximum(now - np.asarray(timestamps, dtype=np.float64), 0.0)
+        age_days /= SECONDS_PER_DAY
+        scores += recency_weight * np.exp2(-age_days / half_life_days).astype(
+            np.float32
+        )
+    if importance_weight > 0:
+        levels = np.clip(np.asarray(importance), 0, MAX_IMPORTANCE)
+        scores += (importance_weight / MAX_IMPORTANCE) * levels.astype(np.float32)
+    return scores
+
+
+def rerank(
+    rows: np.ndarray,
+    scores: np.ndarray,
+    timestamps: np.ndarray,
+    importance: np.ndarray,
+    now: float,
+    recency_weight: float = DEFAULT_RECENCY_WEIGHT,
+    half_life_days: float = DEFAULT_RECENCY_HALF_LIFE_DAYS,
+    importance_weight: float = DEFAULT_IMPORTANCE_WEIGHT,
+):
+    """
+    候補を重み付けしたスコアの高い順に並べ替え
+
+    Args:
+        rows: 候補の行の位置
+        scores: 候補のコサイン類似度
+        timestamps / importance / now / 各重み: weight_scoresと同じ
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (並べ替えた行の位置, 重み付けしたスコア)
+    """
+    weighted = weight_scores(
+        scores,
+        timestamps,
+        importance,
+        now,
+        recency_weight,
+        half_life_days,
+        importance_weight,
+    )
+    order = np.argsort(-weighted, kind="stable")
+    return rows[order], weighted[order]
@@ -0,0 +1,125 @@
+"""
+ANNインデックス機能のテスト
+"""
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ann_index import build_ann_index, load_ann_index, read_ann_manifest
+from embedding_index import EmbeddingIndex, normalize_rows, search_vectors
+
+
+def clustered_vectors(count, dim=32, clusters=20, seed=0):
+    """クラスタ構造を持つ正規化済みの行列を生成"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    labels = rng.integers(0, clusters, count)
+    noise = rng.standard_normal((count, dim), dtype=np.float32) * 0.3
+    return normalize_rows(centers[labels] + noise)
+
+
+def make_index(vectors, ids=None, generation=1):
+    """テスト用の埋め込みインデックス"""
+    if ids is None:
+        ids = np.arange(1, len(vectors) + 1, dtype=np.int64)
+    manifest = {"count": len(vectors), "generation": generation}
+    return EmbeddingIndex(ids, vectors, None, manifest)
+
+
+class TestANNIndex(unittest.TestCase):
+    """ANNインデックスの作成・検索・増分更新のテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.index_dir = tempfile.mkdtemp()
+        # 同じクラスタから生成した末尾の50件をクエリとする
+        vectors = clustered_vectors(2050)
+        self.vectors, self.queries = vectors[:2000], vectors[2000:]
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        shutil.rmtree(self.index_dir)
+
+    def test_search_recall(self):
+        """近似検索の再現率と、全リストを調べた場合の厳密検索との一致のテスト"""
+        index = make_index(self.vectors)
+        build_ann_index(index, self.index_dir, nlist=20)
+        ann = load_ann_index(self.index_dir, index.manifest)
+        self.assertIsNotNone(ann)
+        self.assertEqual(ann.nlist, 20)
+
+        hits = 0
+        for query in self.queries:
+            exact, exact_scores = search_vectors(self.vectors, query, 10)
+            found, _ = ann.search(self.vectors, query, 10, nprobe=4)
+            hits += len(set(exact) & set(found))
+
+            found, scores = ann.search(self.vectors, query, 10, nprobe=ann.nlist)
+            self.assertEqual(list(found), list(exact))
+            np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+        self.assertGreaterEqual(hits / (len(self.queries) * 10), 0.9)
+
+    def test_incremental_build(self):
+        """前回の重心・所属リストを再利用した増分更新のテスト"""
+        index = make_index(self.vectors[:1500])
+        first = build_ann_index(index, self.index_dir, nlist=20)
+        self.assertEqual(first["assigned"], 1500)
+
+        # 新しい500件を追加し、既存の1件のベクトルを変更
+        vectors = self.vectors.copy()
+        vectors[0] = self.vectors[1999]
+        index = make_index(vectors, generation=2)
+        second = build_ann_index(index, self.index_dir)
+        self.assertEqual(second["assigned"], 501)
+        self.assertEqual(second["nlist"], 20)
+        self.assertEqual(second["trained_count"], 1500)
+
+        ann = load_ann_index(self.index_dir, index.manifest)
+        found, _ = ann.search(vectors, vectors[0], 1, nprobe=1)
+        self.assertIn(found[0], (0, 1999))
+
+        # 件数が学習時の2倍を超えると重心を学習し直す
+        vectors = clustered_vectors(3100, seed=2)
+        third = build_ann_index(make_index(vectors, generation=3), self.index_dir)
+        self.assertEqual(third["assigned"], 3100)
+        self.assertEqual(third["trained_count"], 3100)
+
+    def test_search_with_rows(self):
+        """絞り込み条件に一致する行だけが返るかのテスト"""
+        index = make_index(self.vectors)
+        build_ann_index(index, self.index_dir, nlist=16)
+        ann = load_ann_index(self.index_dir, index.manifest)
+
+        # 少ない行は全て計算し、多い行は調べたリストのうち一致する行を計算する
+        for step in (20, 2):
+            rows = np.arange(0, len(self.vectors), step)
+            for query in self.queries[:10]:
+                found, scores = ann.search(self.vectors, query, 5, nprobe=4, rows=rows)
+                self.assertEqual(len(found), 5)
+                self.assertTrue(set(found) <= set(rows))
+                np.testing.assert_allclose(
+                    scores, self.vectors[found] @ query, rtol=1e-5
+                )
+                if step == 20:
+                    exact, _ = search_vectors(self.vectors, query, 5, rows=rows)
+                    self.assertEqual(list(found), list(exact))
+
+    def test_stale_index_not_loaded(self):
+        """埋め込みインデックスと対応していないANNインデックスは読み込まないかのテスト"""
+        index = make_index(self.vectors)
+        build_ann_index(index, self.index_dir, nlist=10)
+        self.assertEqual(read_ann_manifest(self.index_dir)["index_generation"], 1)
+
+        self.assertIsNone(
+            load_ann_index(
+                self.index_dir, {"count": len(self.vectors), "generation": 2}
+            )
+        )
+        self.assertIsNone(load_ann_index(self.index_dir, {"count": 1, "generation": 1}))
+
+
+if __name__ == "__main__":
+    unittest.main()
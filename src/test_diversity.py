@@ -0,0 +1,84 @@
+"""
+検索結果の多様化機能のテスト
+"""
+
+import os
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from diversity import (
+    get_diversity_lambda,
+    get_duplicate_threshold,
+    is_diversity_enabled,
+    mmr_select,
+)
+from embedding_index import normalize_rows
+
+
+class TestMMRSelect(unittest.TestCase):
+    """mmr_selectのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        # 0と1はほぼ同じメッセージ、2は少し似たメッセージ、3は別の話題
+        self.vectors = normalize_rows(
+            np.array(
+                [
+                    [1.0, 0.0, 0.0],
+                    [1.0, 0.01, 0.0],
+                    [0.8, 0.6, 0.0],
+                    [0.0, 0.0, 1.0],
+                ]
+            )
+        )
+        self.relevance = np.array([0.9, 0.89, 0.8, 0.5])
+
+    def test_relevance_order(self):
+        """関連度の重み1で除かない場合は関連度の順のままかのテスト"""
+        chosen = mmr_select(self.vectors, self.relevance, 4, 1.0, 1.1)
+        self.assertEqual(list(chosen), [0, 1, 2, 3])
+
+    def test_duplicates_removed(self):
+        """ほぼ同じメッセージが除かれるかのテスト"""
+        chosen = mmr_select(self.vectors, self.relevance, 4, 1.0, 0.95)
+        self.assertEqual(list(chosen), [0, 2, 3])
+
+    def test_diversity(self):
+        """関連度の重みが小さいほど別の話題が優先されるかのテスト"""
+        chosen = mmr_select(self.vectors, self.relevance, 2, 0.5, 1.1)
+        self.assertEqual(list(chosen), [0, 3])
+
+        chosen = mmr_select(self.vectors, self.relevance, 2, 0.8, 1.1)
+        self.assertEqual(list(chosen), [0, 1])
+
+    def test_missing_vectors(self):
+        """埋め込みのない候補（0の行）は他の候補と類似しないものとして扱うかのテスト"""
+        vectors = np.vstack([self.vectors[:2], np.zeros((1, 3))])
+        chosen = mmr_select(vectors, [3.0, 2.0, 1.0], 3, 1.0, 0.95)
+        self.assertEqual(list(chosen), [0, 2])
+
+    def test_empty(self):
+        """候補がない場合や0件の場合のテスト"""
+        self.assertEqual(list(mmr_select(np.empty((0, 3)), [], 5)), [])
+        self.assertEqual(list(mmr_select(self.vectors, self.relevance, 0)), [])
+
+    def test_settings(self):
+        """環境変数の読み込みのテスト"""
+        env = {"DIVERSITY_LAMBDA": "1.5", "DUPLICATE_THRESHOLD": "2"}
+        with patch.dict(os.environ, env):
+            self.assertEqual(get_diversity_lambda(), 1.0)
+            self.assertFalse(
+                is_diversity_enabled(get_diversity_lambda(), get_duplicate_threshold())
+            )
+        with patch.dict(
+            os.environ, {"DIVERSITY_LAMBDA": "", "DUPLICATE_THRESHOLD": ""}
+        ):
+            self.assertTrue(
+                is_diversity_enabled(get_diversity_lambda(), get_duplicate_threshold())
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
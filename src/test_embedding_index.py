@@ -0,0 +1,289 @@
+"""
+埋め込みインデックス機能のテスト
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+import embedding_index
+from embedding_index import (
+    IndexMetadata,
+    load_embedding_index,
+    normalize_rows,
+    search_vectors,
+    search_vectors_batch,
+    top_k_indices,
+    write_embedding_index,
+)
+from knowledge_db import KnowledgeDB
+
+
+class TestEmbeddingIndex(unittest.TestCase):
+    """埋め込みインデックスの作成・読み込みのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.index_dir = os.path.join(self.temp_dir, "embedding_index")
+        self.db = KnowledgeDB(os.path.join(self.temp_dir, "knowledge.db"))
+
+        messages = [
+            {
+                "id": i,
+                "channel_id": 111,
+                "channel_name": "general",
+                "author_id": 222,
+                "author_name": "TestUser",
+                "content": f"メッセージ {i} 🚀",
+                "created_at": "2024-01-01T00:00:00",
+                "timestamp": float(i),
+            }
+            for i in range(1, 6)
+        ]
+        self.db.insert_messages_batch(messages)
+        self.matrix = np.arange(1, 16, dtype=np.float32).reshape(5, 3)
+        self.db.insert_embeddings_batch([1, 2, 3, 4, 5], self.matrix)
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+
+    def load_fresh_index(self):
+        """DBの現在の状態と一致するインデックスを読み込む"""
+        return load_embedding_index(
+            self.index_dir,
+            self.db.get_embedding_count(),
+            self.db.get_embedding_generation(),
+        )
+
+    def test_write_and_load(self):
+        """作成したインデックスをメモリマップで読み込めるかのテスト"""
+        count = write_embedding_index(self.db, self.index_dir)
+        self.assertEqual(count, 5)
+
+        index = self.load_fresh_index()
+        self.assertIsNotNone(index)
+        self.assertEqual(len(index), 5)
+        self.assertIsInstance(index.vectors, np.memmap)
+
+        # 行の並びは新しい順で、IDと本文が揃っている
+        self.assertEqual(list(index.ids), [5, 4, 3, 2, 1])
+        self.assertEqual(index.texts[0], "メッセージ 5 🚀")
+        self.assertEqual(index.texts[-1], "メッセージ 1 🚀")
+        self.assertEqual(list(index.texts)[1:3], ["メッセージ 4 🚀", "メッセージ 3 🚀"])
+
+        # ベクトルは正規化済み
+        expected = self.matrix[::-1] / np.linalg.norm(
+            self.matrix[::-1], axis=1, keepdims=True
+        )
+        np.testing.assert_allclose(index.vectors, expected, rtol=1e-6)
+
+    def test_stale_index_is_not_loaded(self):
+        """DBの埋め込みが更新された場合に古いインデックスを読み込まないかのテスト"""
+        write_embedding_index(self.db, self.index_dir)
+
+        self.db.insert_messages_batch(
+            [
+                {
+                    "id": 6,
+                    "channel_id": 111,
+                    "channel_name": "general",
+                    "author_id": 222,
+                    "author_name": "TestUser",
+                    "content": "追加メッセージ",
+                    "created_at": "2024-01-01T00:00:00",
+                    "timestamp": 6.0,
+                }
+            ]
+        )
+        self.db.insert_embedding(6, [1.0, 0.0, 0.0])
+        self.assertIsNone(self.load_fresh_index())
+
+        # 作り直すと読み込める
+        write_embedding_index(self.db, self.index_dir)
+        index = self.load_fresh_index()
+        self.assertEqual(len(index), 6)
+        self.assertEqual(index.texts[0], "追加メッセージ")
+
+    def test_missing_index(self):
+        """インデックスが存在しない場合のテスト"""
+        self.assertIsNone(self.load_fresh_index())
+
+        # 埋め込みが1件もない場合はインデックスを作成しない
+        empty_index_dir = os.path.join(self.temp_dir, "empty_index")
+        with KnowledgeDB(os.path.join(self.temp_dir, "empty.db")) as empty_db:
+            self.assertEqual(write_embedding_index(empty_db, empty_index_dir), 0)
+        self.assertIsNone(load_embedding_index(empty_index_dir))
+
+    def test_embedding_without_message_is_skipped(self):
+        """メッセージのない埋め込みを除外して件数を切り詰めるかのテスト"""
+        self.db.insert_embedding(999, [1.0, 1.0, 1.0])
+
+        count = write_embedding_index(self.db, self.index_dir)
+        self.assertEqual(count, 5)
+
+        index = self.load_fresh_index()
+        self.assertIsNotNone(index)
+        self.assertEqual(index.vectors.shape, (5, 3))
+        self.assertEqual(len(index.texts), 5)
+
+    def test_index_search(self):
+        """インデックスの検索がコサイン類似度の高い順に返すかのテスト"""
+        write_embedding_index(self.db, self.index_dir)
+        index = self.load_fresh_index()
+
+        query = np.array([1.0, 2.0, 3.0], dtype=np.float32)
+        indices, scores = index.search(query, top_k=2)
+
+        matrix = self.matrix[::-1]
+        expected = (matrix @ query) / (
+            np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+        )
+        self.assertEqual(list(indices), list(np.argsort(-expected)[:2]))
+        np.testing.assert_allclose(scores, np.sort(expected)[::-1][:2], rtol=1e-6)
+        self.assertEqual(index.texts[indices[0]], "メッセージ 1 🚀")
+
+
+class TestIndexMetadata(unittest.TestCase):
+    """メタデータによる絞り込みのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.index_dir = os.path.join(self.temp_dir, "embedding_index")
+        self.db = KnowledgeDB(os.path.join(self.temp_dir, "knowledge.db"))
+
+        categories = [None, "質問", "告知"]
+        self.messages = [
+            {
+                "id": i,
+                "channel_id": 100 + i % 3,
+                "channel_name": f"channel-{i % 3}",
+                "author_id": 222,
+                "author_name": "TestUser",
+                "content": f"メッセージ {i}",
+                "created_at": "2024-01-01T00:00:00",
+                "timestamp": float(i),
+                "category": categories[i % 4 % 3],
+                "importance": i % 5,
+            }
+            for i in range(1, 41)
+        ]
+        self.db.insert_messages_batch(self.messages)
+        rng = np.random.default_rng(0)
+        self.db.insert_embeddings_batch(
+            list(range(1, 41)), rng.standard_normal((40, 8), dtype=np.float32)
+        )
+        write_embedding_index(self.db, self.index_dir)
+        self.index = load_embedding_index(self.index_dir)
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+
+    def expected_ids(self, filters):
+        """絞り込み条件に一致するメッセージID（DBでの絞り込み結果）"""
+        return {
+            message_id
+            for message_id, _ in self.db.search_text(
+                "メッセージ", limit=100, filters=filters
+            )
+        }
+
+    def test_select_rows(self):
+        """インデックスとDBで絞り込みの結果が一致するかのテスト"""
+        metadata = IndexMetadata.from_rows(
+            [row[3] for row in self.db.iter_embeddings(with_metadata=True)]
+        )
+        cases = [
+            {"channel_id": 101},
+            {"category": "質問"},
+            {"category": "未使用"},
+            {"min_importance": 3},
+            {"since": 10.0, "until": 20.0},
+            {"channel_id": 102, "category": "告知", "min_importance": 1},
+            {"channel_id": 999},
+        ]
+        for filters in cases:
+            expected = self.expected_ids(filters)
+            for target in (self.index.metadata, metadata):
+                rows = target.select_rows(filters)
+                self.assertEqual(list(rows), sorted(rows))
+                self.assertEqual({int(self.index.ids[i]) for i in rows}, expected)
+
+        self.assertIsNone(self.index.metadata.select_rows(None))
+        self.assertIsNone(self.index.metadata.select_rows({"channel_id": None}))
+        with self.assertRaises(ValueError):
+            self.index.metadata.select_rows({"author_id": 222})
+
+    def test_search_with_rows(self):
+        """絞り込んだ行だけが検索されるかのテスト"""
+        rows = self.index.metadata.select_rows({"channel_id": 100})
+        query = np.ones(8, dtype=np.float32)
+        found, scores = self.index.search(query, top_k=5, rows=rows)
+
+        self.assertTrue(set(found) <= set(rows))
+        expected, expected_scores = search_vectors(
+            np.asarray(self.index.vectors[rows]), query, 5
+        )
+        self.assertEqual(list(found), list(rows[expected]))
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+
+
+class TestSearchVectors(unittest.TestCase):
+    """正規化済み行列の検索のテスト"""
+
+    def test_matches_full_sort(self):
+        """全件ソートと同じ順序で上位k件を返すかのテスト"""
+        rng = np.random.default_rng(0)
+        vectors = normalize_rows(rng.standard_normal((500, 16)))
+        query = rng.standard_normal(16) * 10
+
+        for top_k in (1, 5, 500):
+            indices, scores = search_vectors(vectors, query, top_k)
+            expected = np.argsort(-(vectors @ normalize_rows(query[None])[0]))[:top_k]
+            self.assertEqual(list(indices), list(expected))
+            self.assertTrue(np.all(np.diff(scores) <= 0))
+            self.assertLessEqual(scores[0], 1.0 + 1e-6)
+
+    def test_batch_matches_single(self):
+        """複数クエリをまとめた検索が1クエリずつの検索と一致するかのテスト"""
+        rng = np.random.default_rng(1)
+        vectors = normalize_rows(rng.standard_normal((500, 16)))
+        queries = rng.standard_normal((7, 16))
+        rows = np.sort(rng.choice(500, 120, replace=False))
+
+        # 複数の区切りにまたがる上位の統合を確認するため、区切りを小さくする
+        with patch.object(embedding_index, "BATCH_CHUNK_ROWS", 64):
+            for top_k, selected in ((5, None), (500, None), (10, rows), (200, rows)):
+                found, scores = search_vectors_batch(
+                    vectors, queries, top_k, rows=selected
+                )
+                self.assertEqual(found.shape, scores.shape)
+                for query, query_found, query_scores in zip(queries, found, scores):
+                    expected, expected_scores = search_vectors(
+                        vectors, query, top_k, rows=selected
+                    )
+                    self.assertEqual(list(query_found), list(expected))
+                    np.testing.assert_allclose(query_scores, expected_scores, atol=1e-6)
+
+        found, scores = search_vectors_batch(vectors, queries, 0)
+        self.assertEqual(found.shape, (7, 0))
+
+    def test_top_k_indices_bounds(self):
+        """件数を超えるtop_kや0件の場合のテスト"""
+        scores = np.array([0.1, 0.9, 0.5], dtype=np.float32)
+        self.assertEqual(list(top_k_indices(scores, 10)), [1, 2, 0])
+        self.assertEqual(list(top_k_indices(scores, 0)), [])
+        self.assertEqual(list(top_k_indices(np.empty(0), 3)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
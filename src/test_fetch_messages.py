@@ -0,0 +1,336 @@
+"""
+メッセージ取得機能のテスト
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from fake_discord import (
+    FakeAuthor,
+    FakeChannel,
+    FakeClient,
+    FakeMessage,
+    FakeRateLimit,
+    build_guild,
+    load_fixture,
+    save_fixture,
+)
+from fetch_messages import (
+    FetchStats,
+    backfill_channel_windows,
+    fetch_messages_from_guild,
+    plan_windows,
+)
+from knowledge_db import KnowledgeDB
+
+
+class TestPlanWindows(unittest.TestCase):
+    """チャンネル内の範囲分割のテスト"""
+
+    def test_uniform_density(self):
+        """密度が一様な場合に等分されるかのテスト"""
+        bounds = plan_windows(0, 1000, [1.0] * 4, max_windows=4, min_window_messages=10)
+        self.assertEqual(bounds, [0, 250, 500, 750, 1000])
+
+    def test_skewed_density(self):
+        """密度の高い区間ほど細かく分割されるかのテスト"""
+        bounds = plan_windows(
+            0, 100, [0, 0, 1, 1], max_windows=4, min_window_messages=10
+        )
+        self.assertEqual(bounds[0], 0)
+        self.assertEqual(bounds[-1], 100)
+        self.assertEqual(len(bounds), 5)
+        # メッセージのない前半は1つの範囲にまとまる
+        self.assertGreaterEqual(bounds[1], 50)
+
+    def test_small_channel_is_not_split(self):
+        """推定件数が少ない場合は分割しないかのテスト"""
+        bounds = plan_windows(
+            0, 100, [1.0] * 4, max_windows=4, min_window_messages=1000
+        )
+        self.assertEqual(bounds, [0, 100])
+
+    def test_max_windows(self):
+        """範囲数が上限を超えないかのテスト"""
+        bounds = plan_windows(0, 10000, [1.0] * 8, max_windows=3, min_window_messages=1)
+        self.assertEqual(len(bounds), 4)
+        self.assertEqual(bounds, sorted(set(bounds)))
+
+    def test_empty_range(self):
+        """範囲が空の場合のテスト"""
+        self.assertEqual(plan_windows(10, 10, [1.0], 4, 1), [10, 10])
+        self.assertEqual(plan_windows(0, 100, [], 4, 1), [0, 100])
+
+
+def human_message_count(guild):
+    """取得対象（Bot以外）のメッセージ数"""
+    return sum(
+        1
+        for channel in guild.text_channels
+        for message in channel.messages
+        if not message.author.bot
+    )
+
+
+class TestFetchMessagesFromGuild(unittest.TestCase):
+    """擬似ギルドを使ったメッセージ取得のテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db = KnowledgeDB(os.path.join(self.temp_dir.name, "knowledge.db"))
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        self.db.close()
+        self.temp_dir.cleanup()
+
+    def fetch(self, guild, **kwargs):
+        """進捗表示を抑えてfetch_messages_from_guildを実行"""
+        with contextlib.redirect_stdout(io.StringIO()):
+            return asyncio.run(
+                fetch_messages_from_guild(
+                    FakeClient(guild), guild.id, db=self.db, **kwargs
+                )
+            )
+
+    def test_full_fetch(self):
+        """全履歴の取得・取得済み位置の記録のテスト"""
+        guild = build_guild(3, 250)
+        stats = self.fetch(guild, concurrency=2)
+
+        self.assertEqual(stats.saved, human_message_count(guild))
+        self.assertEqual(self.db.get_message_count(), human_message_count(guild))
+        self.assertEqual(self.db.get_crawl_checkpoints(), {})
+
+        sync_states = self.db.get_channel_sync_states()
+        for channel in guild.text_channels:
+            self.assertEqual(
+                sync_states[channel.id]["last_message_id"], channel.messages[-1].id
+            )
+
+    def test_unknown_guild(self):
+        """ギルドが見つからない場合のテスト"""
+        guild = build_guild(1, 10)
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = asyncio.run(
+                fetch_messages_from_guild(FakeClient(guild), 999, db=self.db)
+            )
+        self.assertIsNone(stats)
+
+    def test_incremental_fetch(self):
+        """2回目以降は新しいメッセージのみ取得するかのテスト"""
+        guild = build_guild(2, 200)
+        self.fetch(guild)
+
+        channel = guild.text_channels[0]
+        last = channel.messages[-1]
+        for i in range(1, 6):
+            channel.messages.append(
+                FakeMessage(
+                    last.id + i,
+                    FakeAuthor(1),
+                    f"新しいメッセージ {i}",
+                    last.created_at + timedelta(seconds=i),
+                )
+            )
+
+        channel.requests = 0
+        stats = self.fetch(guild)
+        self.assertEqual(stats.fetched, 5)
+        self.assertEqual(stats.saved, 5)
+        self.assertEqual(self.db.get_message_count(), human_message_count(guild))
+        self.assertEqual(
+            self.db.get_channel_sync_states()[channel.id]["last_message_id"],
+            last.id + 5,
+        )
+
+    def test_excluded_channels(self):
+        """除外チャンネルを取得しないかのテスト"""
+        guild = build_guild(2, 100)
+        self.fetch(guild, excluded_channels=["channel-1"])
+
+        self.assertEqual(guild.text_channels[1].requests, 0)
+        self.assertNotIn(guild.text_channels[1].id, self.db.get_channel_sync_states())
+
+    def test_deadline_and_resume(self):
+        """取得時間の上限で中断し、次回続きから取得するかのテスト"""
+        guild = build_guild(2, 2000, page_latency=0.01)
+        stats = self.fetch(guild, batch_size=100, deadline=time.monotonic() + 0.05)
+
+        self.assertGreater(stats.interrupted, 0)
+        self.assertLess(self.db.get_message_count(), human_message_count(guild))
+        self.assertTrue(self.db.get_crawl_checkpoints())
+
+        stats = self.fetch(guild, batch_size=100)
+        self.assertEqual(stats.interrupted, 0)
+        self.assertEqual(self.db.get_message_count(), human_message_count(guild))
+        self.assertEqual(self.db.get_crawl_checkpoints(), {})
+
+    def test_windowed_backfill(self):
+        """範囲に分割した全履歴の取得で取りこぼしがないかのテスト"""
+        guild = build_guild(1, 3000)
+        with mock.patch("fetch_messages.MIN_WINDOW_MESSAGES", 100):
+            stats = self.fetch(guild, windows=4)
+
+        self.assertEqual(stats.saved, human_message_count(guild))
+        self.assertEqual(self.db.get_message_count(), human_message_count(guild))
+        self.assertEqual(self.db.get_crawl_checkpoints(), {})
+
+    def test_saved_queue(self):
+        """保存済みのバッチが後段のキューに渡されるかのテスト"""
+        guild = build_guild(2, 300)
+
+        async def run():
+            queue = asyncio.Queue()
+            stats = await fetch_messages_from_guild(
+                FakeClient(guild), guild.id, db=self.db, saved_queue=queue
+            )
+            batches = []
+            while not queue.empty():
+                batches.append(queue.get_nowait())
+            return stats, batches
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats, batches = asyncio.run(run())
+        self.assertEqual(sum(len(batch) for batch in batches), stats.saved)
+
+
+class FailingOldestWindowChannel(FakeChannel):
+    """最も古い範囲（下限なし）の取得だけが失敗する擬似チャンネル"""
+
+    async def history(self, limit=None, before=None, after=None, oldest_first=None):
+        if after is None:
+            await asyncio.sleep(self.page_latency)
+            raise RuntimeError("取得に失敗しました")
+        async for message in super().history(limit, before, after, oldest_first):
+            yield message
+
+
+class TestFetchFailures(unittest.TestCase):
+    """取得・書き込みが失敗した場合に実行中のタスクが残らないかのテスト"""
+
+    def test_failed_window_cancels_others(self):
+        """1つの範囲が失敗した場合に残りの範囲の取得が中止されるかのテスト"""
+        messages = build_guild(1, 2000).text_channels[0].messages
+        channel = FailingOldestWindowChannel(
+            1, "channel-0", messages, page_latency=0.01
+        )
+        middle = messages[len(messages) // 2].id
+        checkpoints = [
+            {
+                "range_start": start,
+                "range_end": end,
+                "cursor": None,
+                "complete": False,
+                "last_message_id": messages[-1].id,
+                "last_timestamp": 0.0,
+            }
+            for start, end in ((middle, messages[-1].id + 1), (0, middle))
+        ]
+
+        async def run():
+            queue = asyncio.Queue()
+            with self.assertRaises(RuntimeError):
+                await backfill_channel_windows(
+                    channel, queue, FetchStats(), checkpoints, batch_size=50
+                )
+            requests = channel.requests
+            await asyncio.sleep(0.05)
+            self.assertEqual(channel.requests, requests, "残りの範囲の取得が続いている")
+            self.assertEqual(asyncio.all_tasks(), {asyncio.current_task()})
+
+        asyncio.run(run())
+
+    def test_failed_writer_stops_crawler(self):
+        """書き込みが失敗した場合に取得・書き込みのタスクが終了しているかのテスト"""
+        guild = build_guild(2, 2000, page_latency=0.01)
+
+        async def run():
+            with mock.patch(
+                "fetch_messages.save_batch", side_effect=OSError("書き込みに失敗しました")
+            ):
+                with self.assertRaises(OSError):
+                    await fetch_messages_from_guild(
+                        FakeClient(guild), guild.id, db=self.db, batch_size=50
+                    )
+            self.assertEqual(asyncio.all_tasks(), {asyncio.current_task()})
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.db = KnowledgeDB(os.path.join(temp_dir, "knowledge.db"))
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    asyncio.run(run())
+            finally:
+                self.db.close()
+
+
+class TestFakeDiscord(unittest.TestCase):
+    """擬似Discordクライアントのテスト"""
+
+    def test_fixture_round_trip(self):
+        """フィクスチャの保存・読み込みで履歴が変わらないかのテスト"""
+        guild = build_guild(2, 50)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "fixture.json")
+            save_fixture(guild, path)
+            loaded = load_fixture(path)
+
+        self.assertEqual(loaded.id, guild.id)
+        for original, channel in zip(guild.text_channels, loaded.text_channels):
+            self.assertEqual(channel.id, original.id)
+            self.assertEqual(channel.name, original.name)
+            self.assertEqual(
+                [
+                    (m.id, m.content, m.author.bot, m.created_at)
+                    for m in channel.messages
+                ],
+                [
+                    (m.id, m.content, m.author.bot, m.created_at)
+                    for m in original.messages
+                ],
+            )
+
+    def test_history_order(self):
+        """historyの順序・範囲指定がdiscord.pyと一致するかのテスト"""
+        guild = build_guild(1, 250)
+        channel = guild.text_channels[0]
+        ids = [m.id for m in channel.messages]
+
+        async def collect(**kwargs):
+            return [m.id async for m in channel.history(**kwargs)]
+
+        self.assertEqual(asyncio.run(collect()), ids[::-1])
+        self.assertEqual(asyncio.run(collect(limit=10)), ids[::-1][:10])
+        self.assertEqual(asyncio.run(collect(after=channel.messages[99])), ids[100:])
+        self.assertEqual(
+            asyncio.run(collect(before=channel.messages[10])), ids[:10][::-1]
+        )
+        self.assertEqual(channel.requests, 3 + 1 + 2 + 1)
+
+    def test_rate_limit(self):
+        """擬似レート制限で上限を超えたリクエストが待機するかのテスト"""
+        guild = build_guild(1, 500, rate_limit=FakeRateLimit(2, 0.05))
+        channel = guild.text_channels[0]
+
+        async def collect():
+            return [m async for m in channel.history()]
+
+        began = time.monotonic()
+        messages = asyncio.run(collect())
+        elapsed = time.monotonic() - began
+
+        self.assertEqual(len(messages), 500)
+        self.assertEqual(channel.rate_limit.hits, 2)
+        self.assertGreaterEqual(elapsed, 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
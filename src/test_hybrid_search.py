@@ -0,0 +1,246 @@
+"""
+ハイブリッド検索機能のテスト
+"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+import ai_chatbot
+from embedding_index import EmbeddingIndex, IndexMetadata, normalize_rows
+from hybrid_search import SearchTimings, reciprocal_rank_fusion
+from knowledge_db import KnowledgeDB
+from live_index import IndexSnapshot
+
+
+class FixedEncoder:
+    """常に同じ埋め込みを返すテスト用のモデル"""
+
+    def __init__(self, vector):
+        self.vector = np.asarray(vector, dtype=np.float32)
+
+    def encode(self, text):
+        if isinstance(text, str):
+            return self.vector
+        return np.tile(self.vector, (len(text), 1))
+
+
+class BatchFixedEncoder:
+    """質問ごとに決まった埋め込みを返すテスト用のモデル"""
+
+    VECTORS = {"デプロイ": [1.0, 0.0], "リリース": [0.8, 0.6]}
+
+    def encode(self, texts):
+        return np.array([self.VECTORS[text] for text in texts], dtype=np.float32)
+
+
+class TestReciprocalRankFusion(unittest.TestCase):
+    """RRFによる順位の統合のテスト"""
+
+    def test_fusion(self):
+        """両方の検索で上位の結果が優先されるかのテスト"""
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]], [1.0, 1.0], k=60)
+        self.assertEqual([key for key, _ in fused], ["c", "a", "b", "d"])
+        self.assertAlmostEqual(fused[0][1], 1 / 63 + 1 / 61)
+
+    def test_weights(self):
+        """重みの大きい検索が優先され、重み0の検索は無視されるかのテスト"""
+        rankings = [["a", "b"], ["b", "c"]]
+        fused = reciprocal_rank_fusion(rankings, [1.0, 3.0], k=1)
+        self.assertEqual([key for key, _ in fused], ["b", "c", "a"])
+
+        fused = reciprocal_rank_fusion(rankings, [1.0, 0.0])
+        self.assertEqual([key for key, _ in fused], ["a", "b"])
+        self.assertEqual(reciprocal_rank_fusion([[], []], [1.0, 1.0]), [])
+
+    def test_timings(self):
+        """段階ごとの所要時間の記録のテスト"""
+        timings = SearchTimings()
+        with timings.measure("vector"):
+            pass
+        timings.finish()
+        self.assertIn("vector", timings.stages)
+        self.assertIn("ベクトル", timings.summary())
+        self.assertNotIn("キーワード", timings.summary())
+
+        timings.note("キーワード検索なし")
+        self.assertTrue(timings.summary().endswith("※キーワード検索なし"))
+
+
+class TestSearchSimilarMessage(unittest.TestCase):
+    """ai_chatbot.search_similar_messageのハイブリッド検索のテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db = KnowledgeDB(os.path.join(self.temp_dir.name, "knowledge.db"))
+        contents = {
+            1: "デプロイの手順はwikiにあります",
+            2: "本番環境へのリリース方法",
+            3: "ビルドでModuleNotFoundErrorが発生しました",
+        }
+        self.db.insert_messages_batch(
+            [
+                {
+                    "id": message_id,
+                    "channel_id": 111,
+                    "channel_name": "general",
+                    "author_id": 222,
+                    "author_name": "TestUser",
+                    "content": content,
+                    "created_at": "2024-01-01T00:00:00",
+                    "timestamp": float(message_id),
+                }
+                for message_id, content in contents.items()
+            ]
+        )
+        # メッセージ3は埋め込みが未生成（キーワード検索のみで見つかる）
+        vectors = normalize_rows(np.array([[1.0, 0.0], [0.8, 0.6]]))
+        metadata = IndexMetadata.from_rows([(111, None, 0, 1.0), (111, None, 0, 2.0)])
+        index = EmbeddingIndex(
+            np.array([1, 2]), vectors, [contents[1], contents[2]], {}, metadata
+        )
+        self.patcher = patch.multiple(
+            ai_chatbot,
+            _initialized=True,
+            _model=FixedEncoder([1.0, 0.0]),
+            _db=self.db,
+            _snapshot=IndexSnapshot(index),
+        )
+        self.patcher.start()
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        self.patcher.stop()
+        self.db.close()
+        self.temp_dir.cleanup()
+
+    def test_hybrid_search(self):
+        """キーワード検索のみで見つかったメッセージも結果に含まれるかのテスト"""
+        results = ai_chatbot.search_similar_message("ModuleNotFoundError", top_k=3)
+        # ベクトル検索の1位とキーワード検索の1位が同点で上位になる
+        self.assertEqual(
+            results,
+            [
+                "デプロイの手順はwikiにあります",
+                "ビルドでModuleNotFoundErrorが発生しました",
+                "本番環境へのリリース方法",
+            ],
+        )
+
+    def test_vector_only(self):
+        """キーワード検索の重みが0の場合はベクトル検索のみのテスト"""
+        with patch.dict(os.environ, {"HYBRID_LEXICAL_WEIGHT": "0"}):
+            results = ai_chatbot.search_similar_message("ModuleNotFoundError", top_k=3)
+        self.assertEqual(results, ["デプロイの手順はwikiにあります", "本番環境へのリリース方法"])
+
+    def test_lexical_timeout(self):
+        """キーワード検索が遅れた場合はベクトル検索のみの結果を返すかのテスト"""
+        release = threading.Event()
+
+        def slow_lexical(*args):
+            release.wait(5)
+            return [3]
+
+        env = {"HYBRID_LEXICAL_TIMEOUT": "0.05"}
+        try:
+            with patch.dict(os.environ, env), patch.object(
+                ai_chatbot, "_search_lexical", slow_lexical
+            ), patch("builtins.print") as log:
+                began = time.perf_counter()
+                results = ai_chatbot.search_similar_message(
+                    "ModuleNotFoundError", top_k=3
+                )
+                elapsed = time.perf_counter() - began
+        finally:
+            release.set()
+
+        self.assertEqual(results, ["デプロイの手順はwikiにあります", "本番環境へのリリース方法"])
+        self.assertLess(elapsed, 2.0)
+        self.assertIn("タイムアウト", log.call_args[0][0])
+
+    def test_filters(self):
+        """絞り込み条件がベクトル検索とキーワード検索の両方に適用されるかのテスト"""
+        results = ai_chatbot.search_similar_message(
+            "ModuleNotFoundError", top_k=3, filters={"since": 2.0}
+        )
+        self.assertEqual(
+            results,
+            ["本番環境へのリリース方法", "ビルドでModuleNotFoundErrorが発生しました"],
+        )
+
+        results = ai_chatbot.search_similar_message(
+            "ModuleNotFoundError", top_k=3, filters={"channel_id": 999}
+        )
+        self.assertEqual(results, [])
+
+    def test_duplicates_removed(self):
+        """ほぼ同じとみなすメッセージが結果から除かれるかのテスト"""
+        env = {"DIVERSITY_LAMBDA": "1", "DUPLICATE_THRESHOLD": "0.7"}
+        with patch.dict(os.environ, dict(env, HYBRID_LEXICAL_WEIGHT="0")):
+            results = ai_chatbot.search_similar_message("リリース", top_k=3)
+        self.assertEqual(results, ["デプロイの手順はwikiにあります"])
+
+        # 埋め込みのないメッセージ（キーワード検索のみ）は除かれない
+        with patch.dict(os.environ, env):
+            results = ai_chatbot.search_similar_message("ModuleNotFoundError", top_k=3)
+        self.assertEqual(
+            results,
+            [
+                "デプロイの手順はwikiにあります",
+                "ビルドでModuleNotFoundErrorが発生しました",
+            ],
+        )
+
+    def test_recency_and_importance(self):
+        """新しさと重要度の重みで順位が変わるかのテスト"""
+        env = {"HYBRID_LEXICAL_WEIGHT": "0", "DIVERSITY_LAMBDA": "1"}
+        metadata = ai_chatbot._snapshot.index.metadata
+
+        with patch.dict(os.environ, dict(env, RECENCY_WEIGHT="0.5")):
+            metadata.timestamps[1] = time.time()
+            results = ai_chatbot.search_similar_message("リリース", top_k=2)
+        self.assertEqual(results[0], "本番環境へのリリース方法")
+
+        metadata.timestamps[1] = 2.0
+        with patch.dict(os.environ, dict(env, IMPORTANCE_WEIGHT="0.5")):
+            metadata.importance[1] = 10
+            results = ai_chatbot.search_similar_message("リリース", top_k=2)
+        self.assertEqual(results[0], "本番環境へのリリース方法")
+
+        with patch.dict(os.environ, dict(env, IMPORTANCE_WEIGHT="0")):
+            results = ai_chatbot.search_similar_message("リリース", top_k=2)
+        self.assertEqual(results[0], "デプロイの手順はwikiにあります")
+
+    def test_search_similar_messages(self):
+        """複数の質問をまとめた検索がベクトル検索の順位と類似度を返すかのテスト"""
+        with patch.object(ai_chatbot, "_model", BatchFixedEncoder()):
+            results = ai_chatbot.search_similar_messages(
+                ["デプロイ", "リリース", "デプロイ"], top_k=2
+            )
+        self.assertEqual(
+            [[i for i, _ in result] for result in results], [[1, 2], [2, 1], [1, 2]]
+        )
+        self.assertAlmostEqual(results[0][0][1], 1.0, places=5)
+        self.assertAlmostEqual(results[1][0][1], 1.0, places=5)
+
+        results = ai_chatbot.search_similar_messages(
+            ["デプロイ"], top_k=3, filters={"since": 2.0}
+        )
+        self.assertEqual([i for i, _ in results[0]], [2])
+        self.assertEqual(ai_chatbot.search_similar_messages([]), [])
+
+    def test_filters_without_metadata(self):
+        """メタデータのない（JSONモードの）インデックスでは絞り込めないかのテスト"""
+        ai_chatbot._snapshot.index.metadata = None
+        with self.assertRaises(ValueError):
+            ai_chatbot.search_similar_message("リリース", filters={"channel_id": 111})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+"""
+エクスポートファイルのインポート機能のテスト
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+from discord.utils import time_snowflake
+
+from import_discord_export import import_exports, iter_export_messages
+from knowledge_db import KnowledgeDB
+
+# 2024-01-01T00:00:00+00:00に投稿されたメッセージのID
+BASE_ID = time_snowflake(datetime(2024, 1, 1, tzinfo=timezone.utc))
+
+
+def export_message(message_id, content, bot=False, message_type="Default"):
+    """DiscordChatExporter形式のメッセージ"""
+    return {
+        "id": str(message_id),
+        "type": message_type,
+        "timestamp": "2024-01-01T09:00:00.000+09:00",
+        "timestampEdited": None,
+        "isPinned": False,
+        "content": content,
+        "author": {
+            "id": "42",
+            "name": "alice" if not bot else "helper-bot",
+            "discriminator": "0000",
+            "nickname": "Alice",
+            "isBot": bot,
+        },
+        "attachments": [],
+        "embeds": [],
+        "reactions": [],
+    }
+
+
+def export_file(messages, channel_id="111", topic=None, date_range=None):
+    """DiscordChatExporter形式のエクスポート"""
+    return {
+        "guild": {"id": "1", "name": "テストサーバー"},
+        "channel": {
+            "id": channel_id,
+            "type": "GuildTextChat",
+            "category": "一般",
+            "name": f"channel-{channel_id}",
+            "topic": topic,
+        },
+        "dateRange": date_range or {"after": None, "before": None},
+        "exportedAt": "2024-06-01T00:00:00+00:00",
+        "messages": messages,
+        "messageCount": len(messages),
+    }
+
+
+class TestImportDiscordExport(unittest.TestCase):
+    """エクスポートファイルのインポートのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db = KnowledgeDB(os.path.join(self.temp_dir.name, "knowledge.db"))
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        self.db.close()
+        self.temp_dir.cleanup()
+
+    def write_export(self, name, export, indent=2):
+        """エクスポートをファイルに書き込んでパスを返す"""
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(export, f, ensure_ascii=False, indent=indent)
+        return path
+
+    def test_iter_export_messages(self):
+        """小さい読み込み単位でもメッセージを1件ずつ読み込めるかのテスト"""
+        messages = [export_message(1000 + i, f"メッセージ {i}") for i in range(50)]
+        # チャンネル情報にmessagesという文字列が含まれていても誤認しない
+        export = export_file(messages, topic='"messages": [] について')
+        path = self.write_export("export.json", export)
+
+        for chunk_size in (7, 64, 1 << 20):
+            results = list(iter_export_messages(path, chunk_size=chunk_size))
+            self.assertEqual([m for _, m in results], messages)
+            self.assertEqual(results[0][0]["channel"]["id"], "111")
+
+        path = self.write_export("compact.json", export, indent=None)
+        self.assertEqual([m for _, m in iter_export_messages(path, 5)], messages)
+
+    def test_iter_export_messages_invalid(self):
+        """エクスポート形式でないファイル・途中で終わっているファイルのテスト"""
+        path = self.write_export("other.json", {"foo": "bar"})
+        with self.assertRaises(ValueError):
+            list(iter_export_messages(path))
+
+        path = os.path.join(self.temp_dir.name, "truncated.json")
+        text = json.dumps(export_file([export_message(1, "a"), export_message(2, "b")]))
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text[: text.index('"2"')])
+        with self.assertRaises(ValueError):
+            list(iter_export_messages(path, chunk_size=16))
+
+    def test_import_exports(self):
+        """フィルタ・変換・取得済み位置の記録のテスト"""
+        messages = [
+            export_message(BASE_ID, "通常のメッセージ"),
+            export_message(BASE_ID + 1, "Botの投稿", bot=True),
+            export_message(BASE_ID + 2, "   "),
+            export_message(
+                BASE_ID + 3,
+                "Alice pinned a message.",
+                message_type="ChannelPinnedMessage",
+            ),
+            export_message(BASE_ID + 4, "返信", message_type="Reply"),
+        ]
+        path = self.write_export("export.json", export_file(messages))
+        other = self.write_export("other.json", {"foo": "bar"})
+
+        stats = import_exports(self.db, [path, other], batch_size=1)
+
+        self.assertEqual(stats.files, 1)
+        self.assertEqual(stats.read, 5)
+        self.assertEqual(stats.kept, 2)
+        self.assertEqual(stats.inserted, 2)
+
+        saved = {m["id"]: m for m in self.db.get_all_messages()}
+        self.assertEqual(set(saved), {BASE_ID, BASE_ID + 4})
+        message = saved[BASE_ID]
+        self.assertEqual(message["channel_id"], 111)
+        self.assertEqual(message["channel_name"], "channel-111")
+        self.assertEqual(message["author_id"], 42)
+        self.assertEqual(message["author_name"], "alice")
+        self.assertEqual(message["created_at"], "2024-01-01T00:00:00+00:00")
+        self.assertEqual(message["timestamp"], 1704067200.0)
+
+        # 除外したメッセージも含めた最新のIDを取得済み位置とする
+        sync_state = self.db.get_channel_sync_states()[111]
+        self.assertEqual(sync_state["last_message_id"], BASE_ID + 4)
+
+        # 再インポートしても重複しない
+        stats = import_exports(self.db, [path])
+        self.assertEqual(stats.inserted, 0)
+        self.assertEqual(self.db.get_message_count(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
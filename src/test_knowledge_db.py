@@ -2,11 +2,15 @@
 知識データベース機能のテスト
 """
 
+import json
 import os
+import sqlite3
 import tempfile
 import unittest
 from datetime import datetime
 
+import numpy as np
+
 from knowledge_db import KnowledgeDB
 
 
@@ -23,8 +27,10 @@ class TestKnowledgeDB(unittest.TestCase):
 
     def tearDown(self):
         """各テスト後のクリーンアップ"""
-        if os.path.exists(self.db_path):
-            os.unlink(self.db_path)
+        self.db.close()
+        for path in (self.db_path, self.db_path + "-wal", self.db_path + "-shm"):
+            if os.path.exists(path):
+                os.unlink(path)
 
     def test_insert_message(self):
         """メッセージの挿入テスト"""
@@ -77,6 +83,47 @@ class TestKnowledgeDB(unittest.TestCase):
         self.assertEqual(inserted, 0)
         self.assertEqual(skipped, 10)
 
+    def test_upsert_messages_batch(self):
+        """既存メッセージの編集・チャンネル名変更を反映するupsertのテスト"""
+        messages = [
+            {
+                "id": i,
+                "channel_id": 111,
+                "channel_name": "general",
+                "author_id": 222,
+                "author_name": "TestUser",
+                "content": f"メッセージ {i}",
+                "created_at": datetime.now().isoformat(),
+                "timestamp": float(i),
+            }
+            for i in range(1, 4)
+        ]
+        self.db.insert_messages_batch(messages)
+        self.db.insert_embedding(1, [0.1, 0.2])
+        self.db.insert_embedding(2, [0.3, 0.4])
+
+        # 1件目を編集、4件目を新規、チャンネル名を変更
+        edited = [
+            dict(messages[0], content="編集後のメッセージ", channel_name="renamed"),
+            dict(messages[1], channel_name="renamed"),
+            dict(messages[0], id=4, content="新規メッセージ", channel_name="renamed"),
+        ]
+        inserted, updated, unchanged = self.db.upsert_messages_batch(edited)
+        self.assertEqual((inserted, updated, unchanged), (1, 2, 0))
+
+        stored = {m["id"]: m for m in self.db.get_all_messages()}
+        self.assertEqual(stored[1]["content"], "編集後のメッセージ")
+        # バッチに含まれないメッセージにもチャンネル名の変更が反映される
+        self.assertEqual({m["channel_name"] for m in stored.values()}, {"renamed"})
+
+        # 本文が変わったメッセージの埋め込みのみ削除される
+        pending = [m["id"] for m in self.db.get_messages_without_embeddings()]
+        self.assertEqual(sorted(pending), [1, 3, 4])
+
+        # 同じ内容での再実行は全て変更なし
+        inserted, updated, unchanged = self.db.upsert_messages_batch(edited)
+        self.assertEqual((inserted, updated, unchanged), (0, 0, 3))
+
     def test_message_metadata(self):
         """メタデータ付きメッセージのテスト"""
         message = {
@@ -209,6 +256,103 @@ class TestKnowledgeDB(unittest.TestCase):
         count = self.db.get_embedding_count()
         self.assertEqual(count, 1)
 
+    def test_insert_embeddings_batch(self):
+        """埋め込みの一括挿入のテスト"""
+        matrix = np.arange(12, dtype=np.float64).reshape(4, 3)
+        self.db.insert_embedding(2, matrix[1])
+
+        # 既存の1件はスキップされ、チャンク境界をまたいでも全件書き込まれる
+        inserted = self.db.insert_embeddings_batch(
+            np.array([1, 2, 3, 4]), matrix, chunk_size=3
+        )
+        self.assertEqual(inserted, 3)
+        self.assertEqual(self.db.get_embedding_count(), 4)
+
+        with sqlite3.connect(self.db_path) as conn:
+            blob, dtype, dim = conn.execute(
+                "SELECT embedding_vector, dtype, dim FROM embeddings "
+                "WHERE message_id = 4"
+            ).fetchone()
+        self.assertEqual((dtype, dim), ("float32", 3))
+        np.testing.assert_array_equal(np.frombuffer(blob, np.float32), matrix[3])
+
+        self.assertEqual(self.db.insert_embeddings_batch([], np.empty((0, 3))), 0)
+        with self.assertRaises(ValueError):
+            self.db.insert_embeddings_batch([5, 6], matrix)
+
+        # 埋め込みが未生成のIDのみ、指定した順序で返す
+        large_id = 1191168914227200000
+        self.assertEqual(
+            self.db.filter_messages_without_embeddings([large_id, 3, 5, 1]),
+            [large_id, 5],
+        )
+        self.assertEqual(self.db.filter_messages_without_embeddings([]), [])
+
+    def test_embedding_generation(self):
+        """埋め込みの追加・削除で世代番号が進むかのテスト"""
+        message = {
+            "id": 1,
+            "channel_id": 111,
+            "channel_name": "general",
+            "author_id": 222,
+            "author_name": "TestUser",
+            "content": "テストメッセージ",
+            "created_at": datetime.now().isoformat(),
+            "timestamp": datetime.now().timestamp(),
+        }
+        self.db.insert_message(message)
+        self.assertEqual(self.db.get_embedding_generation(), 0)
+
+        self.db.insert_embedding(1, [0.1, 0.2])
+        generation = self.db.get_embedding_generation()
+        self.assertGreater(generation, 0)
+
+        # 既存のためスキップされた場合は変わらない
+        self.db.insert_embedding(1, [0.1, 0.2])
+        self.db.insert_embeddings_batch([1], np.array([[0.1, 0.2]]))
+        self.assertEqual(self.db.get_embedding_generation(), generation)
+
+        # 本文の編集で埋め込みが削除されると進む
+        self.db.upsert_messages_batch([dict(message, content="編集後")])
+        self.assertGreater(self.db.get_embedding_generation(), generation)
+
+    def test_embedding_changes_since_generation(self):
+        """世代番号以降に追加・削除された埋め込みを取得できるかのテスト"""
+        messages = [
+            {
+                "id": i,
+                "channel_id": 111,
+                "channel_name": "general",
+                "author_id": 222,
+                "author_name": "TestUser",
+                "content": f"メッセージ{i}",
+                "created_at": datetime.now().isoformat(),
+                "timestamp": float(i),
+            }
+            for i in (1, 2)
+        ]
+        self.db.insert_messages_batch(messages)
+        self.db.insert_embedding(1, [0.1, 0.2])
+
+        generation = self.db.get_embedding_generation()
+        self.db.insert_embedding(2, [0.3, 0.4])
+        added = list(self.db.iter_embeddings(since_generation=generation))
+        self.assertEqual([row[0] for row in added], [2])
+        self.assertEqual(self.db.get_deleted_embedding_ids(generation), [])
+
+        # 本文の編集で削除された埋め込み
+        self.db.upsert_messages_batch([dict(messages[0], content="編集後")])
+        self.assertEqual(self.db.get_deleted_embedding_ids(generation), [1])
+
+        # メタデータの更新は、埋め込みを追加し直したものとして扱う
+        generation = self.db.get_embedding_generation()
+        self.db.update_message_metadata(2, importance=5)
+        self.assertGreater(self.db.get_embedding_generation(), generation)
+        added = list(
+            self.db.iter_embeddings(with_metadata=True, since_generation=generation)
+        )
+        self.assertEqual([(row[0], row[3][2]) for row in added], [(2, 5)])
+
     def test_get_messages_without_embeddings(self):
         """埋め込み未生成メッセージ取得のテスト"""
         # 3つのメッセージを挿入
@@ -267,6 +411,397 @@ class TestKnowledgeDB(unittest.TestCase):
         texts, embeddings = self.db.get_all_embeddings(category="A")
         self.assertEqual(len(texts), 1)
 
+    def test_embedding_binary_storage(self):
+        """埋め込みがfloat32バイナリで保存・復元されるかのテスト"""
+        message = {
+            "id": 1,
+            "channel_id": 111,
+            "channel_name": "general",
+            "author_id": 222,
+            "author_name": "TestUser",
+            "content": "テストメッセージ",
+            "created_at": datetime.now().isoformat(),
+            "timestamp": datetime.now().timestamp(),
+        }
+        self.db.insert_message(message)
+
+        vector = np.array([0.25, -0.5, 1.0, 2.0], dtype=np.float32)
+        self.db.insert_embedding(1, vector)
+
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT typeof(embedding_vector), dtype, dim FROM embeddings"
+            ).fetchone()
+        self.assertEqual(row, ("blob", "float32", 4))
+
+        texts, embeddings = self.db.get_all_embeddings()
+        self.assertEqual(texts, ["テストメッセージ"])
+        self.assertEqual(embeddings.dtype, np.float32)
+        np.testing.assert_array_equal(embeddings[0], vector)
+
+    def test_migrate_legacy_json_embeddings(self):
+        """旧形式（JSON）の埋め込みの変換と混在読み込みのテスト"""
+        messages = [
+            {
+                "id": i,
+                "channel_id": 111,
+                "channel_name": "general",
+                "author_id": 222,
+                "author_name": "TestUser",
+                "content": f"メッセージ {i}",
+                "created_at": datetime.now().isoformat(),
+                "timestamp": float(i),
+            }
+            for i in range(1, 4)
+        ]
+        self.db.insert_messages_batch(messages)
+
+        # 旧形式の行を直接書き込む
+        with sqlite3.connect(self.db_path) as conn:
+            for i in range(1, 3):
+                conn.execute(
+                    "INSERT INTO embeddings (message_id, embedding_vector) "
+                    "VALUES (?, ?)",
+                    (i, json.dumps([float(i), 0.5])),
+                )
+        self.db.insert_embedding(3, [3.0, 0.5])
+
+        # 変換前でも両形式を読み込める
+        self.assertEqual(self.db.count_legacy_embeddings(), 2)
+        _, before = self.db.get_all_embeddings()
+        self.assertEqual(before.shape, (3, 2))
+
+        migrated = self.db.migrate_embeddings_to_binary(batch_size=1)
+        self.assertEqual(migrated, 2)
+        self.assertEqual(self.db.count_legacy_embeddings(), 0)
+
+        texts, after = self.db.get_all_embeddings()
+        np.testing.assert_array_equal(before, after)
+        self.assertEqual(texts[0], "メッセージ 3")
+        np.testing.assert_array_equal(after[0], [3.0, 0.5])
+
+        # 再実行しても変換対象はない
+        self.assertEqual(self.db.migrate_embeddings_to_binary(), 0)
+
+    def test_persistent_connection(self):
+        """永続接続の再利用とclose()による解放のテスト"""
+        conn = self.db._get_connection()
+        self.assertIs(self.db._get_connection(), conn)
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(journal_mode.lower(), "wal")
+
+        # close()後も新しい接続で利用できる
+        self.db.close()
+        self.assertEqual(self.db.get_message_count(), 0)
+        self.assertIsNot(self.db._get_connection(), conn)
+
+    def test_context_manager_checkpoints_wal(self):
+        """with文の終了時に接続が閉じられWALが書き戻されるかのテスト"""
+        self.db.close()
+        message = {
+            "id": 1,
+            "channel_id": 111,
+            "channel_name": "general",
+            "author_id": 222,
+            "author_name": "TestUser",
+            "content": "テストメッセージ",
+            "created_at": datetime.now().isoformat(),
+            "timestamp": datetime.now().timestamp(),
+        }
+        with KnowledgeDB(self.db_path) as db:
+            db.insert_message(message)
+
+        self.assertFalse(os.path.exists(self.db_path + "-wal"))
+        with sqlite3.connect(self.db_path) as conn:
+            count = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        self.assertEqual(count, 1)
+
+    def test_streaming_iterators(self):
+        """ストリーミング取得APIのテスト"""
+        messages = [
+            {
+                "id": i,
+                "channel_id": 111,
+                "channel_name": "general",
+                "author_id": 222,
+                "author_name": "TestUser",
+                "content": f"メッセージ {i}",
+                "created_at": datetime.now().isoformat(),
+                "timestamp": float(i),
+                "category": "A" if i % 2 == 0 else "B",
+            }
+            for i in range(1, 8)
+        ]
+        self.db.insert_messages_batch(messages)
+
+        # ページサイズより多い件数でも全件を新しい順に返す
+        rows = list(self.db.iter_messages(page_size=3))
+        self.assertEqual([row[0] for row in rows], [7, 6, 5, 4, 3, 2, 1])
+        self.assertEqual(rows[0][5], "メッセージ 7")
+        self.assertEqual(
+            [row[0] for row in self.db.iter_messages(category="A", page_size=2)],
+            [6, 4, 2],
+        )
+
+        # 読み込みながら書き込んでも全件を1回ずつ返す
+        self.assertEqual(self.db.get_pending_embedding_count(), 7)
+        pending_ids = []
+        for message_id, content in self.db.iter_pending_embeddings(page_size=2):
+            pending_ids.append(message_id)
+            self.db.insert_embedding(message_id, [float(message_id), 0.0])
+        self.assertEqual(pending_ids, [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(self.db.get_pending_embedding_count(), 0)
+
+        embeddings = list(self.db.iter_embeddings(category="B", page_size=2))
+        self.assertEqual([row[0] for row in embeddings], [7, 5, 3, 1])
+        self.assertEqual(embeddings[0][1], "メッセージ 7")
+        np.testing.assert_array_equal(embeddings[0][2], [7.0, 0.0])
+
+    def test_search_text(self):
+        """全文検索（FTS5）のテスト"""
+        contents = [
+            "ビルドでModuleNotFoundErrorが発生しました",
+            "https://example.com/docs を参照してください",
+            "エラーの原因はキャッシュでした",
+            "キャッシュを削除したら直りました",
+            "100%_完了",
+        ]
+        messages = [
+            {
+                "id": i,
+                "channel_id": 111 if i < 4 else 333,
+                "channel_name": "general",
+                "author_id": 222,
+                "author_name": "TestUser",
+                "content": content,
+                "created_at": datetime.now().isoformat(),
+                "timestamp": float(i),
+                "importance": i,
+            }
+            for i, content in enumerate(contents, start=1)
+        ]
+        self.db.insert_messages_batch(messages)
+        self.assertTrue(self.db.fts_enabled)
+
+        # エラー文字列・URL・日本語の部分一致
+        self.assertEqual(
+            [mid for mid, _ in self.db.search_text("modulenotfounderror")], [1]
+        )
+        self.assertEqual(
+            [mid for mid, _ in self.db.search_text("example.com/docs")], [2]
+        )
+        results = self.db.search_text("キャッシュ")
+        self.assertEqual(sorted(mid for mid, _ in results), [3, 4])
+        self.assertTrue(all(score > 0 for _, score in results))
+
+        # 複数語はAND検索、2文字以下の語は部分一致で絞り込む
+        self.assertEqual([mid for mid, _ in self.db.search_text("キャッシュ 原因")], [3])
+        self.assertEqual(self.db.search_text("原因"), [(3, 0.0)])
+        self.assertEqual([mid for mid, _ in self.db.search_text("%_")], [5])
+
+        # OR検索は3文字ずつの断片に分けて照合し、多く一致するほど上位
+        results = self.db.search_text("キャッシュの原因を教えて", match_all=False)
+        self.assertEqual([mid for mid, _ in results], [3, 4])
+        self.assertEqual(self.db.search_text("教えて", match_all=False), [])
+        results = self.db.search_text("原因 直り", match_all=False)
+        self.assertEqual(sorted(mid for mid, _ in results), [3, 4])
+        self.assertEqual(self.db.get_message_contents([4, 99]), {4: "キャッシュを削除したら直りました"})
+
+        # 絞り込み条件
+        results = self.db.search_text("キャッシュ", filters={"channel_id": 333})
+        self.assertEqual([mid for mid, _ in results], [4])
+        results = self.db.search_text("キャッシュ", filters={"until": 4.0})
+        self.assertEqual([mid for mid, _ in results], [3])
+        with self.assertRaises(ValueError):
+            self.db.search_text("キャッシュ", filters={"unknown": 1})
+
+        # 本文の編集が索引に反映される
+        self.db.upsert_messages_batch([dict(messages[3], content="再起動で直りました")])
+        self.assertEqual([mid for mid, _ in self.db.search_text("キャッシュ")], [3])
+        self.assertEqual(self.db.search_text(""), [])
+
+        # メッセージの削除が索引に反映される
+        conn = self.db._get_connection()
+        with conn:
+            conn.execute("DELETE FROM messages WHERE id = 3")
+        self.assertEqual(self.db.search_text("キャッシュ"), [])
+        self.assertEqual([mid for mid, _ in self.db.search_text("再起動")], [4])
+
+    def test_search_text_while_locked(self):
+        """他の接続が書き込み中でも全文検索が待たされないかのテスト"""
+        message = {
+            "id": 1,
+            "channel_id": 111,
+            "channel_name": "general",
+            "author_id": 222,
+            "author_name": "TestUser",
+            "content": "こんにちは、キャッシュを削除しました",
+            "created_at": datetime.now().isoformat(),
+            "timestamp": datetime.now().timestamp(),
+        }
+        self.db.insert_message(message)
+
+        writer = sqlite3.connect(self.db_path, isolation_level=None)
+        try:
+            writer.execute("BEGIN IMMEDIATE")
+            writer.execute("DELETE FROM messages WHERE id = 1")
+            self.db._get_connection().execute("PRAGMA busy_timeout = 0")
+            self.assertEqual([mid for mid, _ in self.db.search_text("こんにちは", 5)], [1])
+            results = self.db.search_text("キャッシュの削除", 5, match_all=False)
+            self.assertEqual([mid for mid, _ in results], [1])
+        finally:
+            writer.rollback()
+            writer.close()
+
+    def test_select_rare_terms_while_locked(self):
+        """他の接続が書き込み中でもOR検索の語の選択が待たされないかのテスト"""
+        message = {
+            "id": 1,
+            "channel_id": 111,
+            "channel_name": "general",
+            "author_id": 222,
+            "author_name": "TestUser",
+            "content": "キャッシュを削除しました",
+            "created_at": datetime.now().isoformat(),
+            "timestamp": datetime.now().timestamp(),
+        }
+        self.db.insert_message(message)
+
+        writer = sqlite3.connect(self.db_path, isolation_level=None)
+        try:
+            writer.execute("BEGIN IMMEDIATE")
+            self.db._get_connection().execute("PRAGMA busy_timeout = 0")
+            terms = self.db._select_rare_terms(["キャッ", "ャッシ", "存在し"])
+        finally:
+            writer.rollback()
+            writer.close()
+        self.assertEqual(sorted(terms), ["キャッ", "ャッシ"])
+
+    def test_search_text_index_rebuild(self):
+        """全文検索の索引がない既存DBで索引が構築されるかのテスト"""
+        message = {
+            "id": 1,
+            "channel_id": 111,
+            "channel_name": "general",
+            "author_id": 222,
+            "author_name": "TestUser",
+            "content": "既存のメッセージ",
+            "created_at": datetime.now().isoformat(),
+            "timestamp": datetime.now().timestamp(),
+        }
+        self.db.insert_message(message)
+        self.db.close()
+
+        # 索引導入前のDBを再現
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("DROP TABLE messages_fts")
+            conn.execute("DROP TRIGGER messages_fts_insert")
+
+        self.db = KnowledgeDB(self.db_path)
+        self.assertEqual([mid for mid, _ in self.db.search_text("メッセージ")], [1])
+
+    def test_search_text_pending_table_migration(self):
+        """反映待ちのテーブルを使う旧形式のDBで、未反映の行が索引に追加されるかのテスト"""
+        message = {
+            "id": 1,
+            "channel_id": 111,
+            "channel_name": "general",
+            "author_id": 222,
+            "author_name": "TestUser",
+            "content": "既存のメッセージ",
+            "created_at": datetime.now().isoformat(),
+            "timestamp": datetime.now().timestamp(),
+        }
+        self.db.insert_message(message)
+        self.db.close()
+
+        # 挿入時にIDだけを記録する旧形式のトリガーと未反映の行を再現
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("CREATE TABLE messages_fts_pending (id INTEGER PRIMARY KEY)")
+            conn.execute("DROP TRIGGER messages_fts_insert")
+            conn.execute(
+                """
+                CREATE TRIGGER messages_fts_insert
+                AFTER INSERT ON messages BEGIN
+                    INSERT OR IGNORE INTO messages_fts_pending(id) VALUES (new.id);
+                END
+            """
+            )
+            conn.execute(
+                "INSERT INTO messages (id, channel_id, channel_name, author_id, "
+                "author_name, content, created_at, timestamp) "
+                "VALUES (2, 111, 'general', 222, 'TestUser', '未反映のメッセージ', '', 2.0)"
+            )
+
+        self.db = KnowledgeDB(self.db_path)
+        results = self.db.search_text("メッセージ")
+        self.assertEqual(sorted(mid for mid, _ in results), [1, 2])
+
+        # 作り直したトリガーで索引が直接更新される
+        self.db.insert_message(dict(message, id=3, content="新しいメッセージ"))
+        results = self.db.search_text("メッセージ")
+        self.assertEqual(sorted(mid for mid, _ in results), [1, 2, 3])
+        conn = self.db._get_connection()
+        tables = conn.execute(
+            "SELECT name FROM sqlite_master WHERE name = 'messages_fts_pending'"
+        ).fetchall()
+        self.assertEqual(tables, [])
+
+    def test_channel_sync_state(self):
+        """チャンネルごとの取得済み位置のテスト"""
+        self.assertEqual(self.db.get_channel_sync_states(), {})
+
+        self.db.update_channel_sync_state(111, "general", 1000, 10.0)
+        self.db.update_channel_sync_state(333, "random", 500, 5.0)
+        states = self.db.get_channel_sync_states()
+        self.assertEqual(set(states), {111, 333})
+        self.assertEqual(states[111]["last_message_id"], 1000)
+        self.assertEqual(states[111]["last_timestamp"], 10.0)
+
+        # 位置は進む
+        self.db.update_channel_sync_state(111, "general", 2000, 20.0)
+        self.assertEqual(
+            self.db.get_channel_sync_states()[111]["last_message_id"], 2000
+        )
+
+        # 古い位置では後退しないが、チャンネル名は更新される
+        self.db.update_channel_sync_state(111, "general-renamed", 1500, 15.0)
+        state = self.db.get_channel_sync_states()[111]
+        self.assertEqual(state["last_message_id"], 2000)
+        self.assertEqual(state["last_timestamp"], 20.0)
+        self.assertEqual(state["channel_name"], "general-renamed")
+
+    def test_crawl_checkpoints(self):
+        """全履歴取得のチェックポイントのテスト"""
+        self.assertEqual(self.db.get_crawl_checkpoints(), {})
+
+        # 2つの範囲に分けて取得中
+        done = self.db.save_crawl_checkpoint(111, "general", 0, 500, 300, 999, 9.0)
+        self.assertFalse(done)
+        done = self.db.save_crawl_checkpoint(111, "general", 500, 1000, None, 999, 9.0)
+        self.assertFalse(done)
+
+        checkpoints = self.db.get_crawl_checkpoints()[111]
+        self.assertEqual([c["range_start"] for c in checkpoints], [0, 500])
+        self.assertEqual(checkpoints[0]["cursor"], 300)
+        self.assertIsNone(checkpoints[1]["cursor"])
+        self.assertFalse(checkpoints[0]["complete"])
+
+        # 片方の範囲が完了しても取得済み位置は記録されない
+        done = self.db.save_crawl_checkpoint(
+            111, "general", 500, 1000, 501, 999, 9.0, complete=True
+        )
+        self.assertFalse(done)
+        self.assertEqual(self.db.get_channel_sync_states(), {})
+
+        # 全範囲が完了すると取得済み位置を記録し、チェックポイントを削除
+        done = self.db.save_crawl_checkpoint(
+            111, "general", 0, 500, 1, 999, 9.0, complete=True
+        )
+        self.assertTrue(done)
+        self.assertEqual(self.db.get_crawl_checkpoints(), {})
+        self.assertEqual(self.db.get_channel_sync_states()[111]["last_message_id"], 999)
+
     def test_incremental_update(self):
         """増分更新のテスト"""
         # 初回: 100メッセージ挿入
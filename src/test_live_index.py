@@ -0,0 +1,245 @@
+"""
+知識データの差分更新機能のテスト
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+import live_index
+from embedding_index import (
+    EmbeddingIndex,
+    normalize_rows,
+    search_vectors,
+    write_embedding_index,
+)
+from knowledge_db import KnowledgeDB
+from live_index import IndexSnapshot, load_index_snapshot, refresh_snapshot
+from quantized_index import build_quantized_index
+
+
+def make_message(message_id, content, channel_id=111):
+    """テスト用のメッセージ"""
+    return {
+        "id": message_id,
+        "channel_id": channel_id,
+        "channel_name": f"channel-{channel_id}",
+        "author_id": 222,
+        "author_name": "TestUser",
+        "content": content,
+        "created_at": "2024-01-01T00:00:00",
+        "timestamp": float(message_id),
+    }
+
+
+class TestLiveIndex(unittest.TestCase):
+    """IndexSnapshotの差分更新のテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.index_dir = os.path.join(self.temp_dir, "embedding_index")
+        self.db = KnowledgeDB(os.path.join(self.temp_dir, "knowledge.db"))
+
+        self.db.insert_messages_batch(
+            [make_message(i, f"メッセージ {i}") for i in range(1, 6)]
+        )
+        self.db.insert_embeddings_batch(list(range(1, 6)), np.eye(5, 8))
+        write_embedding_index(self.db, self.index_dir)
+        self.snapshot = load_index_snapshot(self.db, self.index_dir)
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+
+    def search_ids(self, snapshot, query, top_k=3, filters=None):
+        """検索結果のメッセージIDのリスト"""
+        rows, _ = snapshot.search(query, top_k, snapshot.select_rows(filters))
+        return [snapshot.message_id(i) for i in rows]
+
+    def add_message(self, message_id, content, vector, channel_id=111):
+        """メッセージと埋め込みを追加"""
+        self.db.insert_messages_batch([make_message(message_id, content, channel_id)])
+        self.db.insert_embeddings_batch([message_id], np.array([vector]))
+
+    def test_refresh_adds_delta(self):
+        """追加された埋め込みだけが差分として反映されるかのテスト"""
+        self.assertIsNone(refresh_snapshot(self.db, self.snapshot, self.index_dir))
+
+        query = np.array([0, 0, 0, 0, 0, 1, 0, 0], dtype=np.float32)
+        self.add_message(6, "新しいメッセージ", query)
+        refreshed = refresh_snapshot(self.db, self.snapshot, self.index_dir)
+
+        self.assertEqual(len(refreshed), 6)
+        self.assertEqual(len(refreshed.delta_rows), 1)
+        self.assertIs(refreshed.index, self.snapshot.index)
+        self.assertEqual(self.search_ids(refreshed, query)[0], 6)
+        self.assertEqual(refreshed.text(refreshed.search(query, 1)[0][0]), "新しいメッセージ")
+
+        # 更新前の状態を参照している検索には影響しない
+        self.assertNotIn(6, self.search_ids(self.snapshot, query))
+        self.assertIsNone(refresh_snapshot(self.db, refreshed, self.index_dir))
+
+    def test_refresh_edited_message(self):
+        """本文の編集で削除・再生成された埋め込みが置き換わるかのテスト"""
+        query = np.array([0, 0, 1, 0, 0, 0, 0, 0], dtype=np.float32)
+        self.assertEqual(self.search_ids(self.snapshot, query)[0], 3)
+
+        # 編集で埋め込みが削除された状態
+        self.db.upsert_messages_batch([make_message(3, "編集後のメッセージ")])
+        refreshed = refresh_snapshot(self.db, self.snapshot, self.index_dir)
+        self.assertEqual(len(refreshed), 4)
+        self.assertNotIn(3, self.search_ids(refreshed, query, top_k=5))
+
+        # 埋め込みの再生成後
+        self.db.insert_embeddings_batch([3], np.array([query]))
+        refreshed = refresh_snapshot(self.db, refreshed, self.index_dir)
+        self.assertEqual(len(refreshed), 5)
+        rows, _ = refreshed.search(query, 5)
+        self.assertEqual(refreshed.message_id(rows[0]), 3)
+        self.assertEqual(refreshed.text(rows[0]), "編集後のメッセージ")
+        self.assertEqual(
+            [refreshed.message_id(i) for i in rows].count(3), 1, "古い行が残っている"
+        )
+
+    def test_refresh_reloads_rebuilt_index(self):
+        """埋め込みインデックスが作り直された場合は読み込み直すかのテスト"""
+        self.add_message(6, "新しいメッセージ", np.ones(8))
+        refreshed = refresh_snapshot(self.db, self.snapshot, self.index_dir)
+        self.assertEqual(len(refreshed.delta_rows), 1)
+
+        # DBの世代番号が変わらなくても、作り直したインデックスに置き換える
+        write_embedding_index(self.db, self.index_dir)
+        reloaded = refresh_snapshot(self.db, refreshed, self.index_dir)
+        self.assertEqual(len(reloaded), 6)
+        self.assertEqual(reloaded.delta_rows, [])
+        self.assertIsNot(reloaded.index, self.snapshot.index)
+        self.assertIsNone(refresh_snapshot(self.db, reloaded, self.index_dir))
+
+    def test_refresh_adds_built_indexes(self):
+        """埋め込みインデックスの読み込み後に作成された量子化インデックスを使うかのテスト"""
+        self.assertIsNone(self.snapshot.quantized_index)
+        build_quantized_index(self.snapshot.index, self.index_dir)
+
+        refreshed = refresh_snapshot(self.db, self.snapshot, self.index_dir)
+        self.assertIsNotNone(refreshed.quantized_index)
+        self.assertIs(refreshed.index, self.snapshot.index)
+        self.assertIsNone(refresh_snapshot(self.db, refreshed, self.index_dir))
+
+    def test_search_batch(self):
+        """差分と除く行を含めて、複数クエリの検索が1クエリずつの検索と一致するかのテスト"""
+        self.add_message(6, "新しいメッセージ", np.ones(8))
+        self.db.upsert_messages_batch([make_message(2, "編集後のメッセージ")])
+        refreshed = refresh_snapshot(self.db, self.snapshot, self.index_dir)
+
+        queries = np.vstack([np.eye(8)[:3], np.ones((1, 8))])
+        for filters in (None, {"channel_id": 111}):
+            selection = refreshed.select_rows(filters)
+            results = refreshed.search_batch(queries, 3, selection)
+            self.assertEqual(len(results), len(queries))
+            for query, (rows, scores) in zip(queries, results):
+                expected, expected_scores = refreshed.search(query, 3, selection)
+                self.assertEqual(list(rows), list(expected))
+                np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+                self.assertNotIn(2, [refreshed.message_id(i) for i in rows])
+
+    def test_vectors_for_ids(self):
+        """差分を含めてメッセージIDの埋め込みを取得するかのテスト"""
+        self.add_message(6, "新しいメッセージ", np.ones(8))
+        self.db.upsert_messages_batch([make_message(2, "編集後のメッセージ")])
+        refreshed = refresh_snapshot(self.db, self.snapshot, self.index_dir)
+
+        vectors = refreshed.vectors_for_ids([6, 2, 1, 99])
+        np.testing.assert_allclose(vectors[0], np.ones(8) / np.sqrt(8), rtol=1e-6)
+        # 埋め込みが削除されたメッセージと存在しないメッセージは0の行
+        np.testing.assert_array_equal(vectors[1], np.zeros(8))
+        np.testing.assert_array_equal(vectors[2], np.eye(8)[0])
+        np.testing.assert_array_equal(vectors[3], np.zeros(8))
+
+    def test_row_metadata(self):
+        """差分を含めて行の位置のタイムスタンプと重要度を取得するかのテスト"""
+        self.add_message(6, "新しいメッセージ", np.ones(8))
+        refreshed = refresh_snapshot(self.db, self.snapshot, self.index_dir)
+
+        rows, _ = refreshed.search(np.ones(8, dtype=np.float32), 6)
+        timestamps, importance = refreshed.row_metadata(rows)
+        self.assertEqual(
+            list(timestamps), [float(refreshed.message_id(i)) for i in rows]
+        )
+        self.assertEqual(list(importance), [0] * 6)
+
+    def test_filters_include_delta(self):
+        """絞り込み条件が差分の行にも適用されるかのテスト"""
+        self.add_message(6, "別チャンネルのメッセージ", np.ones(8), channel_id=333)
+        self.add_message(7, "同じチャンネルのメッセージ", np.ones(8))
+        refreshed = refresh_snapshot(self.db, self.snapshot, self.index_dir)
+
+        query = np.ones(8, dtype=np.float32)
+        self.assertEqual(
+            self.search_ids(refreshed, query, filters={"channel_id": 333}), [6]
+        )
+        self.assertNotIn(
+            6, self.search_ids(refreshed, query, top_k=10, filters={"channel_id": 111})
+        )
+
+
+class TestHiddenRows(unittest.TestCase):
+    """除く行が多い場合の検索のテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        rng = np.random.default_rng(0)
+        self.vectors = normalize_rows(rng.standard_normal((1000, 8)))
+        self.query = rng.standard_normal(8).astype(np.float32)
+        self.index = EmbeddingIndex(np.arange(1000), self.vectors, [""] * 1000, {})
+
+    def search_with_fetches(self, snapshot, top_k):
+        """検索結果と、埋め込みインデックスから取得した件数の並び"""
+        fetches = []
+
+        def spy(vectors, query, count, rows=None):
+            fetches.append(count)
+            return search_vectors(vectors, query, count, rows=rows)
+
+        with patch.object(live_index, "search_vectors", spy):
+            found, _ = snapshot.search(self.query, top_k)
+        return list(found), fetches
+
+    def expected(self, hidden, top_k):
+        """除く行以外の行の検索結果"""
+        rows = np.setdiff1d(np.arange(1000), hidden)
+        found, _ = search_vectors(self.vectors, self.query, top_k, rows=rows)
+        return list(found)
+
+    def test_fetch_is_bounded(self):
+        """除く行の数が増えても取得件数が増えないかのテスト"""
+        hidden = np.arange(0, 1000, 2)
+        snapshot = IndexSnapshot(self.index, hidden_rows=hidden)
+        found, fetches = self.search_with_fetches(snapshot, 5)
+
+        self.assertEqual(found, self.expected(hidden, 5))
+        self.assertEqual(fetches[0], 5 + live_index.MIN_HIDDEN_OVERFETCH)
+        self.assertLess(max(fetches), 100)
+
+    def test_fetch_grows_when_top_rows_hidden(self):
+        """上位の行が全て除く行の場合は取得し直すかのテスト"""
+        ranked, _ = search_vectors(self.vectors, self.query, 300)
+        hidden = np.sort(ranked[:200])
+        snapshot = IndexSnapshot(self.index, hidden_rows=hidden)
+        found, fetches = self.search_with_fetches(snapshot, 5)
+
+        self.assertEqual(found, self.expected(hidden, 5))
+        self.assertGreater(len(fetches), 1)
+        self.assertLessEqual(max(fetches), 5 + len(hidden))
+
+        results = snapshot.search_batch(np.vstack([self.query, self.vectors[0]]), 5)
+        self.assertEqual(list(results[0][0]), self.expected(hidden, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+Botのメッセージ処理のテスト
+"""
+
+import asyncio
+import importlib
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock, PropertyMock, patch
+
+import ai_chatbot
+
+
+class TestOnMessage(unittest.TestCase):
+    """main.on_messageのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        env = {"DISCORD_TOKEN": "test-token", "TARGET_GUILD_ID": "1"}
+        with patch.dict(os.environ, env):
+            self.main = importlib.import_module("main")
+        self.temp_file = tempfile.NamedTemporaryFile(suffix=".db")
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        self.temp_file.close()
+
+    def test_channel_mention_is_not_a_filter(self):
+        """チャンネルのメンションを含む質問も絞り込まずに検索するかのテスト"""
+        channel = SimpleNamespace(id=123, name="general", mention="<#123>")
+        message = SimpleNamespace(
+            author=SimpleNamespace(id=2),
+            content="!ask <#123> のデプロイ手順は？",
+            mentions=[],
+            channel_mentions=[channel],
+            channel=SimpleNamespace(send=AsyncMock()),
+        )
+        generate_response = Mock(return_value="回答")
+
+        with patch.multiple(
+            self.main, generate_response=generate_response, DB_PATH=self.temp_file.name
+        ), patch.object(
+            ai_chatbot, "ensure_initialized_with_callback", return_value=True
+        ), patch.object(
+            type(self.main.client),
+            "user",
+            new_callable=PropertyMock,
+            return_value=SimpleNamespace(id=99),
+        ):
+            asyncio.run(self.main.on_message(message))
+
+        generate_response.assert_called_once_with("<#123> のデプロイ手順は？")
+        message.channel.send.assert_awaited_once_with("回答")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+量子化インデックス機能のテスト
+"""
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ann_index import build_ann_index, load_ann_index
+from embedding_index import EmbeddingIndex, normalize_rows, search_vectors
+from quantized_index import (
+    build_quantized_index,
+    load_quantized_index,
+    quantize,
+    train_scales,
+)
+
+
+def make_index(vectors, generation=1):
+    """テスト用の埋め込みインデックス"""
+    ids = np.arange(1, len(vectors) + 1, dtype=np.int64)
+    manifest = {"count": len(vectors), "generation": generation}
+    return EmbeddingIndex(ids, vectors, None, manifest)
+
+
+class TestQuantizedIndex(unittest.TestCase):
+    """量子化インデックスの作成・検索のテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.index_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        vectors = normalize_rows(rng.standard_normal((3050, 64), dtype=np.float32))
+        self.vectors, self.queries = vectors[:3000], vectors[3000:]
+
+    def tearDown(self):
+        """各テスト後のクリーンアップ"""
+        shutil.rmtree(self.index_dir)
+
+    def test_quantize(self):
+        """量子化・復元の誤差がスケールの半分以内に収まるかのテスト"""
+        scales = train_scales(self.vectors)
+        codes = quantize(self.vectors, scales)
+        self.assertEqual(codes.dtype, np.int8)
+        self.assertLessEqual(np.abs(codes.astype(np.int32)).max(), 127)
+
+        restored = codes.astype(np.float32) * scales
+        inside = np.abs(self.vectors) <= scales * 127
+        error = np.abs(restored - self.vectors)
+        self.assertTrue(np.all((error <= scales / 2 + 1e-6) | ~inside))
+
+    def test_search_recall(self):
+        """候補の再計算によるrecall@kと類似度の正確さのテスト"""
+        index = make_index(self.vectors)
+        build_quantized_index(index, self.index_dir)
+        quantized = load_quantized_index(self.index_dir, index.manifest)
+        self.assertIsNotNone(quantized)
+        self.assertEqual(quantized.codes.shape, self.vectors.shape)
+
+        hits = 0
+        for query in self.queries:
+            exact, _ = search_vectors(self.vectors, query, 10)
+            found, scores = quantized.search(self.vectors, query, 10, candidates=50)
+            hits += len(set(exact) & set(found))
+            # 返す類似度はfloat32の行列で計算し直した値
+            np.testing.assert_allclose(scores, self.vectors[found] @ query, rtol=1e-5)
+        self.assertGreaterEqual(hits / (len(self.queries) * 10), 0.98)
+
+    def test_search_with_ann(self):
+        """ANNインデックスと組み合わせた検索のテスト"""
+        index = make_index(self.vectors)
+        build_ann_index(index, self.index_dir, nlist=8)
+        build_quantized_index(index, self.index_dir)
+        ann = load_ann_index(self.index_dir, index.manifest)
+        quantized = load_quantized_index(self.index_dir, index.manifest)
+
+        for query in self.queries[:10]:
+            expected, _ = ann.search(self.vectors, query, 5, nprobe=ann.nlist)
+            found, _ = ann.search(
+                self.vectors, query, 5, nprobe=ann.nlist, quantized=quantized
+            )
+            self.assertEqual(len(set(expected) & set(found)), 5)
+
+    def test_stale_index_not_loaded(self):
+        """埋め込みインデックスと対応していない量子化インデックスは読み込まないかのテスト"""
+        index = make_index(self.vectors)
+        build_quantized_index(index, self.index_dir)
+        self.assertIsNone(
+            load_quantized_index(self.index_dir, {"count": 3000, "generation": 2})
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+"""
+クエリ埋め込みキャッシュ機能のテスト
+"""
+
+import os
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from query_cache import QueryEmbeddingCache, get_query_cache_size, normalize_query
+
+
+class CountingEncoder:
+    """encodeの呼び出しを記録するテスト用のモデル"""
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, text):
+        self.calls.append(text)
+        return np.full(4, len(self.calls), dtype=np.float64)
+
+
+class BatchEncoder:
+    """文字列のリストをまとめて計算するテスト用のモデル"""
+
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts):
+        batch = [texts] if isinstance(texts, str) else list(texts)
+        self.batches.append(batch)
+        vectors = np.array([[len(self.batches), ord(text[0])] for text in batch])
+        return vectors[0] if isinstance(texts, str) else vectors
+
+
+class TestQueryEmbeddingCache(unittest.TestCase):
+    """QueryEmbeddingCacheのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.model = CountingEncoder()
+
+    def test_normalize_query(self):
+        """全角・大文字・空白の違いが同じキーになるかのテスト"""
+        self.assertEqual(normalize_query("  Ｐｙｔｈｏｎの\n使い方　"), "pythonの 使い方")
+        self.assertEqual(
+            normalize_query("Hello  World"), normalize_query("hello world")
+        )
+
+    def test_hits_and_misses(self):
+        """同じ質問ではモデルで計算し直さないかのテスト"""
+        cache = QueryEmbeddingCache(maxsize=8)
+        first = cache.encode(self.model, "Pythonの使い方")
+        second = cache.encode(self.model, "  pythonの使い方 ")
+
+        self.assertIs(first, second)
+        self.assertEqual(first.dtype, np.float32)
+        self.assertFalse(first.flags.writeable)
+        self.assertEqual(self.model.calls, ["Pythonの使い方"])
+        self.assertEqual(
+            cache.stats(),
+            {"size": 1, "maxsize": 8, "hits": 1, "misses": 1, "hit_rate": 0.5},
+        )
+
+    def test_encoder_receives_original_text(self):
+        """モデルには正規化する前の質問文を渡すかのテスト"""
+        cache = QueryEmbeddingCache(maxsize=8)
+        cache.encode(self.model, "ModuleNotFoundError　の対処")
+
+        model = BatchEncoder()
+        cache.encode_batch(model, ["ＡＰＩ の使い方", " api  の使い方", "Docker"])
+
+        self.assertEqual(self.model.calls, ["ModuleNotFoundError　の対処"])
+        self.assertEqual(model.batches, [["ＡＰＩ の使い方", "Docker"]])
+
+    def test_lru_eviction(self):
+        """上限を超えた場合に最も長く使われていない質問から破棄されるかのテスト"""
+        cache = QueryEmbeddingCache(maxsize=2)
+        cache.encode(self.model, "a")
+        cache.encode(self.model, "b")
+        cache.encode(self.model, "a")  # aを最近使ったものにする
+        cache.encode(self.model, "c")  # bが破棄される
+
+        self.assertEqual(len(cache), 2)
+        cache.encode(self.model, "a")
+        self.assertEqual(self.model.calls, ["a", "b", "c"])
+        cache.encode(self.model, "b")
+        self.assertEqual(self.model.calls, ["a", "b", "c", "b"])
+
+    def test_model_change(self):
+        """モデルが変わった場合に保持している埋め込みを破棄するかのテスト"""
+        cache = QueryEmbeddingCache(maxsize=8)
+        cache.encode(self.model, "質問")
+
+        other = CountingEncoder()
+        cache.encode(other, "質問")
+        self.assertEqual(other.calls, ["質問"])
+        self.assertEqual(len(cache), 1)
+
+    def test_encode_batch(self):
+        """キャッシュにないクエリだけを重複を除いて1回のバッチで計算するかのテスト"""
+        cache = QueryEmbeddingCache(maxsize=8)
+        cached = cache.encode(self.model, "a")
+
+        model = BatchEncoder()
+        cache.encode(model, "a")  # モデルの切り替え（aは計算し直す）
+        vectors = cache.encode_batch(model, ["A", "b", "c", " B "])
+
+        self.assertEqual(model.batches, [["a"], ["b", "c"]])
+        self.assertEqual(vectors.shape, (4, 2))
+        self.assertEqual(vectors.dtype, np.float32)
+        np.testing.assert_array_equal(vectors[1], vectors[3])
+        self.assertFalse(np.array_equal(vectors[0], cached))
+        # aの2回とバッチ内のb・c・bがミス（バッチ内の重複は1回だけ計算）
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 5)
+
+        # バッチで計算した埋め込みもキャッシュから取得する
+        np.testing.assert_array_equal(cache.encode(model, "c"), vectors[2])
+        self.assertEqual(len(model.batches), 2)
+        self.assertEqual(cache.encode_batch(model, []).shape[0], 0)
+
+    def test_disabled(self):
+        """上限0では保持しないかのテスト"""
+        cache = QueryEmbeddingCache(maxsize=0)
+        cache.encode(self.model, "質問")
+        cache.encode(self.model, "質問")
+        self.assertEqual(len(self.model.calls), 2)
+        self.assertEqual(len(cache), 0)
+
+        cache.clear()
+        self.assertEqual(cache.stats()["misses"], 0)
+
+    def test_cache_size_setting(self):
+        """環境変数QUERY_CACHE_SIZEの読み込みのテスト"""
+        with patch.dict(os.environ, {"QUERY_CACHE_SIZE": "16"}):
+            self.assertEqual(get_query_cache_size(), 16)
+        with patch.dict(os.environ, {"QUERY_CACHE_SIZE": ""}):
+            self.assertEqual(get_query_cache_size(), 256)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+検索結果の重み付け機能のテスト
+"""
+
+import os
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from embedding_index import NULL_IMPORTANCE
+from ranking_weights import (
+    SECONDS_PER_DAY,
+    get_importance_weight,
+    get_recency_half_life_days,
+    get_recency_weight,
+    rerank,
+    weight_scores,
+)
+
+
+class TestWeightScores(unittest.TestCase):
+    """weight_scores・rerankのテスト"""
+
+    def setUp(self):
+        """各テスト前の準備"""
+        self.now = 1_700_000_000.0
+
+    def test_recency_decay(self):
+        """新しさの重みが半減期ごとに半分になるかのテスト"""
+        timestamps = self.now - np.array([0, 30, 60, -10]) * SECONDS_PER_DAY
+        scores = weight_scores(
+            np.zeros(4), timestamps, np.zeros(4), self.now, 0.4, 30, 0.0
+        )
+        # 未来のタイムスタンプは経過0日として扱う
+        np.testing.assert_allclose(scores, [0.4, 0.2, 0.1, 0.4], rtol=1e-6)
+
+    def test_importance(self):
+        """重要度が0〜10に収められて加算されるかのテスト"""
+        importance = np.array([0, 5, 10, 20, NULL_IMPORTANCE], dtype=np.int32)
+        scores = weight_scores(
+            np.full(5, 0.5), np.zeros(5), importance, self.now, 0.0, 30, 0.2
+        )
+        np.testing.assert_allclose(scores, [0.5, 0.6, 0.7, 0.7, 0.5], rtol=1e-6)
+
+    def test_zero_weights(self):
+        """重みが0の場合はコサイン類似度のままかのテスト"""
+        similarity = np.array([0.3, 0.9], dtype=np.float32)
+        scores = weight_scores(
+            similarity, np.array([self.now, 0.0]), np.array([10, 0]), self.now, 0, 30, 0
+        )
+        np.testing.assert_array_equal(scores, similarity)
+
+    def test_rerank(self):
+        """重み付けしたスコアの高い順に並べ替えるかのテスト"""
+        rows = np.array([7, 3, 5])
+        similarity = np.array([0.80, 0.78, 0.60], dtype=np.float32)
+        timestamps = np.array([0.0, self.now, self.now])
+        importance = np.zeros(3, dtype=np.int32)
+
+        ranked, scores = rerank(
+            rows, similarity, timestamps, importance, self.now, 0.1, 30, 0.0
+        )
+        self.assertEqual(list(ranked), [3, 7, 5])
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+
+    def test_settings(self):
+        """環境変数の読み込みのテスト"""
+        env = {
+            "RECENCY_WEIGHT": "0.2",
+            "RECENCY_HALF_LIFE_DAYS": "30",
+            "IMPORTANCE_WEIGHT": "-1",
+        }
+        with patch.dict(os.environ, env):
+            self.assertEqual(get_recency_weight(), 0.2)
+            self.assertEqual(get_recency_half_life_days(), 30.0)
+            self.assertEqual(get_importance_weight(), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()